@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+# ----------------------------------------------------------------------------
+# Copyright (c) 2015--, The Horizomer Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+#
+# Benchmarks for the Distance Method (distance_method.py)
+#
+
+import sys
+import click
+import numpy
+import time
+from os.path import join, basename
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from distance_method import (
+    compute_distances,
+    compute_native_distances,
+    parse_phylip_alignment,
+    parse_phylip_distances,
+    DISTANCE_MODELS)
+
+
+def run_protdist(phy_msa_fp, scratch_dir):
+    """ Compute the distance matrix of an alignment with protdist.
+
+    Parameters
+    ----------
+    phy_msa_fp: string
+        filepath to PHYLIP alignment
+    scratch_dir: string
+        dirpath where to write the protdist command and output
+
+    Returns
+    -------
+    labels: list
+        sequence names in the order of the rows
+    distances: numpy.ndarray
+        square matrix of pairwise distances
+    """
+    phylip_fp = join(scratch_dir, "msa.dis")
+    open(phylip_fp, 'w').close()
+    phylip_command_fp = join(scratch_dir, "phylip_command.txt")
+    with open(phylip_command_fp, 'w') as phylip_command_f:
+        phylip_command_f.write('%s\nF\n%s\nR\nY\n' % (phy_msa_fp, phylip_fp))
+    compute_distances(phylip_command_fp=phylip_command_fp)
+    return parse_phylip_distances(phylip_fp)
+
+
+def _best_time(func, repeats):
+    """ Return the result of func and its fastest wall time over repeats.
+    """
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return result, best
+
+
+def benchmark_distance_engines(alignment_fps,
+                               model='jtt',
+                               repeats=3,
+                               protdist=True):
+    """ Compare the native distance engine with PHYLIP's protdist.
+
+    Parameters
+    ----------
+    alignment_fps: list
+        filepaths to PHYLIP alignments (ex. msa.phy files left by Clustalw in
+        the Distance Method's working directory)
+    model: string, optional
+        distance model of the native engine (see DISTANCE_MODELS)
+    repeats: integer, optional
+        number of timed runs per engine, the fastest is reported
+    protdist: boolean, optional
+        if False, only time the native engine
+
+    Returns
+    -------
+    results: list of dictionaries
+        one dictionary per alignment with its size, the time of each engine
+        and the agreement between the two distance matrices
+    """
+    results = []
+    scratch_dir = mkdtemp()
+    try:
+        for phy_msa_fp in alignment_fps:
+            labels, sequences = parse_phylip_alignment(phy_msa_fp)
+            result = {'alignment': basename(phy_msa_fp),
+                      'sequences': len(labels),
+                      'length': len(sequences[0]) if sequences else 0}
+            (_, native), result['native_s'] = _best_time(
+                lambda: compute_native_distances(phy_msa_fp, model=model),
+                repeats)
+            if protdist:
+                (_, reference), result['protdist_s'] = _best_time(
+                    lambda: run_protdist(phy_msa_fp, scratch_dir), repeats)
+                finite = numpy.isfinite(native) & numpy.isfinite(reference)
+                result['speedup'] = result['protdist_s'] / result['native_s']
+                result['max_abs_diff'] = float(
+                    numpy.max(numpy.abs(native - reference)[finite]))
+                result['pearson'] = float(numpy.corrcoef(
+                    native[finite], reference[finite])[0, 1])
+            results.append(result)
+    finally:
+        rmtree(scratch_dir)
+    return results
+
+
+@click.command()
+@click.argument('alignment-fps', required=True, nargs=-1,
+                type=click.Path(resolve_path=True, readable=True, exists=True,
+                                file_okay=True))
+@click.option('--distance-model', type=click.Choice(DISTANCE_MODELS),
+              required=False, default='jtt', show_default=True,
+              help="Distance model of the native distance engine")
+@click.option('--repeats', type=int, required=False, default=3,
+              show_default=True, help="Number of timed runs per engine")
+@click.option('--protdist/--no-protdist', default=True, show_default=True,
+              help="Also run PHYLIP's protdist (must be in $PATH)")
+def benchmark_distance_engines_main(alignment_fps,
+                                    distance_model,
+                                    repeats,
+                                    protdist):
+    """ Time the native distance engine against PHYLIP's protdist.
+    """
+    columns = ['alignment', 'sequences', 'length', 'native_s']
+    if protdist:
+        columns.extend(['protdist_s', 'speedup', 'max_abs_diff', 'pearson'])
+    sys.stdout.write("%s\n" % '\t'.join(columns))
+    for result in benchmark_distance_engines(alignment_fps=alignment_fps,
+                                             model=distance_model,
+                                             repeats=repeats,
+                                             protdist=protdist):
+        sys.stdout.write("%s\n" % '\t'.join(
+            str(result[column]) for column in columns))
+
+
+if __name__ == "__main__":
+    benchmark_distance_engines_main()
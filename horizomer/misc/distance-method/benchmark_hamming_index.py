@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+# ----------------------------------------------------------------------------
+# Copyright (c) 2015--, The Horizomer Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+#
+# Benchmark of the Hamming index of the species set clustering
+# (distance_method.py)
+#
+
+import sys
+import click
+import numpy
+import time
+
+from distance_method import (
+    HammingIndex,
+    hamming_distances,
+    popcount,
+    encode_species_set,
+    species_set_words)
+
+
+def simulate_species_sets(num_species,
+                          num_cores,
+                          num_candidates,
+                          num_lineages=20,
+                          core_rate=0.03,
+                          candidate_rate=0.005,
+                          seed=0):
+    """ Simulate the core and candidate species sets of a panel.
+
+    Parameters
+    ----------
+    num_species: integer
+        number of species of the panel
+    num_cores: integer
+        number of core species sets
+    num_candidates: integer
+        number of candidate species sets
+    num_lineages: integer, optional
+        number of random ancestral species sets the species sets derive from
+    core_rate: float, optional
+        probability of flipping every species of a core species set
+    candidate_rate: float, optional
+        probability of flipping every species of a candidate species set
+    seed: integer, optional
+        seed of the random number generator
+
+    Returns
+    -------
+    core_words: numpy.ndarray
+        uint64 array of shape (num_cores, words) (see species_set_words())
+    candidate_words: numpy.ndarray
+        uint64 array of shape (num_candidates, words)
+    """
+    rng = numpy.random.RandomState(seed)
+    lineages = rng.rand(num_lineages, num_species) < 0.5
+
+    def derive(count, rate):
+        species_sets = lineages[rng.randint(num_lineages, size=count)] ^ (
+            rng.rand(count, num_species) < rate)
+        return species_set_words([encode_species_set(
+            ''.join('I' if bit else 'O' for bit in species_set))
+            for species_set in species_sets])
+    return derive(num_cores, core_rate), derive(num_candidates,
+                                                candidate_rate)
+
+
+def brute_force_clusters(core_words, candidate_words, radius, chunk_size):
+    """ Core of every candidate by comparing it to all cores.
+
+    Returns
+    -------
+    numpy.ndarray
+        index of the first core within radius of every candidate, or of its
+        nearest core (first one on ties)
+    """
+    clusters = numpy.empty(shape=len(candidate_words), dtype=int)
+    for start in range(0, len(candidate_words), chunk_size):
+        distances = hamming_distances(core_words,
+                                      candidate_words[start:start+chunk_size])
+        is_within = distances <= radius
+        clusters[start:start+chunk_size] = numpy.where(
+            is_within.any(axis=0), is_within.argmax(axis=0),
+            distances.argmin(axis=0))
+    return clusters
+
+
+def index_clusters(core_words, candidate_words, radius, chunk_size):
+    """ Core of every candidate looked up in a HammingIndex.
+
+    Returns
+    -------
+    numpy.ndarray
+        same as brute_force_clusters()
+    """
+    index = HammingIndex(core_words, radius)
+    clusters = numpy.empty(shape=len(candidate_words), dtype=int)
+    for start in range(0, len(candidate_words), chunk_size):
+        clusters[start:start+chunk_size] = index.first_within(
+            candidate_words[start:start+chunk_size])
+    far = clusters < 0
+    if far.any():
+        clusters[far] = index.nearest(candidate_words[far], chunk_size)[0]
+    return clusters
+
+
+def _best_time(func, repeats):
+    """ Return the result of func and its fastest wall time over repeats.
+    """
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return result, best
+
+
+def benchmark_hamming_index(num_species,
+                            num_cores,
+                            num_candidates,
+                            radii,
+                            chunk_size=4096,
+                            repeats=3,
+                            seed=0):
+    """ Compare the Hamming index with the brute force clustering.
+
+    Parameters
+    ----------
+    num_species: list of integers
+        numbers of species of the simulated panels
+    num_cores: list of integers
+        numbers of core species sets of the simulated panels
+    num_candidates: integer
+        number of candidate species sets of every panel
+    radii: list of integers
+        Hamming distances of the clustering (see cluster_distances())
+    chunk_size: integer, optional
+        number of candidates compared to all cores at once
+    repeats: integer, optional
+        number of timed runs per method, the fastest is reported
+    seed: integer, optional
+        seed of the simulations
+
+    Returns
+    -------
+    results: list of dictionaries
+        one dictionary per panel and radius with the time of each method,
+        the number of candidates beyond radius of every core and whether both
+        methods assigned every candidate to the same core
+    """
+    results = []
+    for species in num_species:
+        for cores in num_cores:
+            core_words, candidate_words = simulate_species_sets(
+                species, cores, num_candidates, seed=seed)
+            for radius in radii:
+                result = {'species': species, 'cores': cores,
+                          'candidates': num_candidates, 'radius': radius}
+                expected, result['brute_force_s'] = _best_time(
+                    lambda: brute_force_clusters(
+                        core_words, candidate_words, radius, chunk_size),
+                    repeats)
+                observed, result['index_s'] = _best_time(
+                    lambda: index_clusters(
+                        core_words, candidate_words, radius, chunk_size),
+                    repeats)
+                result['nearest'] = int((popcount(
+                    core_words[observed] ^ candidate_words).sum(axis=-1) >
+                    radius).sum())
+                result['speedup'] = result['brute_force_s'] / result['index_s']
+                result['agree'] = bool((observed == expected).all())
+                results.append(result)
+    return results
+
+
+@click.command()
+@click.option('--num-species', type=int, multiple=True, required=False,
+              default=[200, 1000], show_default=True,
+              help="Number of species of a simulated panel (repeatable)")
+@click.option('--num-cores', type=int, multiple=True, required=False,
+              default=[200, 2000], show_default=True,
+              help="Number of core species sets (repeatable)")
+@click.option('--num-candidates', type=int, required=False, default=20000,
+              show_default=True, help="Number of candidate species sets")
+@click.option('--hamming-distance', type=int, multiple=True, required=False,
+              default=[2, 10], show_default=True,
+              help="Hamming distance of the clustering (repeatable)")
+@click.option('--chunk-size', type=int, required=False, default=4096,
+              show_default=True,
+              help="Number of candidates compared to all cores at once")
+@click.option('--repeats', type=int, required=False, default=3,
+              show_default=True, help="Number of timed runs per method")
+@click.option('--seed', type=int, required=False, default=0,
+              show_default=True, help="Seed of the simulations")
+def benchmark_hamming_index_main(num_species,
+                                 num_cores,
+                                 num_candidates,
+                                 hamming_distance,
+                                 chunk_size,
+                                 repeats,
+                                 seed):
+    """ Time the Hamming index against the brute force clustering.
+    """
+    columns = ['species', 'cores', 'candidates', 'radius', 'nearest',
+               'brute_force_s', 'index_s', 'speedup', 'agree']
+    sys.stdout.write("%s\n" % '\t'.join(columns))
+    for result in benchmark_hamming_index(num_species=num_species,
+                                          num_cores=num_cores,
+                                          num_candidates=num_candidates,
+                                          radii=hamming_distance,
+                                          chunk_size=chunk_size,
+                                          repeats=repeats,
+                                          seed=seed):
+        sys.stdout.write("%s\n" % '\t'.join(
+            str(result[column]) for column in columns))
+
+
+if __name__ == "__main__":
+    benchmark_hamming_index_main()
@@ -0,0 +1,493 @@
+#!/usr/bin/env python
+
+# ----------------------------------------------------------------------------
+# Copyright (c) 2015--, The Horizomer Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+#
+# Scaling benchmarks of the Distance Method (distance_method.py) on seeded
+# synthetic reference panels
+#
+
+import sys
+import json
+import time
+import platform
+import click
+import numpy
+from shutil import rmtree, which
+from tempfile import mkdtemp
+from os import mkdir
+from os.path import join, exists, isdir
+
+from distance_method import (
+    AMINO_ACIDS,
+    encode_species_set,
+    preprocess_data,
+    parse_blast,
+    normalize_distances,
+    cluster_distances,
+    detect_outlier_genes,
+    distance_method)
+from benchmark_distance_method import _best_time
+
+
+# stages timed by benchmark_scaling(), in the order they run
+SCALING_STAGES = ('preprocess_data', 'parse_blast', 'normalize_distances',
+                  'cluster_distances', 'detect_outlier_genes', 'end_to_end')
+
+
+def _mutate(sequence, probabilities, gene_of_residue, alphabet, rng):
+    """ Substitute every residue with the probability of its gene.
+    """
+    mutated = rng.random(len(sequence)) < probabilities[gene_of_residue]
+    return numpy.where(
+        mutated, alphabet[rng.integers(0, len(alphabet), len(sequence))],
+        sequence)
+
+
+def generate_synthetic_panel(output_dir,
+                             num_species,
+                             num_genes,
+                             seed=0,
+                             min_length=80,
+                             max_length=200,
+                             presence=0.8,
+                             hgt_fraction=0.02,
+                             max_families=None):
+    """ Generate a seeded synthetic panel of proteomes, hits and distances.
+
+    Parameters
+    ----------
+    output_dir: string
+        dirpath where the panel is written (created if it does not exist)
+    num_species: integer
+        number of reference species (at least 2), species 0 is the query
+        genome
+    num_genes: integer
+        number of genes of the query genome
+    seed: integer, optional
+        seed of the random generator, the same seed gives the same panel
+    min_length: integer, optional
+        minimum length of a protein
+    max_length: integer, optional
+        maximum length of a protein
+    presence: float, optional
+        probability that a species carries a homolog of a query gene
+    hgt_fraction: float, optional
+        fraction of query genes transferred from another species
+    max_families: integer, optional
+        number of gene families (the first query genes) with a PHYLIP
+        distance matrix (default: all)
+
+    Returns
+    -------
+    dictionary
+        'target_proteomes_dir' (species_<iiii>.faa per species),
+        'query_proteome_fp' (the proteome of species 0), 'alignments_fp'
+        (query vs. all species hits in BLAST tabular format), 'family_fps'
+        (PHYLIP distance matrices, as output by protdist), 'species_sets'
+        (encoded species set of every query gene), 'hgt_genes' (labels of the
+        transferred query genes) and 'hits' (number of alignments)
+
+    Notes
+    -----
+        Proteins evolve along a star tree without indels: every species has a
+        branch length, every gene a rate, and each residue of a species is
+        substituted with probability 1 - exp(-branch * rate). A transferred
+        query gene is a copy of the gene of a random donor species with a
+        short branch. The percent identity of the hits is computed from the
+        sequences, the family distances are the tree distances with 5% of
+        multiplicative noise.
+    """
+    if num_species < 2:
+        raise ValueError("At least 2 species are required: %s" % num_species)
+    rng = numpy.random.default_rng(seed)
+    alphabet = numpy.frombuffer(AMINO_ACIDS.encode('ascii'), dtype=numpy.uint8)
+    branches = rng.uniform(0.05, 0.6, size=num_species)
+    rates = rng.gamma(shape=2.0, scale=0.5, size=num_genes)
+    lengths = rng.integers(min_length, max_length + 1, size=num_genes)
+    offsets = numpy.zeros(shape=num_genes + 1, dtype=numpy.int64)
+    numpy.cumsum(lengths, out=offsets[1:])
+    gene_of_residue = numpy.repeat(numpy.arange(num_genes), lengths)
+    present = rng.random(size=(num_species, num_genes)) < presence
+    hgt = rng.random(size=num_genes) < hgt_fraction
+    donors = rng.integers(1, num_species, size=num_genes)
+    present[0] = True
+    present[donors[hgt], numpy.flatnonzero(hgt)] = True
+    # index of every gene in the proteome of every species (pseudo names)
+    ranks = numpy.cumsum(present, axis=1) - 1
+    ancestral = alphabet[rng.integers(0, len(alphabet), size=offsets[-1])]
+
+    def species_sequences(species):
+        # every species has its own stream so it can be regenerated alone
+        species_rng = numpy.random.default_rng([seed, species])
+        return _mutate(ancestral, 1 - numpy.exp(-branches[species] * rates),
+                       gene_of_residue, alphabet, species_rng)
+
+    query = species_sequences(0)
+    transfer_rng = numpy.random.default_rng([seed, num_species])
+    for donor in numpy.unique(donors[hgt]):
+        genes = numpy.flatnonzero(hgt & (donors == donor))
+        residues = numpy.concatenate(
+            [numpy.arange(offsets[g], offsets[g+1]) for g in genes])
+        query[residues] = _mutate(
+            species_sequences(donor)[residues],
+            numpy.full(shape=num_genes, fill_value=1 - numpy.exp(-0.02)),
+            gene_of_residue[residues], alphabet, transfer_rng)
+
+    target_proteomes_dir = join(output_dir, "proteomes")
+    for dirpath in (output_dir, target_proteomes_dir):
+        if not isdir(dirpath):
+            mkdir(dirpath)
+    alignments_fp = join(output_dir, "alignments.m8")
+    hits = 0
+    with open(alignments_fp, 'w') as alignments_f:
+        for species in range(num_species):
+            sequences = query if species == 0 else species_sequences(species)
+            genes = numpy.flatnonzero(present[species])
+            identical = numpy.add.reduceat(sequences == query, offsets[:-1])
+            data = sequences.tobytes().decode('ascii')
+            with open(join(target_proteomes_dir,
+                           "species_%04d.faa" % species), 'w') as proteome_f:
+                proteome_f.write(''.join(
+                    ">G%s_SP%s\n%s\n" % (g, species,
+                                         data[offsets[g]:offsets[g+1]])
+                    for g in genes))
+            # qseqid sseqid pident length mismatch gapopen qstart qend sstart
+            # send evalue bitscore qcovs
+            bitscores = 2.0 * identical
+            alignments_f.write(''.join(
+                "G%s_SP0\tG%s_SP%s\t%.2f\t%s\t%s\t0\t1\t%s\t1\t%s\t%.2g\t%.1f"
+                "\t100\n" % (g, g, species,
+                             100.0 * identical[g] / lengths[g], lengths[g],
+                             lengths[g] - identical[g], lengths[g],
+                             lengths[g], 10 ** -min(bitscores[g] / 10, 300),
+                             bitscores[g])
+                for g in genes))
+            hits += len(genes)
+
+    families_dir = join(output_dir, "families")
+    if not isdir(families_dir):
+        mkdir(families_dir)
+    family_fps = []
+    num_families = num_genes if max_families is None else min(
+        num_genes, max_families)
+    for g in range(num_families):
+        species = numpy.flatnonzero(present[:, g])
+        tree = (branches[species][:, None] + branches[species][None, :]) * (
+            rates[g])
+        if hgt[g]:
+            donor = numpy.flatnonzero(species == donors[g])[0]
+            tree[0] = tree[donor] + 0.02 * rates[g]
+            tree[:, 0] = tree[0]
+            tree[0, donor] = tree[donor, 0] = 0.02 * rates[g]
+        noise = rng.lognormal(mean=0.0, sigma=0.05, size=tree.shape)
+        distances = tree * numpy.sqrt(noise * noise.T)
+        numpy.fill_diagonal(distances, 0.0)
+        family_fp = join(families_dir, "family_%s.dis" % g)
+        with open(family_fp, 'w') as family_f:
+            family_f.write("%5d\n" % len(species))
+            for s, row in zip(species, distances):
+                family_f.write("%-10s%s\n" % (
+                    "%s_%s" % (s, ranks[s, g]),
+                    ''.join("  %.6f" % x for x in row)))
+        family_fps.append(family_fp)
+
+    return {'target_proteomes_dir': target_proteomes_dir,
+            'query_proteome_fp': join(target_proteomes_dir,
+                                      "species_0000.faa"),
+            'alignments_fp': alignments_fp,
+            'family_fps': family_fps,
+            'species_sets': [encode_species_set(column)
+                             for column in present.T],
+            'hgt_genes': ["G%s_SP0" % g for g in numpy.flatnonzero(hgt)],
+            'hits': hits}
+
+
+def benchmark_scaling(num_species,
+                      num_genes,
+                      working_dir,
+                      seed=0,
+                      repeats=3,
+                      max_tensor_mb=1024,
+                      end_to_end=True,
+                      jobs=1,
+                      species_set_size=30,
+                      hamming_distance=2):
+    """ Time the Distance Method stages on a synthetic panel.
+
+    Parameters
+    ----------
+    num_species: integer
+        number of reference species
+    num_genes: integer
+        number of query genes
+    working_dir: string
+        dirpath where the panel is generated and the end-to-end run works
+    seed: integer, optional
+        seed of the panel (see generate_synthetic_panel())
+    repeats: integer, optional
+        number of timed runs per stage, the fastest is reported
+    max_tensor_mb: integer, optional
+        maximum size in megabytes of the full distance matrix timed by
+        normalize_distances and detect_outlier_genes, which bounds their
+        number of gene families (the matrix grows as genes x species^2)
+    end_to_end: boolean, optional
+        if True, also time distance_method() on the tabular alignments with
+        the native distance engine (Clustalw must be in $PATH)
+    jobs: integer, optional
+        number of gene families processed in parallel by the end-to-end run
+    species_set_size: integer, optional
+        species_set_size of cluster_distances()
+    hamming_distance: integer, optional
+        hamming_distance of cluster_distances()
+
+    Returns
+    -------
+    dictionary
+        the panel size, the number of hits and of gene families in the full
+        distance matrix, and the best time of every stage in SCALING_STAGES
+        (None for a stage that was skipped)
+    """
+    tensor_genes = max(1, min(num_genes, int(
+        max_tensor_mb * 2 ** 20 // (8 * num_species ** 2))))
+    panel = generate_synthetic_panel(output_dir=working_dir,
+                                     num_species=num_species,
+                                     num_genes=num_genes,
+                                     seed=seed,
+                                     max_families=tensor_genes)
+    timings = dict.fromkeys(SCALING_STAGES)
+
+    (gene_map, _, _), timings['preprocess_data'] = _best_time(
+        lambda: preprocess_data(
+            working_dir=working_dir,
+            target_proteomes_dir=panel['target_proteomes_dir'],
+            extensions=['faa']),
+        repeats)
+    _, timings['parse_blast'] = _best_time(
+        lambda: parse_blast(alignments_fps=panel['alignments_fp'],
+                            gene_map=gene_map),
+        repeats)
+
+    full_distance_matrix = numpy.zeros(
+        shape=(tensor_genes, num_species, num_species))
+
+    def normalize_all():
+        species_set_dict = {}
+        gene_bitvector_map = {}
+        for i, family_fp in enumerate(panel['family_fps']):
+            normalize_distances(
+                phylip_fp=family_fp,
+                full_distance_matrix=full_distance_matrix,
+                num_species=num_species,
+                full_distance_matrix_offset=i,
+                species_set_dict=species_set_dict,
+                gene_bitvector_map=gene_bitvector_map)
+        return gene_bitvector_map
+    gene_bitvector_map, timings['normalize_distances'] = _best_time(
+        normalize_all, repeats)
+
+    # the species sets of all query genes, not only those of the matrix
+    species_set_dict = {}
+    for species_set in panel['species_sets']:
+        species_set_dict[species_set] = species_set_dict.get(
+            species_set, 0) + 1
+    _, timings['cluster_distances'] = _best_time(
+        lambda: cluster_distances(species_set_dict=species_set_dict,
+                                  species_set_size=species_set_size,
+                                  hamming_distance=hamming_distance),
+        repeats)
+    _, timings['detect_outlier_genes'] = _best_time(
+        lambda: detect_outlier_genes(
+            species_set=[],
+            gene_bitvector_map=gene_bitvector_map,
+            full_distance_matrix=full_distance_matrix,
+            stdev_offset=2.326,
+            outlier_hgt=0.5,
+            num_species=num_species,
+            total_genes=tensor_genes),
+        repeats)
+
+    skipped = None
+    if not end_to_end:
+        skipped = "disabled"
+    elif which("clustalw") is None:
+        skipped = "clustalw not found"
+    else:
+        run_dir = join(working_dir, "end_to_end")
+        _, timings['end_to_end'] = _best_time(
+            lambda: distance_method(
+                query_proteome_fp=panel['query_proteome_fp'],
+                target_proteomes_dir=panel['target_proteomes_dir'],
+                working_dir=run_dir,
+                output_hgt_fp=join(working_dir, "hgt.txt"),
+                align_software='diamond',
+                tabular_alignments_fp=panel['alignments_fp'],
+                ext=['faa'],
+                species_set_size=species_set_size,
+                hamming_distance=hamming_distance,
+                jobs=jobs,
+                distance_engine='native',
+                resume=False,
+                report=False),
+            1)
+    return {'num_species': num_species,
+            'num_genes': num_genes,
+            'seed': seed,
+            'hits': panel['hits'],
+            'tensor_genes': tensor_genes,
+            'end_to_end_skipped': skipped,
+            'timings': timings}
+
+
+def update_history(history_fp, results, label=None, threshold=1.2):
+    """ Append benchmark results to a JSON history and compare them.
+
+    Parameters
+    ----------
+    history_fp: string
+        filepath to the JSON history (a list of runs, created if it does not
+        exist)
+    results: list of dictionaries
+        results of benchmark_scaling()
+    label: string, optional
+        label of the run (ex. a commit or a branch name)
+    threshold: float, optional
+        ratio to the previous time above which a stage is flagged as a
+        regression
+
+    Returns
+    -------
+    list of dictionaries
+        one row per panel size and stage with its time, the time of the
+        latest previous run with the same panel (size and seed), their ratio
+        and whether it is a regression
+    """
+    history = []
+    if exists(history_fp):
+        with open(history_fp, 'r') as history_f:
+            history = json.load(history_f)
+    rows = []
+    for result in results:
+        previous = None
+        for run in reversed(history):
+            for old in run['results']:
+                if all(old[key] == result[key] for key in (
+                        'num_species', 'num_genes', 'seed', 'tensor_genes')):
+                    previous = old
+                    break
+            if previous is not None:
+                break
+        for stage in SCALING_STAGES:
+            seconds = result['timings'][stage]
+            old_seconds = (None if previous is None
+                           else previous['timings'].get(stage))
+            ratio = None
+            if seconds is not None and old_seconds:
+                ratio = seconds / old_seconds
+            rows.append({'num_species': result['num_species'],
+                         'num_genes': result['num_genes'],
+                         'stage': stage,
+                         'seconds': seconds,
+                         'previous_seconds': old_seconds,
+                         'ratio': ratio,
+                         'regression': (ratio is not None and
+                                        ratio > threshold)})
+    history.append({'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'label': label,
+                    'host': platform.node(),
+                    'python': platform.python_version(),
+                    'numpy': numpy.__version__,
+                    'results': results})
+    with open(history_fp, 'w') as history_f:
+        json.dump(history, history_f, indent=2)
+        history_f.write('\n')
+    return rows
+
+
+@click.command()
+@click.option('--num-species', type=click.IntRange(10, 2000), multiple=True,
+              default=[10, 100], show_default=True,
+              help="Number of reference species (several values run a "
+                   "sweep)")
+@click.option('--num-genes', type=click.IntRange(100, 20000), multiple=True,
+              default=[100, 1000], show_default=True,
+              help="Number of query genes (several values run a sweep)")
+@click.option('--seed', type=int, required=False, default=0,
+              show_default=True, help="Seed of the synthetic panels")
+@click.option('--repeats', type=int, required=False, default=3,
+              show_default=True, help="Number of timed runs per stage")
+@click.option('--max-tensor-mb', type=int, required=False, default=1024,
+              show_default=True, help="Maximum size of the full distance "
+                                      "matrix of the normalization and "
+                                      "outlier detection stages")
+@click.option('--end-to-end/--no-end-to-end', default=True,
+              show_default=True, help="Also time distance_method() on the "
+                                      "tabular alignments (needs Clustalw)")
+@click.option('--jobs', type=int, required=False, default=1,
+              show_default=True, help="Number of gene families processed in "
+                                      "parallel by the end-to-end run")
+@click.option('--history-fp', required=False,
+              default='benchmark_history.json', show_default=True,
+              type=click.Path(resolve_path=True, file_okay=True),
+              help="JSON history the results are appended to")
+@click.option('--label', type=str, required=False, default=None,
+              help="Label of the run in the history")
+@click.option('--threshold', type=float, required=False, default=1.2,
+              show_default=True, help="Slowdown ratio flagged as a "
+                                      "regression")
+@click.option('--keep-dir', required=False, default=None,
+              type=click.Path(resolve_path=True, file_okay=False),
+              help="Directory where the panels are kept (default: a "
+                   "temporary directory removed at the end)")
+def benchmark_scaling_main(num_species,
+                           num_genes,
+                           seed,
+                           repeats,
+                           max_tensor_mb,
+                           end_to_end,
+                           jobs,
+                           history_fp,
+                           label,
+                           threshold,
+                           keep_dir):
+    """ Time the Distance Method stages on synthetic panels of growing size.
+    """
+    base_dir = keep_dir or mkdtemp()
+    if not isdir(base_dir):
+        mkdir(base_dir)
+    results = []
+    try:
+        for species in num_species:
+            for genes in num_genes:
+                results.append(benchmark_scaling(
+                    num_species=species,
+                    num_genes=genes,
+                    working_dir=join(base_dir, "panel_%s_%s_%s" % (
+                        species, genes, seed)),
+                    seed=seed,
+                    repeats=repeats,
+                    max_tensor_mb=max_tensor_mb,
+                    end_to_end=end_to_end,
+                    jobs=jobs))
+    finally:
+        if keep_dir is None:
+            rmtree(base_dir)
+    columns = ['num_species', 'num_genes', 'stage', 'seconds',
+               'previous_seconds', 'ratio', 'regression']
+    sys.stdout.write("%s\n" % '\t'.join(columns))
+    for row in update_history(history_fp=history_fp,
+                              results=results,
+                              label=label,
+                              threshold=threshold):
+        sys.stdout.write("%s\n" % '\t'.join(
+            str(row[column]) for column in columns))
+
+
+if __name__ == "__main__":
+    benchmark_scaling_main()
@@ -40,31 +40,419 @@
 #    Requires protdist version 3.696
 #
 
+import os
 import sys
+import time
 import click
 import numpy
-import operator
+import pandas as pd
+import asyncio
+import signal
+import resource
 import threading
 import subprocess
 import traceback
 import shlex
+import hashlib
+import json
+from shutil import copyfileobj, move, rmtree, which
+from collections import namedtuple
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from inspect import signature
+from multiprocessing import Pool
+from numpy.lib.format import open_memmap
 from os.path import join, basename, isdir, exists, getsize
-from os import mkdir
+from os import (mkdir, getpid, makedirs, replace, remove, utime, walk, stat,
+                listdir)
 
 from glob import glob
 
 import skbio.io
 
+import distance_method_kernels as kernels
+
+
+# run the inner loops of distance_method_kernels instead of the vectorized
+# NumPy code when they are compiled (Numba is installed)
+JIT_KERNELS = kernels.NUMBA_AVAILABLE
+
+# amino acids in the order used by the JTT rate matrix below
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+# Jones, Taylor & Thornton (1992) exchangeabilities (lower triangle, rows and
+# columns ordered as AMINO_ACIDS) and equilibrium frequencies
+_JTT_EXCHANGEABILITIES = """
+56
+81 10
+105 5 767
+15 78 4 5
+179 59 130 119 5
+27 69 112 26 40 23
+36 17 11 12 89 6 16
+35 7 26 181 4 27 45 21
+30 23 7 9 248 6 56 229 14
+54 31 15 18 43 14 33 479 65 388
+54 34 528 58 10 81 391 47 263 12 30
+194 14 15 18 17 24 115 10 21 102 16 15
+57 9 49 323 4 26 597 9 292 72 43 86 164
+58 113 16 29 5 137 328 22 646 38 44 45 74 310
+378 223 59 30 92 201 73 40 47 59 29 503 285 53 101
+475 42 38 32 12 33 46 245 103 25 226 232 118 51 64 477
+298 62 31 45 62 47 11 961 14 180 323 16 23 20 17 38 112
+9 115 4 10 53 55 8 9 10 52 24 8 6 18 126 35 12 25
+11 209 46 7 536 8 573 32 8 24 18 70 10 24 20 63 21 16 71
+"""
+_JTT_FREQUENCIES = (
+    0.076748, 0.019803, 0.051544, 0.061830, 0.040126, 0.073152, 0.022944,
+    0.053761, 0.058676, 0.091904, 0.023826, 0.042645, 0.050901, 0.040752,
+    0.051691, 0.068765, 0.058565, 0.066005, 0.014261, 0.032102)
+
+# models supported by the native distance engine
+DISTANCE_MODELS = ('jtt', 'kimura', 'poisson', 'p-distance')
+
+
+# resources used by one external command run by ProcessRunner, output and
+# error hold the last max_output bytes written by the command
+JobResult = namedtuple('JobResult', ['command', 'status', 'output', 'error',
+                                     'wall_time', 'cpu_time', 'max_rss',
+                                     'timed_out'])
+
+
+class ProcessRunner(object):
+    """ Run external commands with timeouts from an asyncio event loop.
+
+    The event loop runs in a background thread of the current process, so
+    run() and submit() can be called from ordinary (and several) threads.
+    At most max_jobs commands run at once, the others wait for a slot.
+
+    Parameters
+    ----------
+    max_jobs: integer, optional
+        maximum number of concurrent child processes
+    max_output: integer, optional
+        number of bytes of stdout and stderr kept per command (the last
+        bytes are kept)
+    kill_delay: float, optional
+        number of seconds between SIGTERM and SIGKILL when a command times
+        out
+    poll_interval: float, optional
+        number of seconds between two checks for the exit of a command
+
+    Attributes
+    ----------
+    history: list
+        JobResult (without output and error) of every finished command
+
+    Notes
+    -----
+        Child processes are reaped with os.wait4() to record their exact CPU
+        time (user + system, in seconds) and maximum resident set size (in
+        kilobytes on Linux). Linux counts the memory of the calling process
+        when the command starts in the latter, so it is only informative for
+        commands using more memory than this process. A command that cannot
+        be started raises OSError.
+    """
+
+    def __init__(self, max_jobs=1, max_output=1 << 20, kill_delay=5.0,
+                 poll_interval=0.05):
+        self.max_jobs = max_jobs
+        self.max_output = max_output
+        self.kill_delay = kill_delay
+        self.poll_interval = poll_interval
+        self.history = []
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._running = 0
+        self._loop = None
+        self._semaphore = None
+
+    def _start(self):
+        """ Return the event loop (started if needed) for a new command.
+        """
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever,
+                                          name="ProcessRunner", daemon=True)
+                thread.start()
+                self._semaphore = asyncio.run_coroutine_threadsafe(
+                    self._new_semaphore(), loop).result()
+                self._loop = loop
+            self._running += 1
+            return self._loop
+
+    async def _new_semaphore(self):
+        return asyncio.Semaphore(max(self.max_jobs, 1))
+
+    def submit(self, command, stdin=None, input=None, timeout=None,
+               cwd=None, keep_output=False):
+        """ Start a command and return a future of its JobResult.
+
+        Parameters
+        ----------
+        command: list or string
+            command line (a string is split with shlex)
+        stdin: file object, optional
+            file to read the standard input from
+        input: bytes, optional
+            data written to the standard input (exclusive with stdin)
+        timeout: float, optional
+            number of seconds after which the command is terminated
+        cwd: string, optional
+            working directory of the command
+        keep_output: boolean, optional
+            if True, keep the whole standard output instead of its last
+            max_output bytes (for commands whose output is their result)
+
+        Returns
+        -------
+        concurrent.futures.Future
+        """
+        if isinstance(command, str):
+            command = shlex.split(command)
+        loop = self._start()
+        return asyncio.run_coroutine_threadsafe(
+            self._run(list(command), stdin, input, timeout, cwd,
+                      keep_output), loop)
+
+    def run(self, command, **kwargs):
+        """ Run a command and return its JobResult (see submit()).
+        """
+        return self.submit(command, **kwargs).result()
+
+    def close(self):
+        """ Stop the event loop, commands still running are not waited for.
+        """
+        with self._lock:
+            self._stop()
+
+    def _stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = None
+
+    def resize(self, max_jobs):
+        """ Change the maximum number of concurrent commands.
+
+        Waits until the submitted commands finished, then stops the event
+        loop, which the next command restarts with a semaphore of max_jobs.
+        Commands submitted from other threads meanwhile wait for the resize.
+        """
+        with self._idle:
+            self._idle.wait_for(lambda: not self._running)
+            self._stop()
+            self.max_jobs = max_jobs
+
+    async def _run(self, command, stdin, input, timeout, cwd, keep_output):
+        try:
+            async with self._semaphore:
+                result = await self._execute(command, stdin, input, timeout,
+                                             cwd, keep_output)
+            with self._lock:
+                self.history.append(result._replace(output=b'', error=b''))
+        finally:
+            with self._idle:
+                self._running -= 1
+                self._idle.notify_all()
+        return result
+
+    def _read_pipe(self, pipe, buffer, done, max_output):
+        loop = asyncio.get_running_loop()
+        fd = pipe.fileno()
+
+        def on_readable():
+            try:
+                chunk = os.read(fd, 65536)
+            except BlockingIOError:
+                return
+            except OSError:
+                chunk = b''
+            if chunk:
+                buffer.extend(chunk)
+                if max_output is not None and len(buffer) > max_output:
+                    del buffer[:len(buffer) - max_output]
+            else:
+                loop.remove_reader(fd)
+                pipe.close()
+                if not done.done():
+                    done.set_result(None)
+        os.set_blocking(fd, False)
+        loop.add_reader(fd, on_readable)
+
+    def _write_pipe(self, pipe, data):
+        loop = asyncio.get_running_loop()
+        fd = pipe.fileno()
+        view = memoryview(data)
+
+        def on_writable():
+            nonlocal view
+            try:
+                written = os.write(fd, view[:65536])
+            except BlockingIOError:
+                return
+            except OSError:
+                # the command exited without reading all of its input
+                written = len(view)
+            view = view[written:]
+            if not len(view):
+                loop.remove_writer(fd)
+                pipe.close()
+        if not len(view):
+            pipe.close()
+            return
+        os.set_blocking(fd, False)
+        loop.add_writer(fd, on_writable)
+
+    async def _wait_exit(self, pid):
+        """ Reap the child process, return its wait status and rusage. """
+        while True:
+            waited_pid, status, rusage = os.wait4(pid, os.WNOHANG)
+            if waited_pid == pid:
+                return status, rusage
+            await asyncio.sleep(self.poll_interval)
+
+    @staticmethod
+    def _kill(pid, exit_task, sig):
+        """ Send a signal to a child process that was not reaped yet.
+
+        Only _wait_exit() reaps the children: Popen.send_signal() polls the
+        child first, which could reap it under the os.wait4() of
+        _wait_exit() (or signal another process reusing its pid).
+        """
+        if exit_task.done():
+            return
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    async def _execute(self, command, stdin, input, timeout, cwd,
+                       keep_output):
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        proc = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE if input is not None else stdin,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=cwd,
+            close_fds=True)
+        output, error = bytearray(), bytearray()
+        pipes_done = [loop.create_future(), loop.create_future()]
+        self._read_pipe(proc.stdout, output, pipes_done[0],
+                        None if keep_output else self.max_output)
+        self._read_pipe(proc.stderr, error, pipes_done[1], self.max_output)
+        if input is not None:
+            self._write_pipe(proc.stdin, input)
+        exit_task = asyncio.ensure_future(self._wait_exit(proc.pid))
+        timed_out = False
+        try:
+            await asyncio.wait_for(asyncio.shield(exit_task), timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+            self._kill(proc.pid, exit_task, signal.SIGTERM)
+            try:
+                await asyncio.wait_for(asyncio.shield(exit_task),
+                                       self.kill_delay)
+            except asyncio.TimeoutError:
+                self._kill(proc.pid, exit_task, signal.SIGKILL)
+        status, rusage = await exit_task
+        if os.WIFSIGNALED(status):
+            proc.returncode = -os.WTERMSIG(status)
+        else:
+            proc.returncode = os.WEXITSTATUS(status)
+        wall_time = time.monotonic() - start
+        # descendants of the command may keep its pipes open
+        await asyncio.wait(pipes_done, timeout=self.kill_delay)
+        for pipe, pipe_done in zip((proc.stdout, proc.stderr), pipes_done):
+            if not pipe_done.done():
+                loop.remove_reader(pipe.fileno())
+                pipe.close()
+        if proc.stdin is not None and not proc.stdin.closed:
+            loop.remove_writer(proc.stdin.fileno())
+            proc.stdin.close()
+        return JobResult(command=command,
+                         status=proc.returncode,
+                         output=bytes(output),
+                         error=bytes(error),
+                         wall_time=wall_time,
+                         cpu_time=rusage.ru_utime + rusage.ru_stime,
+                         max_rss=rusage.ru_maxrss,
+                         timed_out=timed_out)
+
+
+# one runner per process (worker processes get their own event loop)
+_process_runner = {}
+
+
+def get_process_runner(max_jobs=None):
+    """ Return the ProcessRunner of the current process.
+
+    Parameters
+    ----------
+    max_jobs: integer, optional
+        if given, the maximum number of concurrent child processes of the
+        runner (applies to commands submitted afterwards, once the commands
+        in flight finished, see ProcessRunner.resize())
+
+    Returns
+    -------
+    ProcessRunner
+    """
+    pid = getpid()
+    runner = _process_runner.get(pid)
+    if runner is None:
+        _process_runner.clear()
+        runner = _process_runner[pid] = ProcessRunner()
+    if max_jobs is not None and max_jobs != runner.max_jobs:
+        runner.resize(max_jobs)
+    return runner
+
+
+def run_command(command, stdin=None, input=None, timeout=None, cwd=None,
+                debug=False, keep_output=False):
+    """ Run an external command with the process runner.
+
+    Parameters
+    ----------
+    command: list or string
+        command line
+    stdin: file object, optional
+        file to read the standard input from
+    input: bytes, optional
+        data written to the standard input
+    timeout: float, optional
+        number of seconds after which the command is terminated
+    cwd: string, optional
+        working directory of the command
+    debug: boolean, optional
+        if True, print the standard error of the command
+    keep_output: boolean, optional
+        if True, keep the whole standard output (see ProcessRunner.submit())
+
+    Returns
+    -------
+    JobResult
+    """
+    result = get_process_runner().run(command, stdin=stdin, input=input,
+                                      timeout=timeout, cwd=cwd,
+                                      keep_output=keep_output)
+    if (result.error and debug):
+        print("[DEBUG] %s\n" % result.error)
+    return result
+
 
 class Command(object):
-    """Run subprocess commands in a different thread with TIMEOUT option.
+    """Run a subprocess command with TIMEOUT option.
 
-    Based on jcollado's solution:
-    http://stackoverflow.com/questions/1191374/subprocess-with-timeout/4825933#4825933
-    https://gist.github.com/kirpit/1306188
+    Kept for compatibility, the command is run by the process runner (see
+    ProcessRunner).
     """
     process = None
     status = None
+    result = None
     output, error = '', ''
 
     def __init__(self, command):
@@ -72,50 +460,414 @@ class Command(object):
             command = shlex.split(command)
         self.command = command
 
-    def run(self, timeout=None, **kwargs):
+    def run(self, timeout=None, stdin=None, **kwargs):
         """ Run a command then return: (status, output, error). """
-        def target(**kwargs):
-            try:
-                self.process = subprocess.Popen(self.command, **kwargs)
-                self.output, self.error = self.process.communicate()
-                self.status = self.process.returncode
-            except subprocess.CalledProcessError:
-                self.error = traceback.format_exc()
-                self.status = -1
-        # default stdout and stderr
-        if 'stdout' not in kwargs:
-            kwargs['stdout'] = subprocess.PIPE
-        if 'stderr' not in kwargs:
-            kwargs['stderr'] = subprocess.PIPE
-        # thread
-        thread = threading.Thread(target=target, kwargs=kwargs)
-        thread.start()
-        thread.join(timeout)
-        if thread.is_alive():
-            self.process.terminate()
-            thread.join()
+        try:
+            self.result = get_process_runner().run(
+                self.command, stdin=stdin, timeout=timeout,
+                cwd=kwargs.get('cwd'))
+            self.status = self.result.status
+            self.output, self.error = self.result.output, self.result.error
+        except OSError:
+            self.error = traceback.format_exc()
+            self.status = -1
         return self.status, self.output, self.error
 
 
-def hamming(str1, str2):
-    """Compute the Hamming distance between two strings.
+def encode_species_set(present):
+    """ Encode a species set as a packed bit array.
 
     Parameters
     ----------
-    str1: string
-        string
-    str2: string
-        string
+    present: string or array_like of booleans
+        binary indicator vector of the species in the set, either as a
+        string (ex. IIOI, any character other than I is an absent species)
+        or as one boolean per species
+
+    Returns
+    -------
+    bytes
+        the indicator vector packed into little-endian uint64 words (bit s of
+        the vector is bit s % 64 of word s // 64), hashable and usable as a
+        species_set_dict key
+
+    Notes
+    -----
+        species_set_dict, gene_bitvector_map and cluster_distances() all use
+        this encoding, see species_set_words() and hamming_distances() to
+        compare species sets in bulk.
+    """
+    if isinstance(present, str):
+        present = [c == 'I' for c in present]
+    bits = numpy.packbits(numpy.asarray(present, dtype=bool),
+                          bitorder='little')
+    padding = -len(bits) % 8
+    if padding or not len(bits):
+        bits = numpy.concatenate(
+            [bits, numpy.zeros(padding or 8, dtype=numpy.uint8)])
+    return bits.tobytes()
+
+
+def decode_species_set(species_set, num_species):
+    """ Decode a packed species set into its string indicator vector.
+
+    Parameters
+    ----------
+    species_set: bytes
+        species set encoded by encode_species_set()
+    num_species: integer
+        number of species in the reference database
+
+    Returns
+    -------
+    string
+        binary indicator vector (ex. IIOI)
+    """
+    bits = numpy.unpackbits(numpy.frombuffer(species_set, dtype=numpy.uint8),
+                            count=num_species, bitorder='little')
+    return ''.join('I' if bit else 'O' for bit in bits)
+
+
+def species_set_words(species_sets):
+    """ Stack packed species sets into a 2-D array of uint64 words.
+
+    Parameters
+    ----------
+    species_sets: list of bytes
+        species sets encoded by encode_species_set() (same number of species)
+
+    Returns
+    -------
+    numpy.ndarray
+        array of shape (len(species_sets), words) and dtype uint64
+    """
+    if not species_sets:
+        return numpy.zeros(shape=(0, 1), dtype=numpy.uint64)
+    return numpy.frombuffer(b''.join(species_sets), dtype=numpy.uint64
+                            ).reshape(len(species_sets), -1)
+
+
+def species_set_counts(words):
+    """ Count the genes of every distinct species set.
+
+    Parameters
+    ----------
+    words: numpy.ndarray
+        uint64 array of shape (genes, words) of the species set of every gene
+        (see DistanceCheckpoint)
+
+    Returns
+    -------
+    dictionary
+        species sets (encoded by encode_species_set()) as keys and their
+        number of genes as values, in order of first appearance of the
+        species sets
+    """
+    if not len(words):
+        return {}
+    species_sets, first, counts = numpy.unique(
+        words, axis=0, return_index=True, return_counts=True)
+    return {species_sets[k].tobytes(): int(counts[k])
+            for k in numpy.argsort(first)}
+
+
+# number of set bits of every byte, used when numpy.bitwise_count is missing
+_POPCOUNT_TABLE = numpy.array([bin(x).count('1') for x in range(256)],
+                              dtype=numpy.uint8)
+
+
+def popcount(words):
+    """ Count the set bits of every element of a uint64 array.
+    """
+    if hasattr(numpy, 'bitwise_count'):
+        return numpy.bitwise_count(words)
+    counts = _POPCOUNT_TABLE[words.view(numpy.uint8)]
+    return counts.reshape(words.shape + (8,)).sum(axis=-1)
+
+
+def hamming_distances(words_a, words_b):
+    """ Compute the Hamming distances between two sets of packed vectors.
+
+    Parameters
+    ----------
+    words_a: numpy.ndarray
+        uint64 array of shape (m, words), see species_set_words()
+    words_b: numpy.ndarray
+        uint64 array of shape (n, words)
+
+    Returns
+    -------
+    numpy.ndarray
+        integer array of shape (m, n) with the number of differing bits
+        (XOR then popcount) between every pair of vectors
+    """
+    if JIT_KERNELS:
+        return kernels.hamming_distances(words_a, words_b)
+    return popcount(words_a[:, None, :] ^ words_b[None, :, :]).sum(
+        axis=-1, dtype=numpy.int64)
+
+
+class HammingIndex(object):
+    """ Multi-index hash of packed species sets for Hamming radius queries.
+
+    Parameters
+    ----------
+    words: numpy.ndarray
+        uint64 array of shape (n, words) of the indexed species sets (see
+        species_set_words())
+    radius: integer
+        largest Hamming distance of the radius queries (see within())
+
+    Notes
+    -----
+        The bits of the species sets are split into radius + 1 blocks of
+        whole bytes. Two vectors within radius differ in at most radius
+        bits, so (pigeonhole principle) at least one of their blocks is
+        identical: the candidates of a query are the vectors sharing one of
+        its blocks, found by binary search in the sorted hashes of every
+        block, and only the candidates' distances are computed (Norouzi et
+        al., Fast exact search in Hamming space with multi-index hashing,
+        2014). The nearest vectors beyond radius are found by a scan
+        accumulating the distances word by word (see nearest()). When there
+        are fewer bytes than blocks the radius queries scan all vectors.
+    """
+
+    def __init__(self, words, radius):
+        self.words = numpy.ascontiguousarray(words, dtype=numpy.uint64)
+        words = self.words
+        self.radius = radius
+        # the bytes where some indexed vector has a set bit, the other bits
+        # of a query add to all its distances and cannot bring a vector
+        # within radius
+        used = numpy.flatnonzero(numpy.bitwise_or.reduce(
+            words.view(numpy.uint8), axis=0)) if len(words) else []
+        num_bytes = int(used[-1]) + 1 if len(used) else 0
+        self.blocks = None
+        if radius + 1 <= num_bytes:
+            self.blocks = []
+            for block in numpy.array_split(numpy.arange(num_bytes),
+                                           radius + 1):
+                keys = self._block_keys(words, block)
+                order = numpy.argsort(keys, kind='stable')
+                self.blocks.append((block, keys[order], order))
+
+    @staticmethod
+    def _block_keys(words, block):
+        """ 64-bit hashes of the bytes block of every vector.
+        """
+        data = numpy.zeros(shape=(len(words), -(-len(block) // 8) * 8),
+                           dtype=numpy.uint8)
+        data[:, :len(block)] = numpy.ascontiguousarray(words).view(
+            numpy.uint8)[:, block]
+        keys = numpy.zeros(shape=len(words), dtype=numpy.uint64)
+        for column in data.view(numpy.uint64).T:
+            keys = (keys ^ column) * numpy.uint64(0x100000001b3)
+        return keys
+
+    def within(self, words):
+        """ All pairs of a query and an indexed vector within radius.
+
+        Parameters
+        ----------
+        words: numpy.ndarray
+            uint64 array of shape (m, words) of the query species sets
+
+        Returns
+        -------
+        queries: numpy.ndarray
+            query index of every pair, sorted
+        indices: numpy.ndarray
+            index of the indexed vector of every pair (sorted within a
+            query)
+        distances: numpy.ndarray
+            Hamming distance of every pair
+        """
+        if self.blocks is None:
+            distances = hamming_distances(words, self.words)
+            queries, indices = numpy.nonzero(distances <= self.radius)
+            return queries, indices, distances[queries, indices]
+        queries = []
+        indices = []
+        for block, keys, order in self.blocks:
+            query_keys = self._block_keys(words, block)
+            first = numpy.searchsorted(keys, query_keys, side='left')
+            counts = numpy.searchsorted(keys, query_keys,
+                                        side='right') - first
+            block_queries = numpy.repeat(numpy.arange(len(words)), counts)
+            offsets = numpy.arange(len(block_queries)) - numpy.repeat(
+                numpy.cumsum(counts) - counts, counts)
+            queries.append(block_queries)
+            indices.append(order[numpy.repeat(first, counts) + offsets])
+        pairs = numpy.unique(
+            numpy.concatenate(queries) * len(self.words) +
+            numpy.concatenate(indices))
+        queries = pairs // len(self.words)
+        indices = pairs % len(self.words)
+        distances = popcount(words[queries] ^ self.words[indices]).sum(
+            axis=-1, dtype=numpy.int64)
+        close = distances <= self.radius
+        return queries[close], indices[close], distances[close]
+
+    def first_within(self, words):
+        """ Lowest index of the indexed vectors within radius of every query.
+
+        Returns
+        -------
+        numpy.ndarray
+            index for every query of words, -1 if none is within radius
+        """
+        queries, indices, _ = self.within(words)
+        first = numpy.full(shape=len(words), fill_value=-1, dtype=int)
+        # the pairs are sorted, the first pair of a query has its lowest index
+        starts = numpy.ones(shape=len(queries), dtype=bool)
+        starts[1:] = queries[1:] != queries[:-1]
+        first[queries[starts]] = indices[starts]
+        return first
+
+    def nearest(self, words, chunk_size=4096):
+        """ Nearest indexed vector of every query (lowest index on ties).
+
+        Parameters
+        ----------
+        words: numpy.ndarray
+            uint64 array of shape (m, words) of the query species sets
+        chunk_size: integer, optional
+            number of queries compared to all indexed vectors at once
+
+        Returns
+        -------
+        indices: numpy.ndarray
+            index of the nearest indexed vector of every query
+        distances: numpy.ndarray
+            its Hamming distance
+
+        Notes
+        -----
+            The distances are accumulated word by word, so the temporary
+            arrays hold len(self.words) x chunk_size counts instead of the
+            XOR of every word (see hamming_distances()).
+        """
+        indices = numpy.zeros(shape=len(words), dtype=int)
+        distances = numpy.zeros(shape=len(words), dtype=numpy.int64)
+        for start in range(0, len(words), chunk_size):
+            chunk = words[start:start+chunk_size]
+            if JIT_KERNELS:
+                counts = kernels.hamming_distances(self.words, chunk)
+            else:
+                counts = numpy.zeros(shape=(len(self.words), len(chunk)),
+                                     dtype=numpy.int32)
+                for word in range(self.words.shape[1]):
+                    counts += popcount(self.words[:, word, None] ^
+                                       chunk[None, :, word])
+            indices[start:start+chunk_size] = counts.argmin(axis=0)
+            distances[start:start+chunk_size] = counts.min(axis=0)
+        return indices, distances
+
+
+def list_proteomes(target_proteomes_dir, extensions):
+    """ List the proteomes of a directory in the order of their species.
+
+    Parameters
+    ----------
+    target_proteomes_dir: string
+        path to directory holding proteomes for all target organisms
+    extensions: list
+        list of extensions for reference proteomes
+
+    Returns
+    -------
+    list
+        filepaths to the proteomes sorted by file name, the i-th proteome
+        holds the genes of species i
+    """
+    return sorted(set(f
+                      for ext in extensions
+                      for f in glob("%s/*%s" % (target_proteomes_dir, ext))),
+                  key=basename)
+
+
+class GeneTable(object):
+    """ Interned identities of the reference genes.
+
+    Every reference gene gets an integer id (its position in labels), the
+    species and the index within its species' proteome of gene i are
+    species[i] and genes[i]. Labels are looked up once through a single
+    label to id index, the rest of the pipeline works on the ids.
+
+    Parameters
+    ----------
+    labels: list
+        FASTA labels of the reference genes
+    species: array_like
+        species index of every gene
+    genes: array_like
+        index of every gene in the proteome of its species
+
+    Attributes
+    ----------
+    index: dictionary
+        FASTA label as key and gene id as value
+    num_species: integer
+        number of species (1 + the largest species index)
+    """
+
+    def __init__(self, labels, species, genes):
+        self.labels = list(labels)
+        self.species = numpy.asarray(species, dtype=numpy.int64)
+        self.genes = numpy.asarray(genes, dtype=numpy.int64)
+        self.index = {label: i for i, label in enumerate(self.labels)}
+        if len(self.index) != len(self.labels):
+            raise ValueError("Duplicate sequence labels are not allowed")
+        self.num_species = (int(self.species.max()) + 1
+                            if len(self.species) else 0)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __contains__(self, label):
+        return label in self.index
+
+    def ids(self, labels):
+        """ Return the ids of labels as an integer array (-1 if unknown).
+        """
+        return numpy.fromiter((self.index.get(label, -1) for label in labels),
+                              dtype=numpy.int64, count=len(labels))
+
+    def pseudo_name(self, i):
+        """ Return the species_gene pseudo name of gene i (ex. 1_1).
+        """
+        return "%s_%s" % (self.species[i], self.genes[i])
+
+    def as_dict(self):
+        """ Return the "two-way" dictionary mapping every label to its pseudo
+        name and vice versa.
+        """
+        gene_map = {}
+        for i, label in enumerate(self.labels):
+            gene_map[label] = self.pseudo_name(i)
+            gene_map[gene_map[label]] = label
+        return gene_map
+
+
+def phylip_name(position):
+    """ Return the name of the position-th member of a gene family as written
+    to the external tools (at most 10 characters, as required by PHYLIP).
+    """
+    return "m%s" % position
+
+
+def phylip_position(name):
+    """ Return the position in its gene family of a member named by
+    phylip_name().
     """
-    assert len(str1) == len(str2)
-    return sum(map(operator.ne, str1, str2))
+    return int(name[1:])
 
 
 def preprocess_data(working_dir,
                     target_proteomes_dir,
                     extensions,
                     verbose=False):
-    """ Map each gene to sudo name (ex. 1_1 for species 1, gene 1).
+    """ Assign an integer id to every reference gene.
 
     Parameters
     ----------
@@ -130,9 +882,8 @@ def preprocess_data(working_dir,
 
     Returns
     -------
-    gene_map: dictionary
-        "two-way" dictionary storing gene names as keys and their pseudo
-        names as values, and vica versa
+    gene_map: GeneTable
+        id, species and index within its species of every reference gene
     ref_db: dictionary
         dictionary storing FASTA label as key and sequence as value for the
         reference databases
@@ -141,34 +892,132 @@ def preprocess_data(working_dir,
 
     Notes
     -----
-        This will facilitate easier output comparison and the 10 character
-        name limitation in PHYLIP output. This format is limited up to 9999
-        species and 99999 genes per species.
+        Gene families are named by the position of their members (see
+        phylip_name()) only when they are written for Clustalw and protdist,
+        so the 10 character name limitation in PHYLIP output does not bound
+        the number of species or genes.
     """
-    gene_map = {}
+    labels = []
+    species_index = []
+    gene_index = []
     ref_db = {}
     if verbose:
         sys.stdout.write("Target organism\tNumber of genes\n")
     # each file contains genes for species
-    files = [f
-             for ext in extensions
-             for f in glob("%s/*%s" % (target_proteomes_dir, ext))]
+    files = list_proteomes(target_proteomes_dir, extensions)
     for species, _file in enumerate(files):
         if verbose:
             sys.stdout.write("%s. %s\t" % (
                 species+1, basename(_file)))
         for gene, seq in enumerate(skbio.io.read(_file, format='fasta')):
             label = seq.metadata['id']
-            ref_db[label] = seq
-            sudo_label = "%s_%s" % (species, gene)
-            if label in gene_map:
+            if label in ref_db:
                 raise ValueError("Duplicate sequence labels are "
                                  "not allowed: %s" % label)
-            gene_map[label] = sudo_label
-            gene_map[sudo_label] = label
+            ref_db[label] = seq
+            labels.append(label)
+            species_index.append(species)
+            gene_index.append(gene)
         if verbose:
             sys.stdout.write("%s\n" % gene)
-    return gene_map, ref_db, species+1
+    return GeneTable(labels, species_index, gene_index), ref_db, species+1
+
+
+def hash_reference_proteomes(ref_fps, align_software, block_size=1 << 20):
+    """ Compute a content hash of a set of reference proteomes.
+
+    Parameters
+    ----------
+    ref_fps: list
+        filepaths to reference proteomes
+    align_software: string
+        software the database is built for (BLAST or DIAMOND)
+    block_size: integer, optional
+        number of bytes read at once
+
+    Returns
+    -------
+    string
+        hexadecimal SHA-1 digest of the software name and of the name and
+        content of every proteome (independent of the order of ref_fps)
+    """
+    digest = hashlib.sha1(align_software.encode())
+    for ref_fp in sorted(ref_fps, key=basename):
+        digest.update(basename(ref_fp).encode() + b'\0')
+        with open(ref_fp, 'rb') as ref_f:
+            for block in iter(lambda: ref_f.read(block_size), b''):
+                digest.update(block)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def build_reference_database(ref_fps,
+                             database_dir,
+                             align_software,
+                             threads=1,
+                             debug=False):
+    """ Build (or reuse) one pooled database of all reference proteomes.
+
+    Parameters
+    ----------
+    ref_fps: list
+        filepaths to reference proteomes
+    database_dir: string
+        dirpath where databases are cached across runs
+    align_software: string
+        software to build the database for (BLAST or DIAMOND)
+    threads: integer, optional
+        number of threads to use for building the DIAMOND database
+    debug: boolean, optional
+        if True, run function in debug mode
+
+    Returns
+    -------
+    pooled_fp: string
+        filepath to the concatenated reference proteomes
+    db_file_fp: string
+        filepath prefix of the database (as given to DIAMOND's --db or
+        BLAST's -db)
+
+    Notes
+    -----
+        The database is named after hash_reference_proteomes() so that it is
+        rebuilt only when a reference proteome is added, removed or modified.
+        A marker file is written once the database is complete.
+    """
+    if align_software not in ("blast", "diamond"):
+        raise ValueError("Software not supported: %s" % align_software)
+    if not isdir(database_dir):
+        mkdir(database_dir)
+    db_file_fp = join(database_dir, "refdb_%s_%s" % (
+        align_software, hash_reference_proteomes(ref_fps, align_software)))
+    pooled_fp = "%s.faa" % db_file_fp
+    done_fp = "%s.done" % db_file_fp
+    if exists(done_fp):
+        return pooled_fp, db_file_fp
+
+    with open(pooled_fp, 'wb') as pooled_f:
+        for ref_fp in sorted(ref_fps, key=basename):
+            with open(ref_fp, 'rb') as ref_f:
+                copyfileobj(ref_f, pooled_f)
+            pooled_f.write(b'\n')
+    if align_software == "diamond":
+        makedb_command = ["diamond",
+                          "makedb",
+                          "--in", pooled_fp,
+                          "-d", db_file_fp,
+                          "--threads", str(threads)]
+    else:
+        makedb_command = ["makeblastdb",
+                          "-in", pooled_fp,
+                          "-out", db_file_fp,
+                          "-dbtype", "prot"]
+    result = run_command(makedb_command, debug=debug)
+    if result.status != 0:
+        raise ValueError("Could not build the %s database %s:\n%s" % (
+            align_software, db_file_fp, result.error))
+    open(done_fp, 'w').close()
+    return pooled_fp, db_file_fp
 
 
 def launch_diamond(query_proteome_fp,
@@ -177,7 +1026,9 @@ def launch_diamond(query_proteome_fp,
                    tmp_dir,
                    e_value=10e-20,
                    threads=1,
-                   debug=False):
+                   debug=False,
+                   db_fp=None,
+                   max_target_seqs=None):
     """ Launch DIAMOND for a query and a reference database of proteomes.
 
     Parameters
@@ -196,31 +1047,33 @@ def launch_diamond(query_proteome_fp,
       number of threads to use for running DIAMOND BLASTP
     debug: boolean
       if True, run function in debug mode
+    db_fp: string, optional
+      prefix of a prebuilt DIAMOND database of ref_fp (see
+      build_reference_database()), if None the database is built in
+      working_dir
+    max_target_seqs: integer, optional
+      maximum number of target sequences to report per query (0 for all), if
+      None DIAMOND's default is used
 
     Returns
     -------
     out_file_fp: string
       filepath to tabular alignment file output by DIAMOND
     """
-    db_file_fp = join(working_dir, "%s" % basename(ref_fp))
-    # build DIAMOND database
-    makediamonddb_command = ["diamond",
-                             "makedb",
-                             "--in", ref_fp,
-                             "-d", db_file_fp,
-                             "--threads", str(threads)]
-    proc = subprocess.Popen(makediamonddb_command,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            close_fds=True)
-    proc.wait()
-    stdout, stderr = proc.communicate()
-    if (stderr and debug):
-        print("[DEBUG] %s\n" % stderr)
+    db_file_fp = db_fp
+    if db_file_fp is None:
+        db_file_fp = join(working_dir, "%s" % basename(ref_fp))
+        # build DIAMOND database
+        makediamonddb_command = ["diamond",
+                                 "makedb",
+                                 "--in", ref_fp,
+                                 "-d", db_file_fp,
+                                 "--threads", str(threads)]
+        run_command(makediamonddb_command, debug=debug)
 
     # launch DIAMOND
-    out_file_fp = join(
-        working_dir, "%s.daa" % basename(query_proteome_fp))
+    out_file_fp = join(working_dir, "%s.%s.daa" % (
+        basename(query_proteome_fp), basename(ref_fp)))
     diamond_command = ["diamond",
                        "blastp",
                        "-t", tmp_dir,
@@ -230,31 +1083,19 @@ def launch_diamond(query_proteome_fp,
                        "--threads", str(threads),
                        "--daa", out_file_fp,
                        "--sensitive"]
-    proc = subprocess.Popen(diamond_command,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            close_fds=True)
-    proc.wait()
-    stdout, stderr = proc.communicate()
-    if (stderr and debug):
-        print("[DEBUG] %s\n" % stderr)
+    if max_target_seqs is not None:
+        diamond_command.extend(["--max-target-seqs", str(max_target_seqs)])
+    run_command(diamond_command, debug=debug)
 
     # convert output to tab delimited file
-    out_file_conv_fp = join(
-        working_dir, "%s.m8" % basename(query_proteome_fp))
+    out_file_conv_fp = join(working_dir, "%s.%s.m8" % (
+        basename(query_proteome_fp), basename(ref_fp)))
     diamond_convert_command = ["diamond",
                                "view",
                                "--daa", out_file_fp,
                                "-f", "tab",
                                "-o", out_file_conv_fp]
-    proc = subprocess.Popen(diamond_convert_command,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            close_fds=True)
-    proc.wait()
-    stdout, stderr = proc.communicate()
-    if (stderr and debug):
-        print("[DEBUG] %s\n" % stderr)
+    run_command(diamond_convert_command, debug=debug)
 
     return out_file_conv_fp
 
@@ -264,7 +1105,9 @@ def launch_blast(query_proteome_fp,
                  working_dir,
                  e_value=10e-20,
                  threads=1,
-                 debug=False):
+                 debug=False,
+                 db_fp=None,
+                 max_target_seqs=None):
     """ Launch BLASTp for a query and a reference database of proteomes.
 
     Parameters
@@ -281,6 +1124,13 @@ def launch_blast(query_proteome_fp,
       number of threads to use for running BLASTP
     debug: boolean
       if True, run function in debug mode
+    db_fp: string, optional
+      prefix of a prebuilt BLAST database of ref_fp (see
+      build_reference_database()), if None the database is built in
+      working_dir
+    max_target_seqs: integer, optional
+      maximum number of target sequences to report per query, if None
+      BLAST's default is used
 
     Returns
     -------
@@ -288,24 +1138,19 @@ def launch_blast(query_proteome_fp,
       filepath to tabular alignment file output by
       BLASTP
     """
-    db_file_fp = join(working_dir, "%s" % basename(ref_fp))
-    # build blast database
-    makeblastdb_command = ["makeblastdb",
-                           "-in", ref_fp,
-                           "-out", db_file_fp,
-                           "-dbtype", "prot"]
-    proc = subprocess.Popen(makeblastdb_command,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            close_fds=True)
-    proc.wait()
-    stdout, stderr = proc.communicate()
-    if (stderr and debug):
-        print("[DEBUG] %s\n" % stderr)
+    db_file_fp = db_fp
+    if db_file_fp is None:
+        db_file_fp = join(working_dir, "%s" % basename(ref_fp))
+        # build blast database
+        makeblastdb_command = ["makeblastdb",
+                               "-in", ref_fp,
+                               "-out", db_file_fp,
+                               "-dbtype", "prot"]
+        run_command(makeblastdb_command, debug=debug)
 
     # launch blast
-    out_file_fp = join(
-        working_dir, "%s.blast" % basename(query_proteome_fp))
+    out_file_fp = join(working_dir, "%s.%s.blast" % (
+        basename(query_proteome_fp), basename(ref_fp)))
     blastp_command = ["blastp",
                       "-db", db_file_fp,
                       "-query", query_proteome_fp,
@@ -314,61 +1159,230 @@ def launch_blast(query_proteome_fp,
                       "-outfmt", "6 std qcovs",
                       "-task", "blastp",
                       "-out", out_file_fp]
-    proc = subprocess.Popen(blastp_command,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            close_fds=True)
-    proc.wait()
-    stdout, stderr = proc.communicate()
-    if (stderr and debug):
-        print("[DEBUG] %s\n" % stderr)
+    if max_target_seqs is not None:
+        blastp_command.extend(["-max_target_seqs", str(max_target_seqs)])
+    run_command(blastp_command, debug=debug)
 
     return out_file_fp
 
 
-def parse_blast(alignments_fp,
-                hits,
+class HomologTable(object):
+    """ Query to homolog table in compressed sparse row (CSR) layout.
+
+    The homologs of the i-th query are the subjects whose codes are stored in
+    indices[indptr[i]:indptr[i+1]]. The table is read-only and dict-like:
+    iterating yields the query names and table[query] returns the list of its
+    homolog names.
+
+    Parameters
+    ----------
+    queries: list
+        query (gene) names
+    indptr: numpy.ndarray
+        offsets of the homologs of every query in indices (len(queries) + 1)
+    indices: numpy.ndarray
+        subject codes of the homologs of all queries
+    subjects: list
+        subject (reference gene) names indexed by their code
+    species: numpy.ndarray
+        species index of every subject
+    subject_index: dictionary, optional
+        subject name as key and code as value (built when needed if None)
+    identities: numpy.ndarray, optional
+        percentage of identical positions of the alignment of every query
+        with each of its homologs, in the order of indices
+    """
+
+    def __init__(self, queries, indptr, indices, subjects, species,
+                 subject_index=None, identities=None):
+        self.queries = queries
+        self.indptr = indptr
+        self.indices = indices
+        self.subjects = subjects
+        self.species = species
+        self.subject_index = subject_index
+        self.identities = identities
+        self._rows = {query: row for row, query in enumerate(queries)}
+
+    def __len__(self):
+        return len(self.queries)
+
+    def __iter__(self):
+        return iter(self.queries)
+
+    def __contains__(self, query):
+        return query in self._rows
+
+    def __getitem__(self, query):
+        row = self._rows[query]
+        return [self.subjects[code]
+                for code in self.indices[self.indptr[row]:self.indptr[row+1]]]
+
+    def as_dict(self):
+        """ Return the table as a dictionary of lists of homolog names.
+        """
+        return {query: self[query] for query in self.queries}
+
+    def query_identities(self, query):
+        """ Percent identities of a query with its homologs (see identities).
+        """
+        if self.identities is None:
+            raise ValueError("The table has no percent identities")
+        row = self._rows[query]
+        return self.identities[self.indptr[row]:self.indptr[row+1]]
+
+    def num_homologs(self, exclude_query=False):
+        """ Number of homologs of every query.
+
+        Parameters
+        ----------
+        exclude_query: boolean, optional
+            if True, a query that hit itself is not counted as its own
+            homolog
+        """
+        counts = numpy.diff(self.indptr)
+        if exclude_query:
+            subject_codes = self.subject_index
+            if subject_codes is None:
+                subject_codes = {subject: code
+                                 for code, subject in enumerate(self.subjects)}
+            query_codes = numpy.array(
+                [subject_codes.get(query, -1) for query in self.queries],
+                dtype=numpy.int64)
+            rows = numpy.repeat(numpy.arange(len(self.queries)), counts)
+            is_query = self.indices == query_codes[rows]
+            counts = counts - numpy.bincount(rows[is_query],
+                                             minlength=len(self.queries))
+        return counts
+
+    def select(self, rows):
+        """ Return a new table restricted to the given rows (queries).
+        """
+        rows = numpy.asarray(rows, dtype=numpy.int64)
+        starts = self.indptr[rows]
+        counts = self.indptr[rows + 1] - starts
+        indptr = numpy.zeros(shape=len(rows) + 1, dtype=numpy.int64)
+        numpy.cumsum(counts, out=indptr[1:])
+        # positions of the homologs of the selected rows in indices
+        positions = (numpy.repeat(starts - indptr[:-1], counts) +
+                     numpy.arange(indptr[-1]))
+        return HomologTable(queries=[self.queries[row] for row in rows],
+                            indptr=indptr,
+                            indices=self.indices[positions],
+                            subjects=self.subjects,
+                            species=self.species,
+                            subject_index=self.subject_index,
+                            identities=(None if self.identities is None
+                                        else self.identities[positions]))
+
+
+def parse_blast(alignments_fps,
                 gene_map,
-                debug=False):
-    """ Parse BLASTp alignment file into a dictionary.
+                chunksize=1000000,
+                debug=False,
+                identities=False):
+    """ Parse BLASTp alignment files into a query to homolog table.
 
     Parameters
     ----------
-    alignments_fp: string
-      filepath to tabular alignment file output by BLASTP
-    hits: dictionary
-      dictionary storing query (gene) names as keys and the best aligning
-      reference sequences as values (one alignment per reference sequence)
-    gene_map: dictionary
-      "two-way" dictionary storing gene names as keys and their pseudo
-      names as values, and vica versa
+    alignments_fps: string or list
+      filepath(s) to tabular alignment file(s) output by BLASTP or DIAMOND
+    gene_map: GeneTable
+      id and species of every reference gene (see preprocess_data())
+    chunksize: integer, optional
+      number of alignments read at once
     debug: boolean
       if True, run function in debug mode
+    identities: boolean, optional
+      if True, also read the percent identity (third column) of every
+      alignment into the identities of the table
+
+    Returns
+    -------
+    HomologTable
+      for each query (in order of first appearance) the best aligning
+      reference sequences (one alignment per reference species, the first
+      one in file order), the subject codes are the gene ids of gene_map
 
     Notes
     -----
-        The keys are the queries and the values are all the reference
-        sequences to which the query mapped with E-value cutoff score.
+        Only the query and subject columns (and percent identities) are read,
+        in chunks. Query names
+        are mapped to integer codes once per distinct name and subject names
+        to their gene ids through the index of gene_map, the first hit of
+        every (query, species) pair is then kept with a single group-by over
+        the integer codes. Subjects missing from gene_map are ignored.
     """
-    # read blastp results
-    with open(alignments_fp, 'r') as alignments_f:
-        for line in alignments_f:
+    if isinstance(alignments_fps, str):
+        alignments_fps = [alignments_fps]
+    query_codes = {}
+    query_chunks = []
+    subject_chunks = []
+    identity_chunks = []
+    columns = [0, 1, 2] if identities else [0, 1]
+    for alignments_fp in alignments_fps:
+        if getsize(alignments_fp) == 0:
+            continue
+        reader = pd.read_csv(alignments_fp, sep=r'\s+', header=None,
+                             usecols=columns, dtype={0: str, 1: str, 2: float},
+                             chunksize=chunksize)
+        for chunk in reader:
             if debug:
-                sys.stdout.write("[DEBUG] %s" % line)
-            query, ref = line.split()[:2]
-            if query not in hits:
-                hits[query] = [ref]
-            else:
-                # check that the query mapped to a different species
-                # since we only want the best homolog per species
-                if gene_map[ref].split('_')[0] not in [
-                        gene_map[gene].split('_')[0] for gene in hits[query]]:
-                    hits[query].append(ref)
+                for query, ref in zip(chunk[0], chunk[1]):
+                    sys.stdout.write("[DEBUG] %s\t%s\n" % (query, ref))
+            codes, uniques = pd.factorize(chunk[0])
+            uniques = numpy.array(
+                [query_codes.setdefault(query, len(query_codes))
+                 for query in uniques], dtype=numpy.int64)
+            query_chunks.append(uniques[codes])
+            codes, uniques = pd.factorize(chunk[1])
+            subject_chunks.append(gene_map.ids(uniques)[codes])
+            if identities:
+                identity_chunks.append(chunk[2].to_numpy())
+    if query_chunks:
+        queries = numpy.concatenate(query_chunks)
+        refs = numpy.concatenate(subject_chunks)
+    else:
+        queries = numpy.zeros(shape=0, dtype=numpy.int64)
+        refs = numpy.zeros(shape=0, dtype=numpy.int64)
+    pidents = None
+    if identities:
+        pidents = (numpy.concatenate(identity_chunks) if identity_chunks
+                   else numpy.zeros(shape=0))
+    known = refs >= 0
+    queries, refs = queries[known], refs[known]
+    hit_species = gene_map.species[refs]
+    # keep the first hit of every (query, species) pair, in file order
+    num_species = max(gene_map.num_species, 1)
+    if JIT_KERNELS:
+        first = kernels.first_hits(queries * num_species + hit_species)
+    else:
+        _, first = numpy.unique(queries * num_species + hit_species,
+                                return_index=True)
+        first.sort()
+    queries, refs = queries[first], refs[first]
+    if identities:
+        pidents = pidents[known][first]
+    # group by query, queries are coded in order of first appearance
+    order = numpy.argsort(queries, kind='stable')
+    counts = numpy.bincount(queries, minlength=len(query_codes))
+    indptr = numpy.zeros(shape=len(query_codes) + 1, dtype=numpy.int64)
+    numpy.cumsum(counts, out=indptr[1:])
+    # queries without any known subject are dropped
+    names = list(query_codes)
+    rows = numpy.flatnonzero(counts)
+    return HomologTable(queries=names,
+                        indptr=indptr,
+                        indices=refs[order],
+                        subjects=gene_map.labels,
+                        species=gene_map.species,
+                        subject_index=gene_map.index,
+                        identities=(None if pidents is None
+                                    else pidents[order])).select(rows)
 
 
 def launch_msa(fasta_in_fp,
                clustal_command_fp,
-               gene_map,
                ref_db,
                hits,
                query,
@@ -379,27 +1393,30 @@ def launch_msa(fasta_in_fp,
     ----------
     fasta_in_fp: string
       filepath to FASTA file of protein sequences to use as input to
-      Clustalw
+      Clustalw, the members are named by their position in hits[query] (see
+      phylip_name())
     clustal_command_fp: string
       filepath to Clustalw command (interactive)
-    gene_map: dictionary
-      "two-way" dictionary storing gene names as keys and their pseudo
-      names as values, and vica versa
     ref_db: dictionary
       dictionary storing FASTA label as key and sequence as value for the
       reference databases
-    hits: dictionary
-      dictionary storing query (gene) names as keys and the best aligning
+    hits: HomologTable or dictionary
+      table storing query (gene) names as keys and the best aligning
       reference sequences as values (one alignment per reference sequence)
     query: string
       query gene name
     timeout: integer
       number of seconds to allow Clustalw to run before terminating the
       process
+
+    Returns
+    -------
+    JobResult or None
+      resources used by Clustalw (None if it could not be started)
     """
     with open(fasta_in_fp, 'w') as in_f:
-        for ref in hits[query]:
-            in_f.write(">%s\n%s\n" % (gene_map[ref], ref_db[ref]))
+        for position, ref in enumerate(hits[query]):
+            in_f.write(">%s\n%s\n" % (phylip_name(position), ref_db[ref]))
 
     with open(clustal_command_fp, 'r') as clustal_command_f:
         clustalw_command = Command("clustalw")
@@ -411,43 +1428,596 @@ def launch_msa(fasta_in_fp,
             sys.stdout.write(
                 "status: %s\noutput: %s\terror: %s\t" % (
                     status, output, error))
+    return clustalw_command.result
 
 
-def compute_distances(phylip_command_fp,
-                      warnings=False):
-    """ Compute distances between each pair of sequences in the MSA.
+# aligners reading the FASTA sequences of a gene family on stdin and writing
+# the aligned sequences in FASTA format to stdout, with the faster setting
+# used to retry a family that timed out (None if there is none)
+MsaBackend = namedtuple('MsaBackend', ['command', 'fast_command'])
+MSA_BACKENDS = {
+    'mafft': MsaBackend(
+        command=['mafft', '--auto', '--amino', '--quiet', '-'],
+        fast_command=['mafft', '--retree', '1', '--maxiterate', '0',
+                      '--amino', '--quiet', '-']),
+    'kalign': MsaBackend(
+        command=['kalign', '-f', 'fasta'],
+        fast_command=None),
+    'muscle': MsaBackend(
+        command=['muscle', '-quiet'],
+        fast_command=['muscle', '-quiet', '-maxiters', '1', '-diags'])}
 
-    Parameters
-    ----------
-    phylip_command_fp: string
-      filepath to the PHYLIP command (interactive)
-    warnings: boolean, optional
-      print warnings output by PHYLIP
+# aligners of the gene families, Clustalw (the default) is driven through its
+# interactive menu (see launch_msa())
+ALIGNERS = ('clustalw',) + tuple(MSA_BACKENDS)
 
-    Notes
-    -----
-        Use PHYLIP's protdist function.
+# largest family aligned by the accurate aligners in 'auto' mode (MAFFT
+# --auto runs L-INS-i up to 200 sequences), larger families go to Kalign
+AUTO_ALIGNER_MAX_MEMBERS = 200
+
+
+@lru_cache(maxsize=None)
+def available_aligners():
+    """ Return the aligners of ALIGNERS installed on the PATH.
     """
-    with open(phylip_command_fp, 'r') as phylip_command_f:
-        proc = subprocess.Popen("protdist",
-                                stdin=phylip_command_f,
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE,
-                                close_fds=True)
-        proc.wait()
-        stdout, stderr = proc.communicate()
-        if stderr and warnings:
-            print(stderr)
+    return tuple(aligner for aligner in ALIGNERS if which(aligner))
 
 
-def normalize_distances(phylip_fp,
-                        full_distance_matrix,
-                        num_species,
-                        full_distance_matrix_offset,
-                        species_set_dict,
-                        gene_bitvector_map,
-                        debug=False):
-    """ Parse and normalize the output file of PHYLIP's protdist function.
+def select_aligner(members, available=None):
+    """ Pick the aligner of a gene family in 'auto' mode.
+
+    Parameters
+    ----------
+    members: integer
+        number of members of the gene family
+    available: list, optional
+        installed aligners (default: available_aligners())
+
+    Returns
+    -------
+    string
+        the first installed of MAFFT, Muscle, Kalign and Clustalw for
+        families of at most AUTO_ALIGNER_MAX_MEMBERS members, of Kalign,
+        MAFFT, Muscle and Clustalw for larger families
+    """
+    if available is None:
+        available = available_aligners()
+    if members <= AUTO_ALIGNER_MAX_MEMBERS:
+        preference = ('mafft', 'muscle', 'kalign', 'clustalw')
+    else:
+        preference = ('kalign', 'mafft', 'muscle', 'clustalw')
+    for aligner in preference:
+        if aligner in available:
+            return aligner
+    raise ValueError("None of the aligners is installed: %s"
+                     % ', '.join(ALIGNERS))
+
+
+def launch_msa_backend(aligner,
+                       ref_db,
+                       hits,
+                       query,
+                       timeout,
+                       fast=False):
+    """ Create MSA for all gene orthologs with a streaming aligner.
+
+    Parameters
+    ----------
+    aligner: string
+        aligner of MSA_BACKENDS
+    ref_db: dictionary
+        dictionary storing FASTA label as key and sequence as value for the
+        reference databases
+    hits: HomologTable or dictionary
+        table storing query (gene) names as keys and the best aligning
+        reference sequences as values (one alignment per reference sequence)
+    query: string
+        query gene name
+    timeout: integer
+        number of seconds to allow the aligner to run before terminating the
+        process
+    fast: boolean, optional
+        use the faster setting of the aligner
+
+    Returns
+    -------
+    job: JobResult
+        resources used by the aligner
+    labels: list
+        names of the members (see phylip_name()) in the order of the
+        alignment, empty if the aligner timed out
+    sequences: list
+        aligned sequences, empty if the aligner timed out
+
+    Notes
+    -----
+        The sequences are written to the standard input of the aligner and
+        the alignment is read from its standard output, no file is written.
+    """
+    backend = MSA_BACKENDS[aligner]
+    command = backend.fast_command if fast else backend.command
+    if command is None:
+        raise ValueError("%s has no fast setting" % aligner)
+    fasta = ''.join(">%s\n%s\n" % (phylip_name(position), ref_db[ref])
+                    for position, ref in enumerate(hits[query]))
+    job = run_command(command, input=fasta.encode('ascii'), timeout=timeout,
+                      keep_output=True)
+    if job.timed_out:
+        return job, [], []
+    if job.status != 0:
+        raise ValueError("%s failed on the gene family of %s (status %s): %s"
+                         % (aligner, query, job.status,
+                            job.error.decode('utf-8', 'replace')))
+    labels, sequences = parse_fasta_alignment(job.output.decode('ascii'))
+    return job, labels, sequences
+
+
+def compute_distances(phylip_command_fp,
+                      warnings=False):
+    """ Compute distances between each pair of sequences in the MSA.
+
+    Parameters
+    ----------
+    phylip_command_fp: string
+      filepath to the PHYLIP command (interactive)
+    warnings: boolean, optional
+      print warnings output by PHYLIP
+
+    Returns
+    -------
+    JobResult
+      resources used by protdist
+
+    Notes
+    -----
+        Use PHYLIP's protdist function.
+    """
+    with open(phylip_command_fp, 'r') as phylip_command_f:
+        result = run_command("protdist", stdin=phylip_command_f)
+        if result.error and warnings:
+            print(result.error)
+    return result
+
+
+def parse_phylip_alignment(phy_msa_fp):
+    """ Parse an interleaved (or sequential) PHYLIP alignment.
+
+    Parameters
+    ----------
+    phy_msa_fp: string
+        filepath to PHYLIP alignment output by Clustalw
+
+    Returns
+    -------
+    labels: list
+        sequence names in the order of the alignment
+    sequences: list
+        aligned sequences (strings of equal length)
+    """
+    with open(phy_msa_fp, 'r') as phy_msa_f:
+        lines = [line.rstrip('\n') for line in phy_msa_f if line.strip()]
+    if not lines:
+        raise ValueError('%s does not exist or is empty' % phy_msa_fp)
+    num_seqs, length = [int(x) for x in lines[0].split()[:2]]
+    labels = []
+    sequences = []
+    for line in lines[1:num_seqs+1]:
+        labels.append(line[:10].strip())
+        sequences.append([''.join(line[10:].split())])
+    for idx, line in enumerate(lines[num_seqs+1:]):
+        sequences[idx % num_seqs].append(''.join(line.split()))
+    sequences = [''.join(seq) for seq in sequences]
+    for label, seq in zip(labels, sequences):
+        if len(seq) != length:
+            raise ValueError(
+                "Sequence %s has length %s, expected %s" % (
+                    label, len(seq), length))
+    return labels, sequences
+
+
+def parse_fasta_alignment(text):
+    """ Parse aligned sequences in FASTA format.
+
+    Parameters
+    ----------
+    text: string
+        aligned sequences in FASTA format (sequences may span several lines)
+
+    Returns
+    -------
+    labels: list
+        sequence names (first word of the headers) in the order of the
+        alignment
+    sequences: list
+        aligned sequences (strings of equal length)
+    """
+    labels = []
+    sequences = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('>'):
+            labels.append(line[1:].split()[0])
+            sequences.append([])
+        elif line:
+            if not labels:
+                raise ValueError("Sequence without a FASTA header: %s" % line)
+            sequences[-1].append(line)
+    sequences = [''.join(seq) for seq in sequences]
+    if sequences and len(set(map(len, sequences))) > 1:
+        raise ValueError("Aligned sequences have different lengths: %s" % (
+            dict(zip(labels, map(len, sequences)))))
+    return labels, sequences
+
+
+def format_phylip_alignment(labels, sequences):
+    """ Format aligned sequences as a sequential PHYLIP alignment.
+
+    Parameters
+    ----------
+    labels: list
+        sequence names of at most 10 characters
+    sequences: list
+        aligned sequences (strings of equal length)
+
+    Returns
+    -------
+    string
+        PHYLIP alignment as read by protdist and parse_phylip_alignment()
+    """
+    length = len(sequences[0]) if sequences else 0
+    return " %s %s\n%s" % (len(sequences), length, ''.join(
+        "%-10s%s\n" % (label, seq.upper())
+        for label, seq in zip(labels, sequences)))
+
+
+def _encode_alignment(sequences):
+    """ Encode aligned sequences as AMINO_ACIDS indices (-1 for gaps and
+    ambiguous residues).
+    """
+    lookup = numpy.full(256, -1, dtype=numpy.int8)
+    for idx, aa in enumerate(AMINO_ACIDS):
+        lookup[ord(aa)] = idx
+        lookup[ord(aa.lower())] = idx
+    raw = numpy.frombuffer(''.join(sequences).encode('ascii'),
+                           dtype=numpy.uint8)
+    return lookup[raw].reshape(len(sequences), -1)
+
+
+@lru_cache(maxsize=None)
+def _jtt_eigensystem():
+    """ Eigendecomposition of the JTT rate matrix (computed once).
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        left and right eigenvector matrices and the eigenvalues such that
+        P(t) = left * diag(exp(eigenvalues * t)) * right, with the rate
+        matrix scaled to one expected substitution per site
+    """
+    exchangeabilities = numpy.zeros(shape=(20, 20))
+    for i, row in enumerate(_JTT_EXCHANGEABILITIES.strip().split('\n')):
+        exchangeabilities[i+1, :i+1] = [float(x) for x in row.split()]
+    exchangeabilities += exchangeabilities.T
+    freqs = numpy.asarray(_JTT_FREQUENCIES)
+    freqs = freqs / freqs.sum()
+    rates = exchangeabilities * freqs
+    numpy.fill_diagonal(rates, -rates.sum(axis=1))
+    rates /= -numpy.dot(freqs, numpy.diag(rates))
+    # symmetrize with the frequencies to use a stable real eigensolver
+    sqrt_freqs = numpy.sqrt(freqs)
+    symmetric = rates * sqrt_freqs[:, None] / sqrt_freqs[None, :]
+    eigenvalues, eigenvectors = numpy.linalg.eigh(
+        (symmetric + symmetric.T) / 2)
+    left = eigenvectors / sqrt_freqs[:, None]
+    right = eigenvectors.T * sqrt_freqs[None, :]
+    return left, right, eigenvalues
+
+
+def _ml_distances(pair_counts,
+                  initial,
+                  max_distance,
+                  iterations=100,
+                  tolerance=1e-8):
+    """ Maximum likelihood JTT distances for a batch of sequence pairs.
+
+    Parameters
+    ----------
+    pair_counts: numpy.ndarray
+        array of shape (pairs, 20, 20) counting the aligned residue pairs
+    initial: numpy.ndarray
+        starting distance for every pair
+    max_distance: float
+        upper bound of the distances
+    iterations: integer, optional
+        maximum number of safeguarded Newton iterations
+    tolerance: float, optional
+        convergence tolerance on the distances
+
+    Returns
+    -------
+    numpy.ndarray
+        distance of every pair
+    """
+    left, right, eigenvalues = _jtt_eigensystem()
+    low = numpy.zeros(len(pair_counts))
+    high = numpy.full(len(pair_counts), max_distance)
+    t = numpy.clip(initial, 1e-6, max_distance)
+    for _ in range(iterations):
+        decay = numpy.exp(eigenvalues[None, :] * t[:, None])
+        # P(t) and its first two derivatives for every pair
+        prob = numpy.matmul(left[None, :, :] * decay[:, None, :], right)
+        d1 = numpy.matmul(
+            left[None, :, :] * (decay * eigenvalues)[:, None, :], right)
+        d2 = numpy.matmul(
+            left[None, :, :] * (decay * eigenvalues ** 2)[:, None, :], right)
+        prob = numpy.maximum(prob, 1e-300)
+        ratio = d1 / prob
+        grad = (pair_counts * ratio).sum(axis=(1, 2))
+        hess = (pair_counts * (d2 / prob - ratio ** 2)).sum(axis=(1, 2))
+        # keep a bracket around the root of the gradient and fall back to
+        # bisection whenever the Newton step leaves it
+        low = numpy.where(grad > 0, t, low)
+        high = numpy.where(grad > 0, high, t)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            step = t - grad / hess
+        bisect = (hess >= 0) | ~(step > low) | ~(step < high)
+        t_new = numpy.where(bisect, (low + high) / 2, step)
+        converged = numpy.abs(t_new - t) <= tolerance * numpy.maximum(t, 1)
+        t = t_new
+        if converged.all():
+            break
+    return t
+
+
+def compute_native_distances(phy_msa_fp,
+                             model='jtt',
+                             max_distance=10.0,
+                             batch_size=1024,
+                             alignment=None):
+    """ Compute pairwise protein distances of an MSA in-process.
+
+    Parameters
+    ----------
+    phy_msa_fp: string
+        filepath to PHYLIP alignment output by Clustalw
+    model: string, optional
+        distance model, one of DISTANCE_MODELS ('jtt' for the maximum
+        likelihood distance under the JTT matrix, 'kimura' for Kimura's
+        protein distance, 'poisson' for the Poisson corrected distance and
+        'p-distance' for the proportion of differing sites)
+    max_distance: float, optional
+        distance assigned to pairs too divergent for a finite estimate under
+        the 'jtt' model
+    batch_size: integer, optional
+        number of sequence pairs optimized together under the 'jtt' model
+    alignment: tuple of (list, list), optional
+        labels and aligned sequences already in memory, phy_msa_fp is not
+        read if given
+
+    Returns
+    -------
+    labels: list
+        sequence names in the order of the alignment
+    distances: numpy.ndarray
+        square matrix of pairwise distances (nan for pairs without comparable
+        sites or beyond the saturation of the Kimura and Poisson formulas)
+
+    Notes
+    -----
+        Replaces the protdist subprocess and the msa.dis file round trip.
+        Sites with a gap or an ambiguous residue in either sequence of a pair
+        are ignored for that pair, as in protdist.
+    """
+    if model not in DISTANCE_MODELS:
+        raise ValueError("Distance model not supported: %s" % model)
+    if alignment is None:
+        labels, sequences = parse_phylip_alignment(phy_msa_fp)
+    else:
+        labels, sequences = alignment
+    codes = _encode_alignment(sequences)
+    num_seqs = len(labels)
+    one_hot = (codes[:, :, None] == numpy.arange(20)).astype(numpy.float32)
+    one_hot = one_hot.reshape(num_seqs, -1)
+    valid = (codes >= 0).astype(numpy.float32)
+    compared = numpy.dot(valid, valid.T).astype(float)
+    identical = numpy.dot(one_hot, one_hot.T).astype(float)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        p = 1.0 - identical / compared
+        if model == 'p-distance':
+            distances = p
+        elif model == 'poisson':
+            distances = -numpy.log(1.0 - p)
+        elif model == 'kimura':
+            distances = -numpy.log(1.0 - p - 0.2 * p ** 2)
+        else:
+            distances = numpy.full((num_seqs, num_seqs), numpy.nan)
+            initial = -numpy.log(numpy.maximum(1.0 - p, 1e-3))
+            first, second = numpy.triu_indices(num_seqs, k=1)
+            keep = compared[first, second] > 0
+            first, second = first[keep], second[keep]
+            # residue pair counts of a batch of sequence pairs, gaps and
+            # ambiguous residues are dropped
+            for start in range(0, len(first), batch_size):
+                i = first[start:start+batch_size]
+                j = second[start:start+batch_size]
+                pair_codes = codes[i].astype(int) * 20 + codes[j]
+                pair_codes[(codes[i] < 0) | (codes[j] < 0)] = -1
+                offsets = numpy.arange(len(i))[:, None] * 400
+                valid_pairs = pair_codes >= 0
+                pair_counts = numpy.bincount(
+                    (pair_codes + offsets)[valid_pairs],
+                    minlength=len(i) * 400).reshape(len(i), 20, 20)
+                distances[i, j] = _ml_distances(
+                    pair_counts, initial[i, j], max_distance)
+                distances[j, i] = distances[i, j]
+    distances[~numpy.isfinite(distances)] = numpy.nan
+    distances[compared == 0] = numpy.nan
+    numpy.fill_diagonal(distances, 0.0)
+    return labels, distances
+
+
+# modes of the per-family distances: from a multiple sequence alignment,
+# alignment-free from the k-mers of the sequences or from the percent
+# identities of the homology search
+DISTANCE_MODES = ('msa', 'kmer', 'hits')
+
+
+def identity_distances(identities):
+    """ Poisson corrected distances of percent identities.
+
+    Parameters
+    ----------
+    identities: numpy.ndarray
+        percentages of identical positions of pairwise alignments
+
+    Returns
+    -------
+    numpy.ndarray
+        -ln(identity / 100), the number of substitutions per site under the
+        Poisson model (nan for missing or null identities)
+    """
+    identities = numpy.asarray(identities, dtype=float)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        distances = -numpy.log(numpy.minimum(identities, 100.0) / 100.0)
+    distances[~numpy.isfinite(distances)] = numpy.nan
+    return distances
+
+
+def compute_hit_distances(query, hits, gene_map, pair_identities=None):
+    """ Compute the distances of a gene family from its homology search.
+
+    Parameters
+    ----------
+    query: string
+        query gene name
+    hits: HomologTable
+        table storing query (gene) names as keys and their homologs as
+        values, with the percent identities of the alignments (see
+        parse_blast())
+    gene_map: GeneTable
+        id and species of every reference gene (see preprocess_data())
+    pair_identities: PairIdentities, optional
+        percent identities of the pairs of members (see
+        search_family_pairs())
+
+    Returns
+    -------
+    distances: numpy.ndarray
+        square matrix of the pairwise distances of the members of the family
+        in the order of hits[query] (see identity_distances()), nan for the
+        pairs without an alignment
+
+    Notes
+    -----
+        The row of the query gene itself (if the query proteome is one of the
+        reference proteomes) holds the distances of its alignments with the
+        other members. The other pairs are only filled by pair_identities.
+    """
+    members = hits[query]
+    member_ids = gene_map.ids(members)
+    num_members = len(members)
+    distances = numpy.full(shape=(num_members, num_members),
+                           fill_value=numpy.nan)
+    if pair_identities is not None:
+        first, second = numpy.triu_indices(num_members, k=1)
+        distances[first, second] = identity_distances(
+            pair_identities.get(member_ids[first], member_ids[second]))
+        distances[second, first] = distances[first, second]
+    rows = numpy.flatnonzero(member_ids == gene_map.index.get(query, -1))
+    if len(rows):
+        query_distances = identity_distances(hits.query_identities(query))
+        distances[rows[0], :] = query_distances
+        distances[:, rows[0]] = query_distances
+    numpy.fill_diagonal(distances, 0.0)
+    return distances
+
+
+def compute_kmer_distances(sequences,
+                           kmer_size=4,
+                           block_size=1 << 16):
+    """ Compute alignment-free pairwise protein distances from k-mer sets.
+
+    Parameters
+    ----------
+    sequences: list
+        unaligned protein sequences
+    kmer_size: integer, optional
+        length of the k-mers (at most 14)
+    block_size: integer, optional
+        number of distinct k-mers counted at once
+
+    Returns
+    -------
+    distances: numpy.ndarray
+        square matrix of pairwise Mash distances (nan for pairs without a
+        shared k-mer)
+
+    Notes
+    -----
+        The Jaccard index J of the k-mer sets of two sequences is computed
+        exactly and converted to the Mash distance -1/k * ln(2J / (1 + J)),
+        an estimate of the substitutions per residue (Ondov et al. 2016).
+        K-mers with an ambiguous residue are ignored. The shared k-mers of
+        all pairs are counted as the product of the sequence x k-mer
+        indicator matrix with its transpose, block_size k-mers at a time.
+    """
+    if not 0 < kmer_size <= 14:
+        raise ValueError("k-mer size must be between 1 and 14: %s"
+                         % kmer_size)
+    num_seqs = len(sequences)
+    powers = 20 ** numpy.arange(kmer_size - 1, -1, -1, dtype=numpy.int64)
+    rows = []
+    kmers = []
+    for row, seq in enumerate(sequences):
+        codes = _encode_alignment([seq])[0].astype(numpy.int64)
+        if len(codes) < kmer_size:
+            continue
+        windows = numpy.lib.stride_tricks.sliding_window_view(
+            codes, kmer_size)
+        ids = numpy.unique(
+            windows[(windows >= 0).all(axis=1)].dot(powers))
+        rows.append(numpy.full(len(ids), row))
+        kmers.append(ids)
+    rows = numpy.concatenate(rows) if rows else numpy.zeros(0, dtype=int)
+    kmers = numpy.concatenate(kmers) if kmers else numpy.zeros(0, dtype=int)
+    counts = numpy.bincount(rows, minlength=num_seqs).astype(float)
+    # number the k-mers shared by several sequences 0, 1, 2 .., the others
+    # only add to the counts
+    _, columns, occurrences = numpy.unique(kmers, return_inverse=True,
+                                           return_counts=True)
+    columns = columns.ravel()
+    keep = occurrences[columns] > 1
+    rows = rows[keep]
+    _, columns = numpy.unique(columns[keep], return_inverse=True)
+    columns = columns.ravel()
+    # float32 counts are exact up to 2^24 shared k-mers
+    shared = numpy.zeros(shape=(num_seqs, num_seqs), dtype=numpy.float32)
+    for start in range(0, columns.max() + 1 if len(columns) else 0,
+                       block_size):
+        block = (columns >= start) & (columns < start + block_size)
+        present = numpy.zeros(shape=(num_seqs, block_size),
+                              dtype=numpy.float32)
+        present[rows[block], columns[block] - start] = 1
+        shared += present.dot(present.T)
+    shared = shared.astype(float)
+    numpy.fill_diagonal(shared, counts)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        jaccard = shared / (counts[:, None] + counts[None, :] - shared)
+        distances = numpy.log((1 + jaccard) / (2 * jaccard)) / kmer_size
+    distances[~numpy.isfinite(distances)] = numpy.nan
+    numpy.fill_diagonal(distances, 0.0)
+    return distances
+
+
+def normalize_distances(phylip_fp,
+                        full_distance_matrix,
+                        num_species,
+                        full_distance_matrix_offset,
+                        species_set_dict,
+                        gene_bitvector_map,
+                        debug=False,
+                        species=None):
+    """ Parse and normalize the output file of PHYLIP's protdist function.
 
     Parameters
     ----------
@@ -462,13 +2032,19 @@ def normalize_distances(phylip_fp,
         the index offset for elements in full_distance_matrix where to write
         the next array
     species_set_dict: dictionary
-        dictionary containing the binary indicator vectors as keys and the
-        number of genes with identical species set represented by the binary
-        vectors as values
+        dictionary containing the binary indicator vectors (encoded by
+        encode_species_set()) as keys and the number of genes with identical
+        species set represented by the binary vectors as values
     gene_bitvector_map: list
-        list containing the binary indicator vector for each query gene
+        list containing the encoded binary indicator vector for each query
+        gene
     debug: boolean
         if True, run function in debug mode
+    species: array_like, optional
+        species index of every member of the gene family, in the order of the
+        family, when protdist names the members by their position (see
+        phylip_name()) as in compute_family_distances() (default: parsed from
+        species_gene labels)
 
     Notes
     -----
@@ -512,65 +2088,111 @@ def normalize_distances(phylip_fp,
 
         (species pairs)
     """
-    # assume a pairwise alignment exists for all species
-    missing_species = [str(x) for x in range(0, num_species)]
-    # scan through file and remove species that exist
-    # from missing_species list
-    if exists(phylip_fp) and getsize(phylip_fp) > 0:
-        with open(phylip_fp, 'r') as phylip_f:
-            next(phylip_f)
-            for line in phylip_f:
-                if not line.startswith(' '):
-                    species = line.split()[0].split('_')[0]
-                    missing_species.remove(species)
-    else:
+    labels, distances = parse_phylip_distances(phylip_fp, debug=debug)
+    if species is not None:
+        species = numpy.asarray(species)[[phylip_position(label)
+                                          for label in labels]]
+    normalize_distance_matrix(
+        labels=labels,
+        distances=distances,
+        full_distance_matrix=full_distance_matrix,
+        num_species=num_species,
+        full_distance_matrix_offset=full_distance_matrix_offset,
+        species_set_dict=species_set_dict,
+        gene_bitvector_map=gene_bitvector_map,
+        species=species)
+
+
+def parse_phylip_distances(phylip_fp, debug=False):
+    """ Parse the distance matrix output by PHYLIP's protdist function.
+
+    Parameters
+    ----------
+    phylip_fp: string
+        filepath to distance matrix output by PHYLIP's protdist function
+    debug: boolean, optional
+        if True, run function in debug mode
+
+    Returns
+    -------
+    labels: list
+        sequence names in the order of the rows
+    distances: numpy.ndarray
+        square matrix of pairwise distances
+    """
+    if not exists(phylip_fp) or getsize(phylip_fp) == 0:
         raise ValueError('%s does not exist or is empty' % phylip_fp)
 
-    # scan through file again, collecting alignment
-    # distances
-    orig_order_labels = []
-    p = numpy.empty(shape=(num_species, num_species))
-    p.fill(numpy.nan)
-    idx = 0
     with open(phylip_fp, 'r') as phylip_f:
-        alignment_list = []
-        # skip first line containing number of lines in
-        # the file
-        next(phylip_f)
-        for line in phylip_f:
-            if debug:
-                sys.stdout.write("[DEBUG] %s" % line)
-            alignment_dist = line.strip().split()
-            if line.startswith(' '):
-                alignment_list.extend(alignment_dist)
-            else:
-                # new species alignment pairs
-                if alignment_list:
-                    for i in range(0, len(missing_species)):
-                        alignment_list.append(None)
-                    a = numpy.asarray(alignment_list[1:], dtype=float)
-                    a[idx] = numpy.nan
-                    p[idx] = (a - numpy.nanmean(a)) / numpy.nanstd(a)
-                    idx += 1
-                    orig_order_labels.append(alignment_list[0])
-                alignment_list = alignment_dist
-
-    # add distance on final line
-    for i in range(0, len(missing_species)):
-        alignment_list.append(None)
-    a = numpy.asarray(alignment_list[1:], dtype=float)
-    a[idx] = numpy.nan
-    p[idx] = (a - numpy.nanmean(a)) / numpy.nanstd(a)
-    orig_order_labels.append(alignment_list[0])
-
-    # add the missing species names to the labels array
-    bitvector_gene = 'I' * num_species
-    for species in missing_species:
-        orig_order_labels.append("%s_X" % species)
-        # indicate missing gene for current species
-        x = list(bitvector_gene)
-        x[int(species)] = 'O'
-        bitvector_gene = ''.join(x)
+        text = phylip_f.read()
+    if debug:
+        # skip first line containing number of lines in the file
+        for line in text.splitlines(True)[1:]:
+            sys.stdout.write("[DEBUG] %s" % line)
+    # the first token is the number of sequences, then every row is a label
+    # followed by its distances (rows may wrap onto continuation lines)
+    tokens = text.split()
+    num_rows = int(tokens[0])
+    if len(tokens) != 1 + num_rows * (num_rows + 1):
+        raise ValueError('%s is not a square distance matrix' % phylip_fp)
+    table = numpy.array(tokens[1:]).reshape(num_rows, num_rows + 1)
+    return table[:, 0].tolist(), table[:, 1:].astype(float)
+
+
+def normalize_distance_matrix(labels,
+                              distances,
+                              full_distance_matrix,
+                              num_species,
+                              full_distance_matrix_offset,
+                              species_set_dict,
+                              gene_bitvector_map,
+                              species=None):
+    """ Z-score normalize a gene family's distance matrix.
+
+    Parameters
+    ----------
+    labels: list
+        pseudo names (species_gene) of the family members, in the order of
+        the rows of distances (only read if species is None)
+    distances: list or numpy.ndarray
+        pairwise distances between the family members (one row per member)
+    full_distance_matrix: dictionary
+        complete distance matrix for pairwise alignments between all species
+        for every gene
+    num_species: integer
+        number of species in the reference database
+    full_distance_matrix_offset: integer
+        the index offset for elements in full_distance_matrix where to write
+        the next array
+    species_set_dict: dictionary
+        dictionary containing the binary indicator vectors (encoded by
+        encode_species_set()) as keys and the number of genes with identical
+        species set represented by the binary vectors as values
+    gene_bitvector_map: list
+        list containing the encoded binary indicator vector for each query
+        gene
+    species: array_like, optional
+        species index of the family members, in the order of the rows of
+        distances (default: parsed from labels)
+
+    Notes
+    -----
+        Shared by the protdist (normalize_distances()) and the native
+        (compute_native_distances()) distance engines, see
+        normalize_distances() for an example.
+    """
+    if species is None:
+        species = [int(label.split('_')[0]) for label in labels]
+    species = numpy.asarray(species, dtype=numpy.intp)
+    if len(species) and (species.min() < 0 or species.max() >= num_species):
+        raise ValueError("Species out of range in labels: %s" % labels)
+    distances = numpy.array(distances, dtype=float).reshape(
+        len(species), len(species))
+
+    # the species set of the gene
+    present = numpy.zeros(shape=num_species, dtype=bool)
+    present[species] = True
+    bitvector_gene = encode_species_set(present)
 
     # update species set counts
     if bitvector_gene not in species_set_dict:
@@ -580,35 +2202,43 @@ def normalize_distances(phylip_fp,
 
     gene_bitvector_map[full_distance_matrix_offset] = bitvector_gene
 
-    # sort the distance matrix based on species names (S1, S2, S3 ..)
-    # in order to be consistent across all gene families
-    x = numpy.argsort(numpy.array(orig_order_labels))
-
-    # re-order rows and columns by ordered species name (0,1,2 ..)
-    p2 = numpy.zeros(shape=(num_species, num_species))
-    for idx_a, arr in enumerate(p):
-        t = numpy.zeros(shape=num_species)
-        for idx_b, el in enumerate(arr):
-            t[x[idx_b]] = el
-        p2[x[idx_a]] = t
-    del p
-
-    # add normalized distance matrix for current gene
-    # to full distance matrix
-    full_distance_matrix[full_distance_matrix_offset] = p2
+    # Z-score normalize the distances of every member to the other members,
+    # a member is never compared to itself and nan distances are ignored,
+    # then write the normalized distances ordered by species (0, 1, 2 ..) to
+    # the gene's slice of the full distance matrix so that the species are
+    # consistent across all gene families, the rows and columns of missing
+    # species are nan
+    gene_matrix = full_distance_matrix[full_distance_matrix_offset]
+    if JIT_KERNELS:
+        kernels.scatter_zscores(distances, species,
+                                numpy.asarray(gene_matrix))
+        return
+    numpy.fill_diagonal(distances, numpy.nan)
+    present_distances = ~numpy.isnan(distances)
+    counts = present_distances.sum(axis=1)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        mean = numpy.where(present_distances, distances, 0).sum(
+            axis=1) / counts
+        deviations = distances - mean[:, None]
+        stdev = numpy.sqrt(numpy.where(
+            present_distances, deviations ** 2, 0).sum(axis=1) / counts)
+        zscores = deviations / stdev[:, None]
+    gene_matrix[...] = numpy.nan
+    gene_matrix[numpy.ix_(species, species)] = zscores
 
 
 def cluster_distances(species_set_dict,
                       species_set_size,
-                      hamming_distance):
+                      hamming_distance,
+                      chunk_size=4096):
     """ Hamming distance clustering algorithm
 
     Parameters
     ----------
     species_set_dict: dictionary
-        dictionary containing the binary indicator vectors as
-        keys and the number of genes with identical species
-        set represented by the binary vectors as values
+        dictionary containing the binary indicator vectors (encoded by
+        encode_species_set()) as keys and the number of genes with identical
+        species set represented by the binary vectors as values
     species_set_size: integer
         threshold number of genes in a species set to
         allow it to form a core cluster
@@ -617,6 +2247,8 @@ def cluster_distances(species_set_dict,
         indicator vectors (ex. IIII and I0II) for the
         genes in a candidate vector to be merged into the
         core cluster
+    chunk_size: integer, optional
+        number of candidate species sets compared to all cores at once
 
     Returns
     -------
@@ -645,52 +2277,101 @@ def cluster_distances(species_set_dict,
         present in the four genes: IIIII (gene 0, 2 and 3), II0II (gene 1). If
         the core set threshold was 3, then there would be 1 core species set
         represented by IIIII.
+
+        The cores within hamming_distance of the candidate species sets are
+        looked up in a multi-index hash of the packed bit arrays of the
+        cores, only the species sets far from every core are compared to all
+        cores (see HammingIndex).
     """
-    sorted_species_set = sorted(list(species_set_dict.items()),
-                                key=operator.itemgetter(1), reverse=True)
+    # species sets by decreasing number of genes (ties keep their order of
+    # insertion in species_set_dict)
+    sorted_species_set = sorted(species_set_dict, key=species_set_dict.get,
+                                reverse=True)
+    counts = numpy.array([species_set_dict[bv] for bv in sorted_species_set])
     # determine core clusters (initial species sets with more than
     # species_set_size genes)
-    gene_clusters_list = []
-    # if the largest species set contains less than threshold
-    # (species_set_size) elements, set the only core cluster to the largest
-    # species set
-    if sorted_species_set[0][1] < species_set_size:
-        cluster_core = (sorted_species_set[0][0], [])
-        gene_clusters_list = []
-    for bitvector in sorted_species_set:
-        if bitvector[1] >= species_set_size:
-            cluster_core = (bitvector[0], [])
-            gene_clusters_list.append(cluster_core)
-    # assign species sets with fewer than species_set_size species to core
-    # clusters if the Hamming distance between the two bitvectors is less than
-    # hamming_distance
-    species_set_assigned = []
-    for idx, cluster_core in enumerate(gene_clusters_list):
-        for bitvector in sorted_species_set:
-            bv = bitvector[0]
-            if (bv not in species_set_assigned and
-                    hamming(cluster_core[0], bv) <= hamming_distance):
-                gene_clusters_list[idx][1].append(bv)
-                species_set_assigned.append(bv)
-    # assign the remaining species sets to the cluster with the closest core
-    # Hamming distance
-    for bitvector in sorted_species_set:
-        bv = bitvector[0]
-        if bv not in species_set_assigned:
-            min_hamming_cluster = -1
-            min_hamming_distance = sys.maxsize
-            # find cluster core with smallest Hamming distance to species set
-            for idx, cluster_core in enumerate(gene_clusters_list):
-                dist = hamming(cluster_core[0], bv)
-                if dist < min_hamming_distance:
-                    min_hamming_distance = dist
-                    min_hamming_cluster = idx
-            if min_hamming_cluster >= 0:
-                gene_clusters_list[min_hamming_cluster][1].append(bv)
+    core_idx = numpy.flatnonzero(counts >= species_set_size)
+    gene_clusters_list = [(sorted_species_set[idx], []) for idx in core_idx]
+    if not gene_clusters_list:
+        return gene_clusters_list
+    words = species_set_words(sorted_species_set)
+    core_words = words[core_idx]
+    # assign species sets to the first core cluster (in order of cluster
+    # size) within hamming_distance, the remaining species sets go to the
+    # cluster with the closest core Hamming distance (first one on ties)
+    index = HammingIndex(core_words, hamming_distance)
+    cluster_idx = numpy.empty(shape=len(sorted_species_set), dtype=int)
+    for start in range(0, len(sorted_species_set), chunk_size):
+        cluster_idx[start:start+chunk_size] = index.first_within(
+            words[start:start+chunk_size])
+    within = cluster_idx >= 0
+    if not within.all():
+        cluster_idx[~within] = index.nearest(words[~within], chunk_size)[0]
+    for assigned in (True, False):
+        for idx in numpy.flatnonzero(within == assigned):
+            gene_clusters_list[cluster_idx[idx]][1].append(
+                sorted_species_set[idx])
 
     return gene_clusters_list
 
 
+def gene_cluster_index(words, gene_clusters_list):
+    """ Map every gene to its core cluster.
+
+    Parameters
+    ----------
+    words: numpy.ndarray
+        uint64 array of shape (genes, words) of the species set of every gene
+        (see DistanceCheckpoint)
+    gene_clusters_list: list of tuples
+        core species sets and their species sets (see cluster_distances())
+
+    Returns
+    -------
+    numpy.ndarray
+        index in gene_clusters_list of the cluster of every gene (-1 if its
+        species set is in no cluster)
+    """
+    cluster_of = {}
+    for cluster, (_, species_sets) in enumerate(gene_clusters_list):
+        for species_set in species_sets:
+            cluster_of.setdefault(species_set, cluster)
+    if not len(words):
+        return numpy.zeros(shape=0, dtype=int)
+    species_sets, inverse = numpy.unique(words, axis=0, return_inverse=True)
+    clusters = numpy.array([cluster_of.get(species_set.tobytes(), -1)
+                            for species_set in species_sets], dtype=int)
+    return clusters[inverse.ravel()]
+
+
+def outlier_bounds(mean, stdev, stdev_offset):
+    """ Bounds of the typical distances of every species pair.
+
+    Parameters
+    ----------
+    mean: numpy.ndarray
+        num_species x num_species matrix of the mean distances
+    stdev: numpy.ndarray
+        num_species x num_species matrix of the standard deviations
+    stdev_offset: float
+        the number of standard deviations from the mean of an outlier
+
+    Returns
+    -------
+    tuple
+        (low_bound, up_bound) matrices rounded to 5 decimals
+    """
+    # Python's round() keeps the bounds identical to the scalar version of
+    # detect_outlier_genes(), there are only num_species x num_species of them
+    low_bound = numpy.array(
+        [round(x, 5) for x in (mean - stdev_offset*stdev).ravel()]).reshape(
+            mean.shape)
+    up_bound = numpy.array(
+        [round(x, 5) for x in (mean + stdev_offset*stdev).ravel()]).reshape(
+            mean.shape)
+    return low_bound, up_bound
+
+
 def detect_outlier_genes(species_set,
                          gene_bitvector_map,
                          full_distance_matrix,
@@ -698,7 +2379,10 @@ def detect_outlier_genes(species_set,
                          outlier_hgt,
                          num_species,
                          total_genes,
-                         debug=False):
+                         chunk_size=None,
+                         debug=False,
+                         statistics=None,
+                         genes=None):
     """ Detect outlier genes.
 
     Parameters
@@ -706,8 +2390,9 @@ def detect_outlier_genes(species_set,
     species_set: list
         list of bitvectors representing species clusters to use in detecting
         outlier genes
-    gene_bitvector_map: list
-        list containing the binary indicator vector for each query gene
+    gene_bitvector_map: list or numpy.ndarray
+        list containing the encoded binary indicator vector for each query
+        gene (or their uint64 words, see DistanceCheckpoint)
     full_distance_matrix: dictionary
         complete distance matrix for pairwise alignments between all species
         for every gene
@@ -723,8 +2408,18 @@ def detect_outlier_genes(species_set,
     total_genes: integer
         total number of genes in the query genome with at least
         min_num_homologs (determined by BLAST search)
+    chunk_size: integer, optional
+        number of genes processed at once, bounds the temporary arrays to
+        chunk_size x num_species x num_species elements (default: all genes)
     debug: boolean
         if True, run function in debug mode
+    statistics: tuple, optional
+        precomputed (mean, stdev) of every species pair (see
+        species_pair_statistics()) over full_distance_matrix rounded to 5
+        decimals (default: computed over the genes tested)
+    genes: numpy.ndarray, optional
+        indices of the genes to test, for example those of a core cluster
+        (see gene_cluster_index()) (default: all total_genes genes)
 
     Returns
     -------
@@ -754,63 +2449,149 @@ def detect_outlier_genes(species_set,
           [n_0, n_1, n_2, .., n_n]]]
 
         The mean and standard deviation are computed for each species pair
-        including all genes.
+        including all genes tested. The distances are rounded to 5 decimals
+        chunk by chunk, full_distance_matrix is not modified.
     """
-    numpy.around(full_distance_matrix, decimals=5, out=full_distance_matrix)
-    outlier_flag_matrix = numpy.zeros(
-        shape=(total_genes, num_species, num_species), dtype=bool)
-    distance_vector = numpy.zeros(total_genes)
+    if genes is None:
+        genes = numpy.arange(total_genes)
+    if chunk_size is None or chunk_size < 1:
+        chunk_size = max(len(genes), 1)
+    if statistics is None:
+        mean, stdev = species_pair_statistics(full_distance_matrix,
+                                              chunk_size, genes=genes,
+                                              decimals=5)
+    else:
+        mean, stdev = statistics
+    low_bound, up_bound = outlier_bounds(mean, stdev, stdev_offset)
+    # a species is never compared to itself
+    off_diagonal = ~numpy.eye(num_species, dtype=bool)
+
+    # flag the outlier distances chunk by chunk along the gene axis, count
+    # them for every gene and species and label the gene as outlier if the
+    # number of outlier distances of a species exceeds the threshold
+    outlier_genes = set()
+    for start in range(0, len(genes), chunk_size):
+        chunk_genes = genes[start:start+chunk_size]
+        chunk = _gene_rows(full_distance_matrix, chunk_genes, decimals=5)
+        # nan distances compare False and are never outliers
+        outlier_flags = ((chunk < low_bound) | (chunk > up_bound))
+        outlier_flags &= off_diagonal
+        outlier_count_matrix = outlier_flags.sum(axis=1)
+        outliers = (outlier_count_matrix > num_species*outlier_hgt).any(
+            axis=1)
+        outlier_genes.update(int(x) for x in chunk_genes[outliers])
+
     if debug:
         sys.stdout.write("[DEBUG] species_species\t")
         for k in range(total_genes):
             sys.stdout.write("gene # %s".ljust(12) % k)
         sys.stdout.write("[low_bound, up_bound]\n")
-    for i in range(num_species):
-        for j in range(num_species):
-            if i != j:
-                for k in range(total_genes):
-                    distance_vector[k] = full_distance_matrix[k][i][j]
-                mean = numpy.nanmean(distance_vector)
-                stdev = numpy.nanstd(distance_vector)
-                low_bound = round(mean - stdev_offset*stdev, 5)
-                up_bound = round(mean + stdev_offset*stdev, 5)
-                if debug:
-                    sys.stdout.write("[DEBUG] %s_%s\t".ljust(20) % (i, j))
-                for k, distance in enumerate(distance_vector):
-                    spaces = "".ljust(2)
-                    if distance < 0:
-                        spaces = "".ljust(1)
-                    if (distance != numpy.nan and
-                       ((distance < low_bound) or (distance > up_bound))):
-                        outlier_flag_matrix[k][i][j] = 1
-                        if debug:
-                            sys.stdout.write(
-                                "%s\033[92m%s\033[0m" % (spaces, distance))
-                    elif debug:
+        for i in range(num_species):
+            for j in range(num_species):
+                if i == j:
+                    continue
+                sys.stdout.write("[DEBUG] %s_%s\t".ljust(20) % (i, j))
+                for distance in numpy.around(
+                        full_distance_matrix[:total_genes, i, j], decimals=5):
+                    spaces = "".ljust(1 if distance < 0 else 2)
+                    if (distance < low_bound[i, j] or
+                            distance > up_bound[i, j]):
+                        sys.stdout.write(
+                            "%s\033[92m%s\033[0m" % (spaces, distance))
+                    else:
                         sys.stdout.write("%s%s" % (spaces, distance))
-                if debug:
-                    sys.stdout.write("\t[%s, %s]\n" % (low_bound, up_bound))
-
-    # traverse outlier_matrix by gene and count the number of outlier
-    # distances by species
-    outlier_count_matrix = numpy.zeros(
-        shape=(total_genes, num_species), dtype=int)
-    for i in range(total_genes):
-        for j in range(num_species):
-            for k in range(num_species):
-                if outlier_flag_matrix[i][j][k]:
-                    outlier_count_matrix[i][k] += 1
-
-    # if number of outlier distances exceeds threshold, label gene as outlier
-    outlier_genes = set()
-    for i in range(total_genes):
-        for j in range(num_species):
-            if outlier_count_matrix[i][j] > num_species*outlier_hgt:
-                outlier_genes.add(i)
+                sys.stdout.write("\t[%s, %s]\n" % (
+                    low_bound[i, j], up_bound[i, j]))
 
     return outlier_genes
 
 
+def _gene_rows(full_distance_matrix, genes, decimals=None):
+    """ Read the distance matrices of sorted genes (a slice if contiguous).
+    """
+    if len(genes) and genes[-1] - genes[0] == len(genes) - 1:
+        rows = full_distance_matrix[genes[0]:genes[-1]+1]
+    else:
+        rows = full_distance_matrix[genes]
+    if decimals is not None:
+        rows = numpy.around(rows, decimals=decimals)
+    return rows
+
+
+def species_pair_statistics(full_distance_matrix, chunk_size, pairs=None,
+                            genes=None, decimals=None):
+    """ Mean and standard deviation of every species pair over all genes.
+
+    Parameters
+    ----------
+    full_distance_matrix: numpy.ndarray
+        complete distance matrix for pairwise alignments between all species
+        for every gene
+    chunk_size: integer
+        number of genes processed at once
+    pairs: numpy.ndarray, optional
+        num_species x num_species boolean mask of the species pairs to
+        compute (default: all pairs)
+    genes: numpy.ndarray, optional
+        sorted indices of the genes to include (default: all genes)
+    decimals: integer, optional
+        number of decimals the distances are rounded to (chunk by chunk)
+
+    Returns
+    -------
+    mean: numpy.ndarray
+        num_species x num_species matrix of means ignoring nan's
+    stdev: numpy.ndarray
+        num_species x num_species matrix of (population) standard deviations
+        ignoring nan's
+
+    Notes
+    -----
+        Equivalent to numpy.nanmean() and numpy.nanstd() along the gene axis
+        but reads full_distance_matrix in chunks of genes (two passes) so the
+        temporary arrays stay bounded. Species pairs without any distance and
+        pairs left out of pairs get nan's.
+    """
+    if genes is None:
+        genes = numpy.arange(full_distance_matrix.shape[0])
+    shape = full_distance_matrix.shape[1:]
+    # only the columns of the selected pairs are read from every chunk
+    index = (slice(None),)
+    if pairs is not None:
+        select = numpy.nonzero(pairs)
+        index += select
+        shape = (len(select[0]),)
+    chunks = [genes[start:start+chunk_size]
+              for start in range(0, len(genes), chunk_size)]
+    total = numpy.zeros(shape=shape)
+    count = numpy.zeros(shape=shape)
+    for chunk_genes in chunks:
+        chunk = _gene_rows(full_distance_matrix, chunk_genes,
+                           decimals)[index]
+        present = ~numpy.isnan(chunk)
+        total += numpy.where(present, chunk, 0).sum(axis=0)
+        count += present.sum(axis=0)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        mean = total / count
+    squares = numpy.zeros(shape=shape)
+    for chunk_genes in chunks:
+        chunk = _gene_rows(full_distance_matrix, chunk_genes,
+                           decimals)[index]
+        deviation = chunk - mean
+        squares += numpy.where(numpy.isnan(chunk), 0, deviation ** 2).sum(
+            axis=0)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        stdev = numpy.sqrt(squares / count)
+    if pairs is None:
+        return mean, stdev
+    pair_mean = numpy.full(shape=full_distance_matrix.shape[1:],
+                           fill_value=numpy.nan)
+    pair_stdev = pair_mean.copy()
+    pair_mean[select] = mean
+    pair_stdev[select] = stdev
+    return pair_mean, pair_stdev
+
+
 def output_full_matrix(matrix, num_species):
     """ Output distance matrix to stdout
     """
@@ -822,49 +2603,1834 @@ def output_full_matrix(matrix, num_species):
             sys.stdout.write("\n")
 
 
-def distance_method(query_proteome_fp,
-                    target_proteomes_dir,
-                    working_dir,
-                    output_hgt_fp,
-                    align_software,
-                    tabular_alignments_fp=None,
-                    ext=['fa', 'fasta', 'faa'],
-                    min_num_homologs=3,
-                    e_value=10e-20,
-                    threads=1,
-                    stdev_offset=2.326,
-                    outlier_hgt=0.5,
-                    species_set_size=30,
-                    hamming_distance=2,
-                    verbose=False,
-                    debug=False,
-                    warnings=False,
-                    timeout=120):
-    """ Run Distance Method algorithm
+class SpeciesPairAccumulator(object):
+    """ Running mean and variance of the distances of every species pair.
+
+    Parameters
+    ----------
+    num_species: integer
+        number of species in the reference database
+
+    Attributes
+    ----------
+    count: numpy.ndarray
+        num_species x num_species matrix of the number of distances
+    mean: numpy.ndarray
+        num_species x num_species matrix of the mean distances
+    m2: numpy.ndarray
+        num_species x num_species matrix of the sums of squared deviations
+        from the mean
+
+    Notes
+    -----
+        The distances are added gene by gene (or chunk by chunk) with
+        Welford's update, merged as in Chan et al.'s parallel algorithm for
+        chunks, so only three num_species x num_species matrices are kept.
+        The distances are rounded to 5 decimals as in detect_outlier_genes()
+        and nan's are ignored, statistics() then matches
+        species_pair_statistics() over all the genes added.
+    """
+
+    def __init__(self, num_species):
+        shape = (num_species, num_species)
+        self.count = numpy.zeros(shape=shape)
+        self.mean = numpy.zeros(shape=shape)
+        self.m2 = numpy.zeros(shape=shape)
+
+    def update(self, distances):
+        """ Add a distance matrix or a chunk (genes x species x species).
+        """
+        distances = numpy.around(distances, decimals=5)
+        if distances.ndim == 2:
+            distances = distances[numpy.newaxis]
+        distances = distances.astype(float)
+        present = ~numpy.isnan(distances)
+        count = present.sum(axis=0)
+        updated = count > 0
+        if not updated.any():
+            return
+        count = count[updated]
+        chunk = distances[:, updated]
+        present = present[:, updated]
+        chunk_mean = numpy.where(present, chunk, 0).sum(axis=0) / count
+        chunk_m2 = (numpy.where(present, chunk - chunk_mean, 0) ** 2).sum(
+            axis=0)
+        previous = self.count[updated]
+        total = previous + count
+        delta = chunk_mean - self.mean[updated]
+        self.mean[updated] += delta * count / total
+        self.m2[updated] += chunk_m2 + delta ** 2 * previous * count / total
+        self.count[updated] = total
+
+    def statistics(self):
+        """ Return the (mean, stdev) of every species pair (nan if empty).
+        """
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            mean = numpy.where(self.count > 0, self.mean, numpy.nan)
+            stdev = numpy.sqrt(self.m2 / self.count)
+        return mean, stdev
+
+
+class OnlineOutlierDetector(object):
+    """ Provisional outlier genes of a run, tested as their families complete.
+
+    Parameters
+    ----------
+    checkpoint: DistanceCheckpoint
+        full distance matrix the gene families are stored in
+    queries: list
+        query (gene) names in the order of the full distance matrix
+    output_fp: string
+        filepath to the streaming output of the provisional candidates
+    num_species: integer
+        number of species in the reference database
+    stdev_offset: float, optional
+        the number of standard deviations a gene's normalized distance
+        is from the mean to identify it as an outlier for a species pair
+    outlier_hgt: float, optional
+        the fraction (value between (0,1]) of normalized pairwise distances
+        over all species-pair vectors belonging to the same gene that are
+        z-score standard deviations from the mean
+    warmup: integer, optional
+        number of gene families accumulated before the first genes are
+        tested
+    refresh_interval: integer, optional
+        number of gene families tested with the same bounds
+    chunk_size: integer, optional
+        number of genes read at once from the full distance matrix
+    outlier_statistics: string, optional
+        'genome' to test the genes against the statistics of the species
+        pairs over all families, 'cluster' against those over the families
+        of their provisional core cluster (see detect_hgt_genes())
+    species_set_size: integer, optional
+        threshold number of genes of a core species set (see
+        cluster_distances()), with the 'cluster' outlier statistics
+    hamming_distance: integer, optional
+        Hamming distance of the clustering (see cluster_distances()), with
+        the 'cluster' outlier statistics
+
+    Attributes
+    ----------
+    accumulator: SpeciesPairAccumulator
+        statistics of the species pairs over all families
+    cluster_accumulators: list
+        SpeciesPairAccumulator of every provisional core cluster, with the
+        'cluster' outlier statistics
+
+    Notes
+    -----
+        The families already complete in the checkpoint (of a resumed run)
+        are accumulated when the detector is created. Every gene is tested
+        once, against the bounds of the species pairs (see outlier_bounds())
+        over the families complete at that time, and written to output_fp
+        with that number of families if it is an outlier. The candidates are
+        provisional: finalize() records which ones the outlier detection over
+        all genes confirmed. When the checkpoint resumed families, the
+        candidates already written to output_fp by the interrupted run are
+        kept and the new ones are appended.
+
+        With the 'cluster' outlier statistics the core clusters are only
+        known once all families are computed, so the families complete so
+        far are clustered again every refresh_interval tested genes and every
+        family is accumulated in its provisional core cluster. When the cores
+        of the provisional clustering change, the accumulators are rebuilt
+        from the families in the checkpoint. A gene is only tested once its
+        species set is in a provisional core cluster.
+    """
+
+    def __init__(self, checkpoint, queries, output_fp, num_species,
+                 stdev_offset=2.326, outlier_hgt=0.5, warmup=100,
+                 refresh_interval=100, chunk_size=None,
+                 outlier_statistics='genome', species_set_size=30,
+                 hamming_distance=2):
+        if outlier_statistics not in OUTLIER_STATISTICS:
+            raise ValueError("Outlier statistics not supported: %s"
+                             % outlier_statistics)
+        self.checkpoint = checkpoint
+        self.queries = queries
+        self.num_species = num_species
+        self.stdev_offset = stdev_offset
+        self.outlier_hgt = outlier_hgt
+        self.warmup = warmup
+        self.refresh_interval = max(refresh_interval, 1)
+        self.chunk_size = chunk_size or 1024
+        self.outlier_statistics = outlier_statistics
+        self.species_set_size = species_set_size
+        self.hamming_distance = hamming_distance
+        self.accumulator = SpeciesPairAccumulator(num_species)
+        self.cluster_accumulators = []
+        self.families = 0
+        self.candidates = []
+        self._off_diagonal = ~numpy.eye(num_species, dtype=bool)
+        self._bounds = None
+        self._tested = 0
+        # provisional clustering of the 'cluster' outlier statistics: the
+        # species set counts and the families complete so far, the ordered
+        # cores and the families without a core cluster when they were tested
+        self._species_set_dict = {}
+        self._completed = []
+        self._cores = []
+        self._index = None
+        self._unclustered = []
+        provisional = False
+        if checkpoint.resumed and exists(output_fp):
+            # the candidates of the interrupted run (none if it finished)
+            with open(output_fp, 'r') as output_f:
+                for line in output_f:
+                    if line.startswith('#'):
+                        provisional = line.startswith('# Provisional')
+                        self.candidates = []
+                    elif provisional and line.strip():
+                        self.candidates.append(line.split('\t')[0])
+            self._output_f = open(output_fp, 'a')
+        else:
+            self._output_f = open(output_fp, 'w')
+        self._reported = set(self.candidates)
+        if not provisional:
+            self._output_f.write("# Provisional HGT candidates (gene, gene "
+                                 "families computed when it was tested)\n")
+        self._output_f.flush()
+        # families complete but not tested yet (before the warmup)
+        self._waiting = list(numpy.flatnonzero(checkpoint.completed))
+        for start in range(0, len(self._waiting), self.chunk_size):
+            self._add(self._waiting[start:start+self.chunk_size])
+        self._test_waiting()
+
+    def _add(self, indices):
+        """ Accumulate the families stored in the checkpoint.
+        """
+        distances = self.checkpoint.distances[indices]
+        self.accumulator.update(distances)
+        self.families += len(indices)
+        if self.outlier_statistics != 'cluster':
+            return
+        for words in self.checkpoint.species_sets[indices]:
+            # the species set of a timed out family is empty
+            if words.any():
+                species_set = words.tobytes()
+                self._species_set_dict[species_set] = (
+                    self._species_set_dict.get(species_set, 0) + 1)
+        self._completed.extend(indices)
+        self._accumulate_clusters(indices, distances)
+
+    def _clusters(self, indices):
+        """ Provisional core cluster of families (-1 if none).
+
+        As in cluster_distances(), a family goes to the first core within
+        hamming_distance of its species set, otherwise to the nearest one.
+        """
+        words = self.checkpoint.species_sets[indices]
+        clusters = numpy.full(shape=len(indices), fill_value=-1, dtype=int)
+        if self._index is None:
+            return clusters
+        computed = words.any(axis=1)
+        clusters[computed] = self._index.first_within(words[computed])
+        far = computed & (clusters < 0)
+        if far.any():
+            clusters[far] = self._index.nearest(words[far])[0]
+        return clusters
+
+    def _accumulate_clusters(self, indices, distances):
+        """ Accumulate families in their provisional core cluster.
+        """
+        clusters = self._clusters(indices)
+        for cluster in numpy.unique(clusters[clusters >= 0]):
+            self.cluster_accumulators[cluster].update(
+                distances[clusters == cluster])
+
+    def _refresh(self):
+        """ Compute the bounds of the next tested genes.
+
+        Returns
+        -------
+        boolean
+            True if the cores of the provisional clustering changed
+        """
+        self._tested = 0
+        if self.outlier_statistics != 'cluster':
+            mean, stdev = self.accumulator.statistics()
+            self._bounds = outlier_bounds(mean, stdev, self.stdev_offset)
+            return False
+        # the bounds of every cluster are computed when first needed
+        self._bounds = {}
+        cores = [core for core, _ in cluster_distances(
+            species_set_dict=self._species_set_dict,
+            species_set_size=self.species_set_size,
+            hamming_distance=self.hamming_distance)]
+        if cores == self._cores:
+            return False
+        self._cores = cores
+        self._index = HammingIndex(species_set_words(cores),
+                                   self.hamming_distance)
+        self.cluster_accumulators = [SpeciesPairAccumulator(self.num_species)
+                                     for _ in cores]
+        for start in range(0, len(self._completed), self.chunk_size):
+            indices = self._completed[start:start+self.chunk_size]
+            self._accumulate_clusters(indices,
+                                      self.checkpoint.distances[indices])
+        return True
+
+    def _cluster_bounds(self, cluster):
+        """ Bounds of the species pairs of a provisional core cluster.
+        """
+        if cluster not in self._bounds:
+            mean, stdev = self.cluster_accumulators[cluster].statistics()
+            self._bounds[cluster] = outlier_bounds(mean, stdev,
+                                                   self.stdev_offset)
+        return self._bounds[cluster]
+
+    def update(self, i):
+        """ Accumulate and test the i-th family, once stored in checkpoint.
+
+        Returns
+        -------
+        boolean
+            True if the gene is a provisional outlier
+        """
+        self._add([i])
+        self._waiting.append(i)
+        return self.queries[i] in self._test_waiting()
+
+    def _test_waiting(self):
+        """ Test the waiting families if the warmup is over.
+        """
+        if self.families < self.warmup or not self._waiting:
+            return []
+        outliers = []
+        while self._waiting:
+            if self._bounds is None or self._tested >= self.refresh_interval:
+                if self._refresh():
+                    self._waiting.extend(self._unclustered)
+                    self._unclustered = []
+            indices = numpy.asarray(self._waiting[:self.chunk_size])
+            del self._waiting[:self.chunk_size]
+            chunk = numpy.around(self.checkpoint.distances[indices],
+                                 decimals=5)
+            if self.outlier_statistics == 'cluster':
+                clusters = self._clusters(indices)
+                flagged = numpy.zeros(shape=len(indices), dtype=bool)
+                for cluster in numpy.unique(clusters[clusters >= 0]):
+                    members = clusters == cluster
+                    flagged[members] = self._flag(
+                        chunk[members], *self._cluster_bounds(cluster))
+                # tested again once their species set is in a core cluster
+                unclustered = (clusters < 0) & self.checkpoint.species_sets[
+                    indices].any(axis=1)
+                self._unclustered.extend(indices[unclustered])
+                self._tested += int((clusters >= 0).sum())
+            else:
+                flagged = self._flag(chunk, *self._bounds)
+                self._tested += len(indices)
+            for i in indices[flagged]:
+                query = self.queries[i]
+                outliers.append(query)
+                if query in self._reported:
+                    continue
+                self._reported.add(query)
+                self.candidates.append(query)
+                self._output_f.write("%s\t%s\n" % (query, self.families))
+        self._output_f.flush()
+        return outliers
+
+    def _flag(self, chunk, low_bound, up_bound):
+        """ Outlier flag of every gene of a chunk (see detect_outlier_genes).
+        """
+        outlier_flags = (chunk < low_bound) | (chunk > up_bound)
+        outlier_flags &= self._off_diagonal
+        return (outlier_flags.sum(axis=1) >
+                self.num_species*self.outlier_hgt).any(axis=1)
+
+    def statistics(self):
+        """ Return the (mean, stdev) of every species pair so far.
+        """
+        return self.accumulator.statistics()
+
+    def finalize(self, hgt_genes):
+        """ Record the final status of the candidates and close the output.
+
+        Parameters
+        ----------
+        hgt_genes: list
+            the candidate HGT genes of the outlier detection over all genes
+
+        Returns
+        -------
+        dictionary
+            'confirmed', 'rejected' (provisional candidates that are not HGT
+            candidates) and 'added' (HGT candidates that were not
+            provisional candidates) gene names
+        """
+        final = set(hgt_genes)
+        provisional = set(self.candidates)
+        status = {
+            'confirmed': [q for q in self.candidates if q in final],
+            'rejected': [q for q in self.candidates if q not in final],
+            'added': [q for q in hgt_genes if q not in provisional]}
+        self._output_f.write("# Final status of the candidates (%s gene "
+                             "families)\n" % self.families)
+        for name in ('confirmed', 'rejected', 'added'):
+            for query in status[name]:
+                self._output_f.write("%s\t%s\n" % (query, name))
+        self._output_f.close()
+        return status
+
+
+class FamilyCache(object):
+    """ Persistent cache of gene family alignments and distance matrices.
+
+    Entries are keyed by a hash of the family's members (pseudo names and
+    sequences) and of the alignment and distance settings, so they can be
+    shared by runs that only differ in the clustering and outlier detection
+    parameters. Each entry stores the PHYLIP alignment and the raw pairwise
+    distances of the family, from which normalize_distance_matrix() rebuilds
+    the normalized species x species matrix.
+
+    Parameters
+    ----------
+    cache_dir: string
+        dirpath to the cache (created if it does not exist)
+    max_size: integer, optional
+        maximum size of the cache in bytes enforced by evict(), the least
+        recently used entries are removed first (default: unbounded)
+
+    Notes
+    -----
+        Entries are written atomically and reading an entry updates its
+        modification time, which is the recency used by evict(). Several
+        processes may share a cache directory.
+    """
+
+    def __init__(self, cache_dir, max_size=None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        if not isdir(cache_dir):
+            makedirs(cache_dir)
+
+    @staticmethod
+    def key(members, settings):
+        """ Compute the key of a gene family.
+
+        Parameters
+        ----------
+        members: list of tuples
+            (pseudo name, sequence) of every family member in the order they
+            are aligned
+        settings: dictionary
+            JSON serializable alignment and distance settings
+
+        Returns
+        -------
+        string
+            hexadecimal SHA-1 digest
+        """
+        digest = hashlib.sha1(
+            json.dumps(settings, sort_keys=True).encode())
+        for label, sequence in members:
+            digest.update(("\n%s\t%s" % (label, sequence)).encode())
+        return digest.hexdigest()
+
+    def _entry_fp(self, key):
+        return join(self.cache_dir, key[:2], "%s.npz" % key)
+
+    def get(self, key):
+        """ Return (labels, distances, alignment) of a family or None.
+        """
+        entry_fp = self._entry_fp(key)
+        try:
+            with numpy.load(entry_fp, allow_pickle=False) as entry:
+                labels = [str(label) for label in entry['labels']]
+                distances = entry['distances']
+                alignment = str(entry['alignment'])
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        try:
+            utime(entry_fp, None)
+        except OSError:
+            pass
+        return labels, distances, alignment
+
+    def put(self, key, labels, distances, alignment):
+        """ Store the alignment and the raw distances of a family.
+        """
+        entry_fp = self._entry_fp(key)
+        entry_dir = join(self.cache_dir, key[:2])
+        if not isdir(entry_dir):
+            makedirs(entry_dir, exist_ok=True)
+        tmp_fp = "%s.%s.tmp" % (entry_fp, getpid())
+        with open(tmp_fp, 'wb') as tmp_f:
+            numpy.savez(tmp_f,
+                        labels=numpy.asarray(labels, dtype=str),
+                        distances=numpy.asarray(distances, dtype=float),
+                        alignment=numpy.asarray(alignment, dtype=str))
+        replace(tmp_fp, entry_fp)
+
+    def evict(self):
+        """ Remove the least recently used entries above max_size.
+
+        Returns
+        -------
+        integer
+            number of entries removed
+        """
+        if self.max_size is None:
+            return 0
+        entries = []
+        total_size = 0
+        for dirpath, _, filenames in walk(self.cache_dir):
+            for filename in filenames:
+                if not filename.endswith('.npz'):
+                    continue
+                entry_fp = join(dirpath, filename)
+                try:
+                    entry_stat = stat(entry_fp)
+                except OSError:
+                    continue
+                entries.append(
+                    (entry_stat.st_mtime, entry_stat.st_size, entry_fp))
+                total_size += entry_stat.st_size
+        removed = 0
+        for _, size, entry_fp in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                remove(entry_fp)
+            except OSError:
+                continue
+            total_size -= size
+            removed += 1
+        return removed
+
+
+def prepare_family_scratch(scratch_dir):
+    """ Create the scratch files used to align and compare one gene family.
+
+    Parameters
+    ----------
+    scratch_dir: string
+        dirpath to the scratch directory (must exist)
+
+    Returns
+    -------
+    scratch: dictionary
+        dictionary storing the filepaths of the FASTA input, the PHYLIP
+        alignment, the guide tree, the PHYLIP distance matrix and the
+        interactive Clustalw (default and fast pairwise alignments) and
+        PHYLIP commands
+
+    Notes
+    -----
+        A scratch directory is reused by every gene family processed by the
+        same worker, the alignment and distance files are truncated before
+        each family (see compute_family_distances()).
+    """
+    scratch = {'fasta_in': join(scratch_dir, "input.faa"),
+               'phy_msa': join(scratch_dir, "msa.phy"),
+               'dnd_msa': join(scratch_dir, "msa.dnd"),
+               'phylip': join(scratch_dir, "msa.dis"),
+               'clustal_command': join(scratch_dir, "clustal_command.txt"),
+               'clustal_fast_command': join(scratch_dir,
+                                            "clustal_fast_command.txt"),
+               'phylip_command': join(scratch_dir, "phylip_command.txt")}
+    for key in ('phy_msa', 'dnd_msa', 'phylip'):
+        open(scratch[key], 'a').close()
+    # the fast command toggles Clustalw's pairwise alignments from full
+    # dynamic programming to k-tuple matching (option 4 of the multiple
+    # alignment menu)
+    for key, toggle in (('clustal_command', ''),
+                        ('clustal_fast_command', '4\n')):
+        with open(scratch[key], 'w') as clustal_command_f:
+            clustal_command_f.write(
+                '1\n%s\n2\n9\n1\n4\n\n%s1\n%s\n%s\nX\n\nX\n' % (
+                    scratch['fasta_in'], toggle, scratch['phy_msa'],
+                    scratch['dnd_msa']))
+    with open(scratch['phylip_command'], 'w') as phylip_command_f:
+        phylip_command_f.write('%s\nF\n%s\nR\nY\n' % (
+            scratch['phy_msa'], scratch['phylip']))
+    return scratch
+
+
+# number of dynamic programming cells (see estimate_family_costs()) per unit
+# of timeout_scale
+FAMILY_COST_UNIT = 1e9
+
+
+def deduplicate_families(hits, ref_db, gene_map):
+    """ Group the gene families whose members are identical.
+
+    Parameters
+    ----------
+    hits: HomologTable or dictionary
+        table storing query (gene) names as keys and their homologs as
+        values, one gene family per query
+    ref_db: dictionary
+        dictionary storing FASTA label as key and sequence as value for the
+        reference databases
+    gene_map: GeneTable
+        id and species of every reference gene (see preprocess_data())
+
+    Returns
+    -------
+    representatives: numpy.ndarray
+        position in hits of the first family of every group of identical
+        families
+    groups: numpy.ndarray
+        index in representatives of the group of every family of hits
+
+    Notes
+    -----
+        Families are identical if their members have the same species and
+        sequences in the same order (multi-copy paralogs of the query genome,
+        identical proteins of clonal references), so that they get the same
+        alignment and species x species distance matrix. The families are
+        compared by a SHA-1 digest of the species and sequences of their
+        members.
+    """
+    digests = {}
+    representatives = []
+    groups = numpy.empty(shape=len(hits), dtype=int)
+    for position, query in enumerate(hits):
+        members = hits[query]
+        digest = hashlib.sha1()
+        for species, ref in zip(gene_map.species[gene_map.ids(members)],
+                                members):
+            digest.update(("\n%s\t%s" % (species, ref_db[ref])).encode())
+        group = digests.setdefault(digest.digest(), len(representatives))
+        if group == len(representatives):
+            representatives.append(position)
+        groups[position] = group
+    return numpy.array(representatives, dtype=int), groups
+
+
+def estimate_family_costs(hits, ref_db):
+    """ Estimate the cost of aligning every gene family.
+
+    Parameters
+    ----------
+    hits: HomologTable or dictionary
+        table storing query (gene) names as keys and their homologs as
+        values, one gene family per query
+    ref_db: dictionary
+        dictionary storing FASTA label as key and sequence as value for the
+        reference databases
+
+    Returns
+    -------
+    costs: numpy.ndarray
+        estimated number of dynamic programming cells of every family, in
+        the order of hits
+    residues: numpy.ndarray
+        total number of residues of every family, in the order of hits
+
+    Notes
+    -----
+        Clustalw's running time is dominated by its full pairwise alignments:
+        n * (n - 1) / 2 alignments of two sequences of (mean) length L for a
+        family of n members, plus the n profile alignments of the progressive
+        stage, i.e. n * (n + 1) / 2 * L^2 cells. The faster aligners of
+        MSA_BACKENDS stay well within this estimate.
+    """
+    members = numpy.zeros(shape=len(hits))
+    residues = numpy.zeros(shape=len(hits), dtype=numpy.int64)
+    for row, query in enumerate(hits):
+        family = hits[query]
+        members[row] = len(family)
+        residues[row] = sum(len(ref_db[ref]) for ref in family)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        mean_length = numpy.where(members > 0, residues / members, 0)
+    return members * (members + 1) / 2 * mean_length ** 2, residues
+
+
+def family_timeouts(costs, timeout, timeout_scale=0.0):
+    """ Scale the aligner timeout of every gene family with its cost.
+
+    Parameters
+    ----------
+    costs: numpy.ndarray
+        estimated cost of every family (see estimate_family_costs())
+    timeout: integer
+        number of seconds to allow the aligner to run per family, whatever
+        its cost
+    timeout_scale: float, optional
+        number of seconds added to timeout per FAMILY_COST_UNIT cells of a
+        family, 0 gives every family the same timeout
+
+    Returns
+    -------
+    numpy.ndarray
+        number of seconds to allow the aligner to run for every family:
+        timeout + cost / FAMILY_COST_UNIT * timeout_scale
+    """
+    return timeout + numpy.asarray(costs) / FAMILY_COST_UNIT * timeout_scale
+
+
+def compute_family_distances(query,
+                             hits,
+                             scratch,
+                             gene_map,
+                             ref_db,
+                             num_species,
+                             timeout,
+                             distance_engine='protdist',
+                             distance_model='jtt',
+                             warnings=False,
+                             debug=False,
+                             cache=None,
+                             stats=None,
+                             fast_retry=False,
+                             aligner='clustalw',
+                             distance_mode='msa',
+                             kmer_size=4,
+                             pair_identities=None):
+    """ Align one gene family and compute its normalized distance matrix.
+
+    Parameters
+    ----------
+    query: string
+        query gene name
+    hits: HomologTable or dictionary
+        table storing query (gene) names as keys and the best aligning
+        reference sequences as values (one alignment per reference sequence)
+    scratch: dictionary
+        scratch filepaths created by prepare_family_scratch()
+    gene_map: GeneTable
+        id and species of every reference gene (see preprocess_data())
+    ref_db: dictionary
+        dictionary storing FASTA label as key and sequence as value for the
+        reference databases
+    num_species: integer
+        number of species in the reference database
+    timeout: integer
+        number of seconds to allow the aligner to run before terminating the
+        process
+    distance_engine: string, optional
+        'protdist' to run PHYLIP's protdist or 'native' to compute the
+        distances in-process with compute_native_distances()
+    distance_model: string, optional
+        distance model of the native engine (see DISTANCE_MODELS)
+    warnings: boolean, optional
+        print warnings output by PHYLIP
+    debug: boolean, optional
+        if True, run function in debug mode
+    cache: FamilyCache, optional
+        if given, reuse the alignment and distances of an identical family
+        computed with the same settings, and store them otherwise
+    stats: dictionary, optional
+        if given, filled with the family size, the alignment length, whether
+        the family was cached and the time spent in every step (see
+        FAMILY_STATS)
+    fast_retry: boolean, optional
+        if the aligner times out, align the family again with its faster
+        setting (Clustalw's fast k-tuple pairwise alignments, see
+        MSA_BACKENDS for the others)
+    aligner: string, optional
+        one of ALIGNERS, or 'auto' to pick it from the size of the family
+        (see select_aligner())
+    distance_mode: string, optional
+        'msa' to compute the distances from a multiple sequence alignment,
+        'kmer' to compute them without alignment from the k-mers of the
+        members (see compute_kmer_distances()) or 'hits' to take them from
+        the percent identities of the homology search (see
+        compute_hit_distances()), the last two ignore the aligner, the
+        distance engine and the cache
+    kmer_size: integer, optional
+        length of the k-mers of the 'kmer' distance mode
+    pair_identities: PairIdentities, optional
+        percent identities of the pairs of members of the 'hits' distance
+        mode (see search_family_pairs())
+
+    Returns
+    -------
+    distance_matrix: numpy.ndarray
+        Z-score normalized species x species distance matrix of the family
+    bitvector: bytes
+        binary indicator vector of the species present in the family (encoded
+        by encode_species_set())
+
+    Notes
+    -----
+        A family whose alignment times out (again, with fast_retry) is
+        reported on the standard error and gets no distances: its matrix is
+        all nan and its species set is empty, so it takes no part in the
+        clustering and outlier detection. It is not stored in the cache.
+        Except for Clustalw, the aligners read the family from their standard
+        input and write the alignment to their standard output, only protdist
+        reads it back from the scratch directory.
+    """
+    start = time.perf_counter()
+    members = hits[query]
+    member_ids = gene_map.ids(members)
+    if (member_ids < 0).any():
+        raise ValueError("Unknown reference genes in the family of %s: %s" % (
+            query, [ref for i, ref in zip(member_ids, members) if i < 0]))
+    if stats is None:
+        stats = {}
+    stats.update({'query': query,
+                  'members': len(members),
+                  'residues': sum(len(ref_db[ref]) for ref in members),
+                  'alignment_length': 0,
+                  'cached': False,
+                  'duplicate_of': '',
+                  'aligner': aligner,
+                  'timeout_s': timeout,
+                  'timed_out': False,
+                  'msa_s': 0.0,
+                  'distance_s': 0.0,
+                  'normalize_s': 0.0,
+                  'external_wall_s': 0.0,
+                  'external_cpu_s': 0.0})
+    if distance_mode not in DISTANCE_MODES:
+        raise ValueError("Distance mode not supported: %s" % distance_mode)
+    if distance_mode != 'msa':
+        # nothing to align, and the distances are cheaper than a cache entry
+        cache = None
+    elif aligner == 'auto':
+        aligner = select_aligner(len(members))
+    elif aligner not in ALIGNERS:
+        raise ValueError("Aligner not supported: %s" % aligner)
+    # the aligner settings to try in turn, a fast setting is named
+    # <aligner>-fast
+    aligners = (aligner,)
+    if fast_retry and distance_mode == 'msa' and (
+            aligner == 'clustalw' or
+            MSA_BACKENDS[aligner].fast_command is not None):
+        aligners += ('%s-fast' % aligner,)
+    entry = None
+    keys = {}
+    if cache is not None:
+        family = [(gene_map.pseudo_name(i), ref_db[ref])
+                  for i, ref in zip(member_ids, members)]
+        for setting in aligners:
+            keys[setting] = cache.key(
+                members=family,
+                settings={'aligner': setting,
+                          'names': 'position',
+                          'distance_engine': distance_engine,
+                          'distance_model': (distance_model
+                                             if distance_engine == 'native'
+                                             else None)})
+            entry = cache.get(keys[setting])
+            if entry is not None:
+                stats['aligner'] = setting
+                break
+    if distance_mode != 'msa':
+        stats['aligner'] = distance_mode
+        labels = [phylip_name(position) for position in range(len(members))]
+        if distance_mode == 'kmer':
+            distances = compute_kmer_distances(
+                [str(ref_db[ref]) for ref in members], kmer_size=kmer_size)
+        else:
+            distances = compute_hit_distances(
+                query=query, hits=hits, gene_map=gene_map,
+                pair_identities=pair_identities)
+        stats['distance_s'] = time.perf_counter() - start
+    elif entry is not None:
+        labels, distances, alignment = entry
+        stats['cached'] = True
+        stats['alignment_length'] = _alignment_length(alignment)
+    else:
+        jobs = []
+        # aligned sequences of the streaming aligners (None for Clustalw,
+        # which writes them to the scratch directory)
+        msa = None
+        for setting in aligners:
+            # never let a failed run read the output of the previous family
+            for key_fp in ('phy_msa', 'phylip'):
+                open(scratch[key_fp], 'w').close()
+            stats['aligner'] = setting
+            if aligner == 'clustalw':
+                job = launch_msa(
+                    fasta_in_fp=scratch['fasta_in'],
+                    clustal_command_fp=scratch[
+                        'clustal_fast_command' if setting != aligner
+                        else 'clustal_command'],
+                    ref_db=ref_db,
+                    hits=hits,
+                    query=query,
+                    timeout=timeout)
+            else:
+                job, msa_labels, msa_sequences = launch_msa_backend(
+                    aligner=aligner,
+                    ref_db=ref_db,
+                    hits=hits,
+                    query=query,
+                    timeout=timeout,
+                    fast=setting != aligner)
+                msa = (msa_labels, msa_sequences)
+            jobs.append(job)
+            stats['timed_out'] = job is not None and job.timed_out
+            if not stats['timed_out']:
+                break
+            sys.stderr.write(
+                "Warning: %s timed out after %ss on the gene family of %s "
+                "(%s members, %s residues)\n" % (
+                    setting, timeout, query, stats['members'],
+                    stats['residues']))
+        msa_end = time.perf_counter()
+        stats['msa_s'] = msa_end - start
+        if msa is not None:
+            alignment = format_phylip_alignment(*msa)
+        else:
+            with open(scratch['phy_msa'], 'r') as phy_msa_f:
+                alignment = phy_msa_f.read()
+        if stats['timed_out']:
+            labels, distances = [], []
+        elif distance_engine == 'native':
+            labels, distances = compute_native_distances(
+                phy_msa_fp=scratch['phy_msa'], model=distance_model,
+                alignment=msa)
+        elif distance_engine == 'protdist':
+            if msa is not None:
+                with open(scratch['phy_msa'], 'w') as phy_msa_f:
+                    phy_msa_f.write(alignment)
+            jobs.append(compute_distances(
+                phylip_command_fp=scratch['phylip_command'],
+                warnings=warnings))
+            labels, distances = parse_phylip_distances(
+                phylip_fp=scratch['phylip'], debug=debug)
+        else:
+            raise ValueError(
+                "Distance engine not supported: %s" % distance_engine)
+        stats['distance_s'] = time.perf_counter() - msa_end
+        for job in jobs:
+            if job is not None:
+                stats['external_wall_s'] += job.wall_time
+                stats['external_cpu_s'] += job.cpu_time
+        stats['alignment_length'] = _alignment_length(alignment)
+        if cache is not None and not stats['timed_out']:
+            cache.put(keys[stats['aligner']], labels, distances, alignment)
+    if stats['timed_out']:
+        stats['total_s'] = time.perf_counter() - start
+        return (numpy.full(shape=(num_species, num_species),
+                           fill_value=numpy.nan),
+                encode_species_set(numpy.zeros(shape=num_species,
+                                               dtype=bool)))
+    normalize_start = time.perf_counter()
+    family_matrix = numpy.zeros(shape=(1, num_species, num_species))
+    species_set_dict = {}
+    gene_bitvector_map = {}
+    # the tools name the members by their position in the family
+    member_species = gene_map.species[member_ids]
+    normalize_distance_matrix(
+        labels=labels,
+        distances=distances,
+        full_distance_matrix=family_matrix,
+        num_species=num_species,
+        full_distance_matrix_offset=0,
+        species_set_dict=species_set_dict,
+        gene_bitvector_map=gene_bitvector_map,
+        species=member_species[[phylip_position(label)
+                                for label in labels]])
+    stats['normalize_s'] = time.perf_counter() - normalize_start
+    stats['total_s'] = time.perf_counter() - start
+    return family_matrix[0], gene_bitvector_map[0]
+
+
+def _alignment_length(alignment):
+    """ Return the number of columns of a PHYLIP alignment (0 if empty).
+    """
+    header = alignment.split('\n', 1)[0].split()
+    return int(header[1]) if len(header) > 1 else 0
+
+
+# state shared by the gene families processed in a worker process, set once
+# by _init_family_worker() so it is not pickled for every family
+_family_worker = {}
+
+
+def _init_family_worker(working_dir, kwargs):
+    scratch_dir = join(working_dir, "worker_%s" % getpid())
+    if not isdir(scratch_dir):
+        mkdir(scratch_dir)
+    _family_worker['scratch'] = prepare_family_scratch(scratch_dir)
+    _family_worker['kwargs'] = kwargs
+
+
+def _family_worker_memmaps(checkpoint_dir):
+    """ Open (once per worker) the memory maps of a DistanceCheckpoint.
+    """
+    memmaps = _family_worker.setdefault('memmaps', {})
+    if checkpoint_dir not in memmaps:
+        memmaps[checkpoint_dir] = tuple(
+            open_memmap(join(checkpoint_dir, name), mode='r+')
+            for name in (DistanceCheckpoint.distances_name,
+                         DistanceCheckpoint.species_sets_name))
+    return memmaps[checkpoint_dir]
+
+
+def _compute_family_distances_worker(task):
+    position, query, timeout, location = task
+    stats = {}
+    distance_matrix, bitvector = compute_family_distances(
+        query=query, scratch=_family_worker['scratch'], stats=stats,
+        timeout=timeout, **_family_worker['kwargs'])
+    if location is not None:
+        # written into the shared checkpoint (for the family and its
+        # duplicates) instead of being pickled back
+        for checkpoint_dir, i in location:
+            distances, species_sets = _family_worker_memmaps(checkpoint_dir)
+            distances[i] = distance_matrix
+            species_sets[i] = numpy.frombuffer(bitvector, dtype=numpy.uint64)
+        distance_matrix = None
+    return position, distance_matrix, bitvector, stats
+
+
+def _duplicate_stats(stats, query, representative):
+    """ Statistics of a family whose distances were copied from another.
+    """
+    duplicate = dict(stats, query=query, duplicate_of=representative,
+                     cached=False)
+    for column in ('msa_s', 'distance_s', 'normalize_s', 'external_wall_s',
+                   'external_cpu_s', 'total_s'):
+        duplicate[column] = 0.0
+    return duplicate
+
+
+def iter_family_distances(hits,
+                          working_dir,
+                          gene_map,
+                          ref_db,
+                          num_species,
+                          timeout,
+                          jobs=1,
+                          distance_engine='protdist',
+                          distance_model='jtt',
+                          warnings=False,
+                          debug=False,
+                          cache=None,
+                          timeout_scale=0.0,
+                          fast_retry=False,
+                          aligner='clustalw',
+                          distance_mode='msa',
+                          kmer_size=4,
+                          pair_identities=None,
+                          locations=None,
+                          deduplicate=False):
+    """ Compute the normalized distance matrix of every gene family.
+
+    Parameters
+    ----------
+    hits: HomologTable or dictionary
+        table storing query (gene) names as keys and their homologs as
+        values, one gene family per query
+    working_dir: string
+        dirpath to working directory
+    gene_map: GeneTable
+        id and species of every reference gene (see preprocess_data())
+    ref_db: dictionary
+        dictionary storing FASTA label as key and sequence as value for the
+        reference databases
+    num_species: integer
+        number of species in the reference database
+    timeout: integer
+        minimum number of seconds to allow the aligner to run per family
+    jobs: integer, optional
+        number of gene families to process in parallel
+    distance_engine: string, optional
+        'protdist' or 'native' (see compute_family_distances())
+    distance_model: string, optional
+        distance model of the native engine (see DISTANCE_MODELS)
+    warnings: boolean, optional
+        print warnings output by PHYLIP
+    debug: boolean, optional
+        if True, run function in debug mode
+    cache: FamilyCache, optional
+        cache of family alignments and distances (see
+        compute_family_distances())
+    timeout_scale: float, optional
+        number of seconds added to the timeout of a family per
+        FAMILY_COST_UNIT cells of its estimated cost (see family_timeouts())
+    fast_retry: boolean, optional
+        align the families that time out again with the faster setting of
+        the aligner (see compute_family_distances())
+    aligner: string, optional
+        one of ALIGNERS or 'auto' (see compute_family_distances())
+    distance_mode: string, optional
+        'msa', 'kmer' or 'hits' (see compute_family_distances())
+    kmer_size: integer, optional
+        length of the k-mers of the 'kmer' distance mode
+    pair_identities: PairIdentities, optional
+        percent identities of the pairs of members of the 'hits' distance
+        mode (see compute_family_distances())
+    locations: list, optional
+        location in a DistanceCheckpoint of every family of hits (see
+        DistanceCheckpoint.location()), with jobs > 1 the workers write the
+        distance matrices and species sets there
+    deduplicate: boolean, optional
+        if True, compute the families with identical members once (see
+        deduplicate_families()), except in the 'hits' distance mode whose
+        distances depend on the query gene
+
+    Yields
+    ------
+    tuple of (integer, string, numpy.ndarray, bytes, dictionary)
+        position of the family in hits, query gene name, its normalized
+        distance matrix (None if a worker wrote it to its location), the
+        encoded binary indicator vector of its species and its statistics
+        (see compute_family_distances(), the statistics of a duplicate
+        family name the family it was copied from in duplicate_of and have
+        no times)
+
+    Notes
+    -----
+        The cost of every family is estimated from its number of members and
+        residues (see estimate_family_costs()). With jobs > 1 the families
+        are dispatched from the most to the least expensive, so that the
+        largest families do not start last and leave the other workers idle,
+        and they are yielded as they complete. Every worker process gets its
+        own scratch directory (working_dir/worker_<pid>) so the Clustalw and
+        protdist files of concurrent families never collide. Given locations,
+        the workers share the memory mapped full distance matrix with this
+        process instead of pickling every matrix back, so memory holds a
+        single copy of it whatever the number of workers. With jobs = 1 the
+        families are yielded in the order of hits, the duplicates of a family
+        right after it.
+    """
+    kwargs = {'hits': hits,
+              'gene_map': gene_map,
+              'ref_db': ref_db,
+              'num_species': num_species,
+              'distance_engine': distance_engine,
+              'distance_model': distance_model,
+              'warnings': warnings,
+              'debug': debug,
+              'cache': cache,
+              'fast_retry': fast_retry,
+              'aligner': aligner,
+              'distance_mode': distance_mode,
+              'kmer_size': kmer_size,
+              'pair_identities': pair_identities}
+    queries = list(hits)
+    costs, _ = estimate_family_costs(hits, ref_db)
+    timeouts = family_timeouts(costs, timeout, timeout_scale)
+    if deduplicate and distance_mode != 'hits':
+        representatives, groups = deduplicate_families(hits, ref_db, gene_map)
+    else:
+        representatives = groups = numpy.arange(len(queries))
+    # positions of the duplicates of every family computed
+    copies = {position: [] for position in representatives}
+    for position, group in enumerate(groups):
+        if representatives[group] != position:
+            copies[representatives[group]].append(position)
+    if jobs > 1:
+        # stable so that families of equal cost keep the order of hits
+        order = representatives[numpy.argsort(-costs[representatives],
+                                              kind='stable')]
+        tasks = [(position, queries[position], float(timeouts[position]),
+                  None if locations is None else
+                  [locations[p] for p in [position] + copies[position]])
+                 for position in order]
+        with Pool(processes=jobs,
+                  initializer=_init_family_worker,
+                  initargs=(working_dir, kwargs)) as pool:
+            for position, distance_matrix, bitvector, stats in (
+                    pool.imap_unordered(_compute_family_distances_worker,
+                                        tasks)):
+                yield (position, queries[position], distance_matrix,
+                       bitvector, stats)
+                for copy in copies[position]:
+                    yield (copy, queries[copy], distance_matrix, bitvector,
+                           _duplicate_stats(stats, queries[copy],
+                                            queries[position]))
+    else:
+        scratch = prepare_family_scratch(working_dir)
+        for position in representatives:
+            query = queries[position]
+            stats = {}
+            distance_matrix, bitvector = compute_family_distances(
+                query=query, scratch=scratch, stats=stats,
+                timeout=float(timeouts[position]), **kwargs)
+            yield position, query, distance_matrix, bitvector, stats
+            for copy in copies[position]:
+                yield (copy, queries[copy], distance_matrix, bitvector,
+                       _duplicate_stats(stats, queries[copy], query))
+
+
+# columns of the per-family statistics (see compute_family_distances())
+FAMILY_STATS = ('query', 'members', 'residues', 'alignment_length',
+                'cached', 'duplicate_of', 'aligner', 'timeout_s', 'timed_out',
+                'msa_s', 'distance_s', 'normalize_s', 'external_wall_s',
+                'external_cpu_s', 'total_s')
+
+
+class StageTimer(object):
+    """ Record the wall time, CPU time and peak memory of consecutive stages.
+
+    Attributes
+    ----------
+    stages: list of dictionaries
+        one dictionary per finished stage with its name, wall time, CPU time
+        of this process and of its finished children (in seconds) and the
+        peak resident set size of this process and of its largest child (in
+        kilobytes on Linux) at the end of the stage
+
+    Notes
+    -----
+        Peak resident set sizes are high-water marks since the start of the
+        process, a stage that raises them is the one that allocated the
+        memory. Children (external commands and worker processes) are only
+        accounted once they have exited.
+    """
+
+    def __init__(self):
+        self.stages = []
+        self._current = None
+
+    @staticmethod
+    def _usage():
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return time.perf_counter(), own, children
+
+    def start(self, name, **fields):
+        """ Finish the current stage (if any) and start a new one.
+
+        Extra keyword arguments are recorded with the stage.
+        """
+        self.stop()
+        self._current = (name, fields) + self._usage()
+
+    def stop(self):
+        """ Finish the current stage.
+        """
+        if self._current is None:
+            return
+        name, fields, wall, own, children = self._current
+        end_wall, end_own, end_children = self._usage()
+        self.stages.append(dict(fields, **{
+            'stage': name,
+            'wall_s': round(end_wall - wall, 6),
+            'cpu_s': round(end_own.ru_utime + end_own.ru_stime -
+                           own.ru_utime - own.ru_stime, 6),
+            'children_cpu_s': round(end_children.ru_utime +
+                                    end_children.ru_stime -
+                                    children.ru_utime - children.ru_stime,
+                                    6),
+            'max_rss_kb': end_own.ru_maxrss,
+            'children_max_rss_kb': end_children.ru_maxrss}))
+        self._current = None
+
+
+def write_run_report(output_hgt_fp, timer, family_stats, jobs=()):
+    """ Write the timing and memory report of a Distance Method run.
+
+    Parameters
+    ----------
+    output_hgt_fp: string
+        filepath to the output file of detected HGTs, the report is written
+        to output_hgt_fp.report.json and the per-family statistics to
+        output_hgt_fp.families.tsv
+    timer: StageTimer
+        timer of the stages of the run
+    family_stats: list of dictionaries
+        statistics of every computed gene family (see FAMILY_STATS), the
+        families copied from an identical family (see
+        deduplicate_families()) are counted apart as duplicates
+    jobs: list of JobResult, optional
+        external commands run by this process (see ProcessRunner.history)
+
+    Returns
+    -------
+    report_fp: string
+        filepath to the JSON report
+    families_fp: string
+        filepath to the TSV of per-family statistics
+    """
+    duplicates = [stats for stats in family_stats if stats['duplicate_of']]
+    family_stats = [stats for stats in family_stats
+                    if not stats['duplicate_of']]
+    families = {'computed': len(family_stats),
+                'cached': sum(1 for stats in family_stats if stats['cached']),
+                'timed_out': sum(1 for stats in family_stats
+                                 if stats['timed_out']),
+                'fast_aligner': sum(1 for stats in family_stats
+                                    if stats['aligner'].endswith('-fast'))}
+    for column in ('members', 'residues', 'alignment_length', 'msa_s',
+                   'distance_s', 'normalize_s', 'external_wall_s',
+                   'external_cpu_s', 'total_s'):
+        families[column] = sum(stats[column] for stats in family_stats)
+    # the work saved by copying the distances of identical families
+    families['duplicates'] = len(duplicates)
+    families['duplicate_members'] = sum(stats['members']
+                                        for stats in duplicates)
+    families['duplicate_residues'] = sum(stats['residues']
+                                         for stats in duplicates)
+    # time of the family each duplicate was copied from (if it is one of
+    # family_stats)
+    total_s = {stats['query']: stats['total_s'] for stats in family_stats}
+    families['duplicate_saved_s'] = sum(
+        total_s.get(stats['duplicate_of'], 0.0) for stats in duplicates)
+    commands = {}
+    for job in jobs:
+        name = basename(job.command[0])
+        if len(job.command) > 1 and not job.command[1].startswith('-'):
+            name = "%s %s" % (name, job.command[1])
+        summary = commands.setdefault(
+            name, {'count': 0, 'wall_s': 0.0, 'cpu_s': 0.0,
+                   'max_rss_kb': 0, 'timed_out': 0})
+        summary['count'] += 1
+        summary['wall_s'] += job.wall_time
+        summary['cpu_s'] += job.cpu_time
+        summary['max_rss_kb'] = max(summary['max_rss_kb'], job.max_rss)
+        summary['timed_out'] += int(job.timed_out)
+    report_fp = "%s.report.json" % output_hgt_fp
+    with open(report_fp, 'w') as report_f:
+        json.dump({'stages': timer.stages,
+                   'families': families,
+                   'commands': commands}, report_f, indent=2)
+        report_f.write('\n')
+    families_fp = "%s.families.tsv" % output_hgt_fp
+    with open(families_fp, 'w') as families_f:
+        families_f.write("%s\n" % '\t'.join(FAMILY_STATS))
+        for stats in family_stats + duplicates:
+            families_f.write("%s\n" % '\t'.join(
+                str(stats[column]) for column in FAMILY_STATS))
+    return report_fp, families_fp
+
+
+class DistanceCheckpoint(object):
+    """ On-disk full distance matrix with per-family completion flags.
+
+    The full distance matrix (genes x species x species), the species set of
+    every gene and a completion bitmap (one flag per gene family) are .npy
+    memory maps in working_dir, so the matrix does not need to fit in RAM and
+    a restarted run only computes the families that are not flagged complete.
+
+    Parameters
+    ----------
+    working_dir: string
+        dirpath to working directory
+    queries: list
+        query (gene) names, one gene family per query in the order of the
+        full distance matrix
+    num_species: integer
+        number of species in the reference database
+    dtype: string, optional
+        'float64' or 'float32' (halves the size of the matrix)
+    settings: dictionary, optional
+        JSON serializable settings the distances depend on, a checkpoint
+        computed with different settings is discarded
+    resume: boolean, optional
+        if True, reopen an existing checkpoint of the same families and
+        settings, otherwise (the default) discard it
+    hits: HomologTable or dictionary, optional
+        members of every gene family (hits[query]), a checkpoint of families
+        with other members is discarded
+
+    Attributes
+    ----------
+    distances: numpy.memmap
+        full distance matrix
+    species_sets: numpy.memmap
+        uint64 array of shape (genes, words) storing the species set of every
+        gene (see encode_species_set())
+    completed: numpy.memmap
+        boolean completion flag of every gene family
+    resumed: integer
+        number of families already complete when the checkpoint was opened
+    """
+    manifest_name = "distance_checkpoint.json"
+    distances_name = "full_distance_matrix.npy"
+    species_sets_name = "species_sets.npy"
+    completed_name = "completed_families.npy"
+
+    def __init__(self, working_dir, queries, num_species, dtype='float64',
+                 settings=None, resume=False, hits=None):
+        total_genes = len(queries)
+        words = max(1, -(-num_species // 64))
+        digest = hashlib.sha1()
+        for query in queries:
+            digest.update(query.encode() + b'\n')
+            if hits is not None:
+                digest.update('\t'.join(hits[query]).encode() + b'\n')
+        manifest = {'queries': digest.hexdigest(),
+                    'total_genes': total_genes,
+                    'num_species': num_species,
+                    'dtype': numpy.dtype(dtype).name,
+                    'settings': settings or {}}
+        manifest_fp = join(working_dir, self.manifest_name)
+        paths = [join(working_dir, name) for name in (
+            self.distances_name, self.species_sets_name,
+            self.completed_name)]
+        previous = None
+        if resume and exists(manifest_fp) and all(exists(p) for p in paths):
+            with open(manifest_fp, 'r') as manifest_f:
+                try:
+                    previous = json.load(manifest_f)
+                except ValueError:
+                    previous = None
+        if previous == manifest:
+            self.distances = open_memmap(paths[0], mode='r+')
+            self.species_sets = open_memmap(paths[1], mode='r+')
+            self.completed = open_memmap(paths[2], mode='r+')
+        else:
+            # the flags are written last, a stale flag file must never
+            # describe new distances
+            self.completed = open_memmap(
+                paths[2], mode='w+', dtype=bool, shape=(total_genes,))
+            self.distances = open_memmap(
+                paths[0], mode='w+', dtype=manifest['dtype'],
+                shape=(total_genes, num_species, num_species))
+            self.species_sets = open_memmap(
+                paths[1], mode='w+', dtype=numpy.uint64,
+                shape=(total_genes, words))
+            self.completed.flush()
+            with open(manifest_fp, 'w') as manifest_f:
+                json.dump(manifest, manifest_f)
+        self.working_dir = working_dir
+        self.resumed = int(self.completed.sum())
+        self._pending = []
+
+    def pending(self):
+        """ Return the indices of the gene families left to compute.
+        """
+        return numpy.flatnonzero(~self.completed)
+
+    def store(self, i, distance_matrix, bitvector):
+        """ Store the distance matrix and species set of the i-th family.
+
+        The family is flagged complete by the next call to commit(). A None
+        distance_matrix means that a worker process already wrote the family
+        into the memory maps (see location()).
+        """
+        if distance_matrix is not None:
+            self.distances[i] = distance_matrix
+            self.species_sets[i] = numpy.frombuffer(bitvector,
+                                                    dtype=numpy.uint64)
+        self._pending.append(i)
+
+    def location(self, i):
+        """ Return the (working_dir, i) of the i-th family for a worker.
+
+        Worker processes given the location of a family write its distance
+        matrix and species set in place (see iter_family_distances()), the
+        memory maps of the checkpoint are shared with them through the page
+        cache so the matrix is neither pickled nor copied.
+        """
+        return self.working_dir, int(i)
+
+    def commit(self):
+        """ Write the stored families to disk, then flag them complete.
+        """
+        if not self._pending:
+            return
+        self.distances.flush()
+        self.species_sets.flush()
+        self.completed[self._pending] = True
+        self.completed.flush()
+        self._pending = []
+
+    def species_set(self, i):
+        """ Return the species set of the i-th family (as bytes).
+        """
+        return self.species_sets[i].tobytes()
+
+
+class ReferencePanelState(object):
+    """ Persistent state of incremental runs against a changing panel.
+
+    The state directory holds the tabular alignments of the query proteome
+    against every reference proteome (alignments/<proteome hash>.m8) and a
+    generation directory per update of the panel with its gene families
+    (families.npz: query names and homolog names in CSR layout), their full
+    distance matrix and species sets (a DistanceCheckpoint) and the mean and
+    standard deviation of every species pair (statistics.npz). The manifest
+    (state.json) records the settings, the reference proteomes in species
+    order (file name and content hash) and the current generation.
+
+    Parameters
+    ----------
+    state_dir: string
+        dirpath to the state (created if it does not exist)
+    settings: dictionary
+        JSON serializable settings the alignments and distances depend on, a
+        state computed with different settings is discarded
+
+    Attributes
+    ----------
+    manifest: dictionary
+        manifest of the current generation, None if there is none
+
+    Notes
+    -----
+        The manifest is replaced atomically once a generation is complete,
+        an interrupted update leaves the current generation untouched and is
+        resumed from the checkpoint of the next generation.
+    """
+    manifest_name = "state.json"
+    families_name = "families.npz"
+    statistics_name = "statistics.npz"
+
+    def __init__(self, state_dir, settings):
+        self.state_dir = state_dir
+        self.settings = settings
+        self.alignments_dir = join(state_dir, "alignments")
+        self.manifest = None
+        manifest_fp = join(state_dir, self.manifest_name)
+        if exists(manifest_fp):
+            with open(manifest_fp, 'r') as manifest_f:
+                try:
+                    self.manifest = json.load(manifest_f)
+                except ValueError:
+                    self.manifest = None
+        if self.manifest is None or self.manifest['settings'] != settings:
+            # alignments and generations of other settings are stale
+            self.manifest = None
+            for dirpath in glob(join(state_dir, "generation_*")):
+                rmtree(dirpath)
+            if isdir(self.alignments_dir):
+                rmtree(self.alignments_dir)
+        makedirs(self.alignments_dir, exist_ok=True)
+
+    def alignments_fp(self, proteome_hash):
+        """ Return the filepath to the alignments against a proteome.
+        """
+        return join(self.alignments_dir, "%s.m8" % proteome_hash)
+
+    def generation_dir(self, generation=None):
+        """ Return the dirpath to a generation (default: the current one).
+        """
+        if generation is None:
+            generation = self.manifest['generation']
+        return join(self.state_dir, "generation_%s" % generation)
+
+    def save_families(self, generation, hits):
+        """ Store the gene families (a HomologTable) of a generation.
+        """
+        numpy.savez(join(self.generation_dir(generation), self.families_name),
+                    queries=numpy.asarray(list(hits), dtype=str),
+                    indptr=hits.indptr,
+                    members=numpy.asarray(
+                        [hits.subjects[code] for code in hits.indices],
+                        dtype=str))
+
+    def load_families(self):
+        """ Return the homolog names of every query of the current generation.
+        """
+        families_fp = join(self.generation_dir(), self.families_name)
+        with numpy.load(families_fp, allow_pickle=False) as families:
+            indptr = families['indptr']
+            members = [str(member) for member in families['members']]
+            return {str(query): members[indptr[row]:indptr[row+1]]
+                    for row, query in enumerate(families['queries'])}
+
+    def save_statistics(self, generation, mean, stdev):
+        """ Store the species pair statistics of a generation.
+        """
+        numpy.savez(join(self.generation_dir(generation),
+                         self.statistics_name), mean=mean, stdev=stdev)
+
+    def load_statistics(self):
+        """ Return (mean, stdev) of the current generation or None.
+        """
+        statistics_fp = join(self.generation_dir(), self.statistics_name)
+        if not exists(statistics_fp):
+            return None
+        with numpy.load(statistics_fp, allow_pickle=False) as statistics:
+            return statistics['mean'], statistics['stdev']
+
+    def commit(self, generation, proteomes):
+        """ Make a generation current.
+
+        The previous generation and the alignments against proteomes that
+        left the panel are removed once the manifest is written.
+        """
+        previous = None if self.manifest is None else self.manifest[
+            'generation']
+        manifest = {'settings': self.settings,
+                    'generation': generation,
+                    'proteomes': proteomes}
+        manifest_fp = join(self.state_dir, self.manifest_name)
+        tmp_fp = "%s.%s.tmp" % (manifest_fp, getpid())
+        with open(tmp_fp, 'w') as tmp_f:
+            json.dump(manifest, tmp_f)
+        replace(tmp_fp, manifest_fp)
+        self.manifest = manifest
+        if previous is not None and previous != generation:
+            rmtree(self.generation_dir(previous))
+        hashes = set(proteome['hash'] for proteome in proteomes)
+        for filename in listdir(self.alignments_dir):
+            if filename[:-len(".m8")] not in hashes:
+                remove(join(self.alignments_dir, filename))
+
+
+def search_homologs(query_proteome_fp,
+                    ref_fps,
+                    working_dir,
+                    align_software,
+                    num_references,
+                    e_value=10e-20,
+                    threads=1,
+                    jobs=1,
+                    pooled_database=False,
+                    database_dir=None,
+                    debug=False):
+    """ Search a query proteome against the target proteomes.
 
     Parameters
     ----------
     query_proteome_fp: string
         filepath to query proteome
-    target_proteomes_dir: string
-        dirpath to target proteomes
+    ref_fps: list
+        filepaths to target proteomes
+    working_dir: string
+        dirpath to working directory
+    align_software: string
+        software to use for sequence alignment (BLAST or DIAMOND)
+    num_references: integer
+        total number of reference sequences (bounds the number of targets
+        reported per query by a pooled search)
+    e_value: float, optional
+        the E-value cutoff to identify orthologous genes using BLASTP
+    threads: integer, optional
+        number of threads to use for sequence alignment
+    jobs: integer, optional
+        number of target proteomes searched in parallel
+    pooled_database: boolean, optional
+        if True, search once against a single database of all target
+        proteomes (see build_reference_database())
+    database_dir: string, optional
+        dirpath where the pooled database is cached (default: working_dir)
+    debug: boolean, optional
+        if True, run in debug mode
+
+    Returns
+    -------
+    alignments_fps: list
+        filepaths to the tabular alignments, to be parsed by parse_blast()
+    """
+    db_fp = None
+    max_target_seqs = None
+    if pooled_database:
+        # one database (cached by content) and one search for all
+        # proteomes, hits are split by species in parse_blast()
+        pooled_fp, db_fp = build_reference_database(
+            ref_fps=ref_fps,
+            database_dir=database_dir or working_dir,
+            align_software=align_software,
+            threads=threads,
+            debug=debug)
+        ref_fps = [pooled_fp]
+        # report every reference gene so that no species is crowded out
+        max_target_seqs = num_references
+    if align_software == "blast":
+        launch = partial(launch_blast,
+                         query_proteome_fp=query_proteome_fp,
+                         working_dir=working_dir,
+                         e_value=e_value,
+                         threads=threads,
+                         debug=debug,
+                         db_fp=db_fp,
+                         max_target_seqs=max_target_seqs)
+    elif align_software == "diamond":
+        launch = partial(launch_diamond,
+                         query_proteome_fp=query_proteome_fp,
+                         working_dir=working_dir,
+                         tmp_dir=working_dir,
+                         e_value=e_value,
+                         threads=threads,
+                         debug=debug,
+                         db_fp=db_fp,
+                         max_target_seqs=max_target_seqs)
+    else:
+        raise ValueError(
+            "Software not supported: %s" % align_software)
+    # searches against different proteomes are independent, run up to
+    # jobs of them at once through the process runner
+    get_process_runner(max_jobs=max(jobs, 1))
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        return list(executor.map(lambda ref_fp: launch(ref_fp=ref_fp),
+                                 ref_fps))
+
+
+class PairIdentities(object):
+    """ Percent identities of aligned pairs of reference genes.
+
+    Parameters
+    ----------
+    keys: numpy.ndarray
+        sorted codes first * num_genes + second of the gene id pairs (see
+        GeneTable), the first id of a pair is the smaller one
+    identities: numpy.ndarray
+        percent identity of every pair, in the order of keys
+    num_genes: integer
+        number of reference genes
+    """
+
+    def __init__(self, keys, identities, num_genes):
+        self.keys = keys
+        self.identities = identities
+        self.num_genes = num_genes
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get(self, first, second):
+        """ Percent identities of the pairs of gene ids (nan if not aligned).
+        """
+        first = numpy.asarray(first, dtype=numpy.int64)
+        second = numpy.asarray(second, dtype=numpy.int64)
+        keys = (numpy.minimum(first, second) * self.num_genes +
+                numpy.maximum(first, second))
+        identities = numpy.full(shape=keys.shape, fill_value=numpy.nan)
+        if len(self.keys):
+            positions = numpy.minimum(numpy.searchsorted(self.keys, keys),
+                                      len(self.keys) - 1)
+            found = self.keys[positions] == keys
+            identities[found] = self.identities[positions[found]]
+        return identities
+
+
+def parse_pair_identities(alignments_fps, gene_map, chunksize=1000000):
+    """ Parse the percent identities of a search of reference genes.
+
+    Parameters
+    ----------
+    alignments_fps: list
+        filepaths to tabular alignment files output by BLASTP or DIAMOND
+        whose queries and subjects are reference genes
+    gene_map: GeneTable
+        id and species of every reference gene (see preprocess_data())
+    chunksize: integer, optional
+        number of alignments read at once
+
+    Returns
+    -------
+    PairIdentities
+        the percent identity of the first alignment of every pair of distinct
+        genes (in either direction), in file order
+    """
+    pairs = []
+    identities = []
+    for alignments_fp in alignments_fps:
+        if getsize(alignments_fp) == 0:
+            continue
+        reader = pd.read_csv(alignments_fp, sep=r'\s+', header=None,
+                             usecols=[0, 1, 2],
+                             dtype={0: str, 1: str, 2: float},
+                             chunksize=chunksize)
+        for chunk in reader:
+            codes, uniques = pd.factorize(chunk[0])
+            first = gene_map.ids(uniques)[codes]
+            codes, uniques = pd.factorize(chunk[1])
+            second = gene_map.ids(uniques)[codes]
+            known = (first >= 0) & (second >= 0) & (first != second)
+            first, second = first[known], second[known]
+            pairs.append(numpy.minimum(first, second) * len(gene_map) +
+                         numpy.maximum(first, second))
+            identities.append(chunk[2].to_numpy()[known])
+    keys = numpy.concatenate(pairs) if pairs else numpy.zeros(
+        shape=0, dtype=numpy.int64)
+    identities = numpy.concatenate(identities) if identities else numpy.zeros(
+        shape=0)
+    # numpy.unique returns the first occurrence of every key
+    keys, first = numpy.unique(keys, return_index=True)
+    return PairIdentities(keys=keys, identities=identities[first],
+                          num_genes=len(gene_map))
+
+
+def search_family_pairs(hits,
+                        ref_db,
+                        gene_map,
+                        working_dir,
+                        align_software,
+                        e_value=10e-20,
+                        threads=1,
+                        debug=False):
+    """ Align all members of the gene families against each other.
+
+    Parameters
+    ----------
+    hits: HomologTable
+        table storing query (gene) names as keys and their homologs as
+        values, one gene family per query
+    ref_db: dictionary
+        dictionary storing FASTA label as key and sequence as value for the
+        reference databases
+    gene_map: GeneTable
+        id and species of every reference gene (see preprocess_data())
     working_dir: string
         dirpath to working directory
-    output_hgt_fp: string
-        filepath to output file for storing detected HGTs
     align_software: string
         software to use for sequence alignment (BLAST or DIAMOND)
-    tabular_alignments_fp: string, optional
-        filepath to tabular sequence alignments
-    ext: list, optional
-        list of file extensions to open in the target proteomes directory
-    min_num_homologs: integer, optional
-        the mininum number of homologs (determined by BLAST search)
-        for each gene to test
     e_value: float, optional
-        the E-value cutoff to identify orthologous genes using BLASTP
+        the E-value cutoff of the alignments
     threads: integer, optional
         number of threads to use for sequence alignment
+    debug: boolean, optional
+        if True, run in debug mode
+
+    Returns
+    -------
+    PairIdentities
+        percent identities of the aligned pairs of family members
+
+    Notes
+    -----
+        The members of all families are written to family_members.faa in
+        working_dir and searched against themselves once, reporting every
+        target sequence. Only the members are searched, not the whole
+        reference proteomes.
+    """
+    members = numpy.unique(hits.indices)
+    members_fp = join(working_dir, "family_members.faa")
+    with open(members_fp, 'w') as members_f:
+        for code in members:
+            ref = hits.subjects[code]
+            members_f.write(">%s\n%s\n" % (ref, ref_db[ref]))
+    if align_software == "blast":
+        alignments_fp = launch_blast(query_proteome_fp=members_fp,
+                                     ref_fp=members_fp,
+                                     working_dir=working_dir,
+                                     e_value=e_value,
+                                     threads=threads,
+                                     debug=debug,
+                                     max_target_seqs=max(len(members), 1))
+    elif align_software == "diamond":
+        alignments_fp = launch_diamond(query_proteome_fp=members_fp,
+                                       ref_fp=members_fp,
+                                       working_dir=working_dir,
+                                       tmp_dir=working_dir,
+                                       e_value=e_value,
+                                       threads=threads,
+                                       debug=debug,
+                                       max_target_seqs=0)
+    else:
+        raise ValueError(
+            "Software not supported: %s" % align_software)
+    return parse_pair_identities([alignments_fp], gene_map)
+
+
+# statistics the genes of a core cluster are compared to: of all genes or of
+# the genes of the cluster
+OUTLIER_STATISTICS = ('genome', 'cluster')
+
+
+def detect_hgt_genes(queries,
+                     checkpoint,
+                     num_species,
+                     output_hgt_fp,
+                     stdev_offset=2.326,
+                     outlier_hgt=0.5,
+                     species_set_size=30,
+                     hamming_distance=2,
+                     outlier_chunk_size=None,
+                     timer=None,
+                     genome=None,
+                     debug=False,
+                     statistics=None,
+                     outlier_statistics='genome'):
+    """ Cluster the gene families of a query genome and report its HGTs.
+
+    Parameters
+    ----------
+    queries: list
+        query (gene) names in the order of the full distance matrix
+    checkpoint: DistanceCheckpoint
+        complete distance matrix and species sets of the query genome
+    num_species: integer
+        number of species in the reference database
+    output_hgt_fp: string
+        filepath to output file for storing detected HGTs
     stdev_offset: float, optional
         the number of standard deviations a gene's normalized distance
         is from the mean to identify it as an outlier for a species pair
@@ -873,25 +4439,190 @@ def distance_method(query_proteome_fp,
         over all species-pair vectors belonging to the same gene that are
         z-score standard deviations from the mean
     species_set_size: integer, optional
-        threshold number of genes to consider a species set large (a species
-        set is a set of genes whose orthologs are detectable in exactly the
-        same subset of the considered species)
+        threshold number of genes to consider a species set large
     hamming_distance: integer, optional
         distance between two binary vectors indicating the species in which
         the corresponding ortholog gene appears
-    verbose: boolean, optional
-        if True, run in verbose mode
+    outlier_chunk_size: integer, optional
+        number of genes processed at once by the outlier detection (default:
+        all genes)
+    timer: StageTimer, optional
+        timer recording the clustering and outlier_detection stages
+    genome: string, optional
+        name of the query genome recorded with the stages
     debug: boolean, optional
         if True, run in debug mode
-    warnings: boolean, optional
-        if True, output warnings
-    timeout: integer, optional
-        number of seconds to allow Clustalw to run per call
+    statistics: tuple, optional
+        precomputed (mean, stdev) of every species pair over all genes (see
+        detect_outlier_genes()), only used with the 'genome' outlier
+        statistics
+    outlier_statistics: string, optional
+        'genome' to compare the genes of every core cluster to the mean and
+        standard deviation of the species pairs over all genes, computed
+        once, or 'cluster' to compare them to those over the genes of their
+        core cluster
+
+    Returns
+    -------
+    list
+        names of the candidate HGT genes in the order they are written
+
+    Notes
+    -----
+        Every gene is tested once, with the genes of its core cluster (see
+        gene_cluster_index()).
+    """
+    if outlier_statistics not in OUTLIER_STATISTICS:
+        raise ValueError("Outlier statistics not supported: %s"
+                         % outlier_statistics)
+    stage_fields = {} if genome is None else {'genome': genome}
+    if timer is not None:
+        timer.start('clustering', **stage_fields)
+    # the gene families whose alignment timed out have an empty species set
+    # and no distances, they are left out of the clustering (and only
+    # counted in the run report)
+    computed = checkpoint.species_sets.any(axis=1)
+    # dictionary to store all subsets of orthologs (keys) and
+    # their number of occurrences (values) (maximum occurrences
+    # is equal to the number of genes), counted in the order of the genes so
+    # it is identical for a serial, parallel or resumed run
+    species_set_dict = species_set_counts(checkpoint.species_sets[computed])
+    gene_bitvector_map = checkpoint.species_sets
+
+    # output_full_matrix(full_distance_matrix, num_species)
+
+    # cluster gene families by species
+    gene_clusters_list = cluster_distances(
+        species_set_dict=species_set_dict,
+        species_set_size=species_set_size,
+        hamming_distance=hamming_distance)
+
+    # detect outlier genes per core cluster of genes, every cluster only
+    # reads the distance matrices of its own genes
+    if timer is not None:
+        timer.start('outlier_detection', **stage_fields)
+    clusters = gene_cluster_index(checkpoint.species_sets, gene_clusters_list)
+    clusters[~computed] = -1
+    order = numpy.argsort(clusters, kind='stable')
+    bounds = numpy.searchsorted(clusters[order],
+                                numpy.arange(len(gene_clusters_list) + 1))
+    if outlier_statistics == 'cluster':
+        statistics = None
+    elif statistics is None and gene_clusters_list:
+        # shared by all clusters
+        chunk_size = outlier_chunk_size
+        if chunk_size is None or chunk_size < 1:
+            chunk_size = max(len(queries), 1)
+        statistics = species_pair_statistics(checkpoint.distances,
+                                             chunk_size, decimals=5)
+    outlier_genes = set()
+    for cluster, (core_cluster, species_set) in enumerate(
+            gene_clusters_list):
+        outlier_genes.update(detect_outlier_genes(
+            species_set=species_set,
+            gene_bitvector_map=gene_bitvector_map,
+            full_distance_matrix=checkpoint.distances,
+            stdev_offset=stdev_offset,
+            outlier_hgt=outlier_hgt,
+            num_species=num_species,
+            total_genes=len(queries),
+            chunk_size=outlier_chunk_size,
+            debug=debug,
+            statistics=statistics,
+            genes=order[bounds[cluster]:bounds[cluster+1]]))
+    hgt_genes = [queries[gene] for gene in sorted(outlier_genes)]
+    with open(output_hgt_fp, 'w') as output_hgt_f:
+        output_hgt_f.write("\n# Candidate HGT genes: \n")
+        for query in hgt_genes:
+            output_hgt_f.write("%s\n" % query)
+    if timer is not None:
+        timer.stop()
+
+    # output_full_matrix(outlier_genes, num_species)
+    return hgt_genes
+
+
+def read_query_genes(query_proteome_fps):
+    """ Map every query gene to the index of its query proteome.
+
+    Parameters
+    ----------
+    query_proteome_fps: list
+        filepaths to query proteomes
+
+    Returns
+    -------
+    dictionary
+        FASTA label of every query gene as key and the index of its proteome
+        in query_proteome_fps as value
+    """
+    query_genes = {}
+    for genome, query_proteome_fp in enumerate(query_proteome_fps):
+        for seq in skbio.io.read(query_proteome_fp, format='fasta'):
+            label = seq.metadata['id']
+            if label in query_genes:
+                raise ValueError("Duplicate query sequence labels are "
+                                 "not allowed: %s" % label)
+            query_genes[label] = genome
+    return query_genes
+
+
+def _distance_method(genomes,
+                     target_proteomes_dir,
+                     working_dir,
+                     align_software,
+                     tabular_alignments_fp,
+                     ext,
+                     min_num_homologs,
+                     e_value,
+                     threads,
+                     stdev_offset,
+                     outlier_hgt,
+                     species_set_size,
+                     hamming_distance,
+                     verbose,
+                     debug,
+                     warnings,
+                     timeout,
+                     jobs,
+                     distance_engine,
+                     distance_model,
+                     outlier_chunk_size,
+                     pooled_database,
+                     database_dir,
+                     distance_dtype,
+                     resume,
+                     checkpoint_interval,
+                     cache_dir,
+                     cache_max_size,
+                     report,
+                     timeout_scale,
+                     fast_retry,
+                     aligner,
+                     distance_mode,
+                     kmer_size,
+                     online_outliers,
+                     online_warmup,
+                     online_refresh_interval,
+                     deduplicate,
+                     outlier_statistics):
+    """ Run the Distance Method for one or more query genomes.
+
+    The references are preprocessed and searched once for all query genomes,
+    and the gene families of all of them are computed by one worker pool.
+    genomes is a list of (query_proteome_fp, output_hgt_fp, genome_dir)
+    tuples, the full distance matrix of each genome is checkpointed in its
+    genome_dir. See distance_method() for the other parameters.
     """
+    timer = StageTimer()
+    timer.start('preprocess')
+    # external commands run by this process before this run are not reported
+    first_job = len(get_process_runner().history)
     if verbose:
         sys.stdout.write(
             "Begin whole-genome HGT detection using the Distance method.\n\n")
-        sys.stdout.write("Query genome: %s\n" % query_proteome_fp)
+        for query_proteome_fp, _, _ in genomes:
+            sys.stdout.write("Query genome: %s\n" % query_proteome_fp)
 
     extensions = set(['fa', 'fasta', 'faa'])
     extensions.update(ext)
@@ -908,68 +4639,57 @@ def distance_method(query_proteome_fp,
 
     if debug:
         sys.stdout.write("\n[DEBUG] gene map:\n")
-        for gene in gene_map:
-            sys.stdout.write("[DEBUG] %s: %s\n" % (gene, gene_map[gene]))
+        for i, gene in enumerate(gene_map.labels):
+            sys.stdout.write("[DEBUG] %s: %s\n" % (
+                gene, gene_map.pseudo_name(i)))
+
+    # a single query genome keeps every family of the alignments, several
+    # query genomes get the families of their own genes
+    query_genes = None
+    query_proteome_fp = genomes[0][0]
+    if len(genomes) > 1:
+        query_genes = read_query_genes([genome[0] for genome in genomes])
+        query_proteome_fp = join(working_dir, "batch_queries.faa")
+        with open(query_proteome_fp, 'wb') as query_f:
+            for genome_fp, _, _ in genomes:
+                with open(genome_fp, 'rb') as genome_f:
+                    copyfileobj(genome_f, query_f)
+                query_f.write(b'\n')
 
+    timer.start('search')
     if verbose:
         sys.stdout.write("\nRunning BLASTp ..\n")
-    hits = {}
-
     # tabular alignments provided
     if tabular_alignments_fp is not None:
-        # generate a dictionary of orthologous genes
-        parse_blast(alignments_fp=tabular_alignments_fp,
-                    hits=hits,
-                    gene_map=gene_map,
-                    debug=debug)
+        alignments_fps = [tabular_alignments_fp]
     # tabular alignments to be created
     else:
-        files = [f
-                 for e in extensions
-                 for f in glob("%s/*%s" % (target_proteomes_dir, e))]
-        for _file in files:
-            # launch BLASTp
-            if align_software == "blast":
-                alignments_fp = launch_blast(
-                    query_proteome_fp=query_proteome_fp,
-                    ref_fp=_file,
-                    working_dir=working_dir,
-                    e_value=e_value,
-                    threads=threads,
-                    debug=debug)
-            elif align_software == "diamond":
-                alignments_fp = launch_diamond(
-                    query_proteome_fp=query_proteome_fp,
-                    ref_fp=_file,
-                    working_dir=working_dir,
-                    tmp_dir=working_dir,
-                    e_value=e_value,
-                    threads=threads,
-                    debug=debug)
-            else:
-                raise ValueError(
-                    "Software not supported: %s" % align_software)
+        alignments_fps = search_homologs(
+            query_proteome_fp=query_proteome_fp,
+            ref_fps=list_proteomes(target_proteomes_dir, extensions),
+            working_dir=working_dir,
+            align_software=align_software,
+            num_references=len(ref_db),
+            e_value=e_value,
+            threads=threads,
+            jobs=jobs,
+            pooled_database=pooled_database,
+            database_dir=database_dir,
+            debug=debug)
 
-            # generate a dictionary of orthologous genes
-            parse_blast(alignments_fp=alignments_fp,
-                        hits=hits,
-                        gene_map=gene_map,
-                        debug=debug)
+    # generate a table of orthologous genes
+    timer.start('parse_blast')
+    hits = parse_blast(alignments_fps=alignments_fps,
+                       gene_map=gene_map,
+                       debug=debug,
+                       identities=distance_mode == 'hits')
 
     # keep only genes with >= min_num_homologs
-    hits_min_num_homologs = {}
-    max_homologs = 0
-    for query in hits:
-        len_hits = len(hits[query])
-        if query in hits[query]:
-            len_hits -= 1
-        if len_hits >= min_num_homologs:
-            if query in hits_min_num_homologs:
-                raise ValueError("Duplicate gene names found: %s" % query)
-            hits_min_num_homologs[query] = hits[query]
-            if len_hits > max_homologs:
-                max_homologs = len_hits
-    hits.clear()
+    num_homologs = hits.num_homologs(exclude_query=True)
+    keep = numpy.flatnonzero(num_homologs >= min_num_homologs)
+    hits_min_num_homologs = hits.select(keep)
+    max_homologs = int(num_homologs[keep].max()) if len(keep) else 0
+    del hits
 
     if verbose:
         sys.stdout.write(
@@ -981,96 +4701,850 @@ def distance_method(query_proteome_fp,
         for query in hits_min_num_homologs:
             sys.stdout.write(
                 "[DEBUG] %s: %s\n" % (query, hits_min_num_homologs[query]))
-    # generate command for CLUSTALW
-    phy_msa_fp = join(working_dir, "msa.phy")
-    open(phy_msa_fp, 'a').close()
-    dnd_msa_fp = join(working_dir, "msa.dnd")
-    open(dnd_msa_fp, 'a').close()
-    phylip_fp = join(working_dir, "msa.dis")
-    open(phylip_fp, 'a').close()
-    # create fasta file for each gene family and run CLUSTALW
-    fasta_in_fp = join(working_dir, "input.faa")
-    clustal_command_fp = join(working_dir, "clustal_command.txt")
-    with open(clustal_command_fp, 'w') as clustal_command_f:
-        clustal_command_f.write(
-            '1\n%s\n2\n9\n1\n4\n\n1\n%s\n%s\nX\n\nX\n' % (
-                fasta_in_fp, phy_msa_fp, dnd_msa_fp))
-    phylip_command_fp = join(working_dir, "phylip_command.txt")
-    with open(phylip_command_fp, 'w') as phylip_command_f:
-        phylip_command_f.write('%s\nF\n%s\nR\nY\n' % (phy_msa_fp, phylip_fp))
-
-    total_genes = len(hits_min_num_homologs)
     if verbose:
         sys.stdout.write("\nRunning CLUSTALW and PROTDIST ..\n")
     if max_homologs > num_species:
         raise ValueError(
             "max_homologs > num_species: %s > %s " % (
                 max_homologs, num_species))
-    # distance matrix containing distances between all ortholog genes
-    full_distance_matrix = numpy.zeros(
-        shape=(total_genes, num_species, num_species), dtype=float)
-    # dictionary to store all subsets of orthologs (keys) and
-    # their number of occurrences (values) (maximum occurrences
-    # is equal to the number of genes)
-    species_set_dict = {}
-    gene_bitvector_map = {}
-    gene_id = {}
-    for i, query in enumerate(hits_min_num_homologs):
+
+    # distance matrix containing distances between all ortholog genes of
+    # every query genome, memory mapped in its directory and filled family
+    # by family
+    timer.start('families')
+    if query_genes is None:
+        genome_of_family = numpy.zeros(len(hits_min_num_homologs), dtype=int)
+    else:
+        genome_of_family = numpy.array(
+            [query_genes.get(query, -1) for query in hits_min_num_homologs],
+            dtype=int)
+    genome_families = []
+    checkpoints = []
+    pending = []
+    # the families depend on the sequences of the reference proteomes and of
+    # the query genome and on the alignments, not only on their names
+    references = hash_reference_proteomes(
+        list_proteomes(target_proteomes_dir, extensions), align_software)
+    alignments = (None if tabular_alignments_fp is None
+                  else hash_reference_proteomes([tabular_alignments_fp],
+                                                align_software))
+    for genome, (genome_fp, _, genome_dir) in enumerate(genomes):
+        if not isdir(genome_dir):
+            mkdir(genome_dir)
+        families = numpy.flatnonzero(genome_of_family == genome)
+        genome_hits = hits_min_num_homologs.select(families)
+        checkpoint = DistanceCheckpoint(
+            working_dir=genome_dir,
+            queries=list(genome_hits),
+            num_species=num_species,
+            dtype=distance_dtype,
+            settings={'query': hash_reference_proteomes([genome_fp],
+                                                        align_software),
+                      'reference_proteomes': references,
+                      'tabular_alignments': alignments,
+                      'distance_engine': distance_engine,
+                      'distance_model': distance_model,
+                      'align_software': align_software,
+                      'e_value': e_value,
+                      'aligner': aligner,
+                      'distance_mode': distance_mode,
+                      'kmer_size': (kmer_size if distance_mode == 'kmer'
+                                    else None)},
+            resume=resume,
+            hits=genome_hits)
+        if verbose and checkpoint.resumed:
+            sys.stdout.write(
+                "Resuming: %s gene families already computed for %s\n" % (
+                    checkpoint.resumed, genomes[genome][0]))
+        genome_families.append(families)
+        checkpoints.append(checkpoint)
+        pending.extend((genome, i) for i in checkpoint.pending())
+    total_genes = len(pending)
+    cache = None
+    if cache_dir is not None:
+        cache = FamilyCache(
+            cache_dir=cache_dir,
+            max_size=(None if cache_max_size is None
+                      else int(cache_max_size * 1024 * 1024)))
+    pending_hits = hits_min_num_homologs.select(
+        [genome_families[genome][i] for genome, i in pending])
+    pair_identities = None
+    if distance_mode == 'hits':
+        timer.start('all_vs_all')
+        pair_identities = search_family_pairs(
+            hits=pending_hits,
+            ref_db=ref_db,
+            gene_map=gene_map,
+            working_dir=working_dir,
+            align_software=align_software,
+            e_value=e_value,
+            threads=threads,
+            debug=debug)
+        timer.start('families')
+    family_distances = iter_family_distances(
+        hits=pending_hits,
+        working_dir=working_dir,
+        gene_map=gene_map,
+        ref_db=ref_db,
+        num_species=num_species,
+        timeout=timeout,
+        jobs=jobs,
+        distance_engine=distance_engine,
+        distance_model=distance_model,
+        warnings=warnings,
+        debug=debug,
+        cache=cache,
+        timeout_scale=timeout_scale,
+        fast_retry=fast_retry,
+        aligner=aligner,
+        distance_mode=distance_mode,
+        kmer_size=kmer_size,
+        pair_identities=pair_identities,
+        locations=[checkpoints[genome].location(i)
+                   for genome, i in pending],
+        deduplicate=deduplicate)
+    # provisional outliers of every query genome, tested as the families
+    # complete
+    detectors = None
+    if online_outliers:
+        detectors = [OnlineOutlierDetector(
+            checkpoint=checkpoints[genome],
+            queries=list(hits_min_num_homologs.select(
+                genome_families[genome])),
+            output_fp="%s.provisional.txt" % output_hgt_fp,
+            num_species=num_species,
+            stdev_offset=stdev_offset,
+            outlier_hgt=outlier_hgt,
+            warmup=online_warmup,
+            refresh_interval=online_refresh_interval,
+            chunk_size=outlier_chunk_size,
+            outlier_statistics=outlier_statistics,
+            species_set_size=species_set_size,
+            hamming_distance=hamming_distance)
+            for genome, (_, output_hgt_fp, _) in enumerate(genomes)]
+    family_stats = [[] for _ in genomes]
+    for n, (position, query, distance_matrix, bitvector, stats) in (
+            enumerate(family_distances)):
+        genome, i = pending[position]
         if verbose:
-            print("Computing MSA and distances for gene %s .. (%s/%s)" % (
-                query, i+1, total_genes))
-        gene_id[i] = query
-        # generate a multiple sequence alignment
-        # for each orthologous gene family
-        launch_msa(fasta_in_fp=fasta_in_fp,
-                   clustal_command_fp=clustal_command_fp,
-                   ref_db=ref_db,
-                   gene_map=gene_map,
-                   hits=hits_min_num_homologs,
-                   query=query,
-                   timeout=timeout)
-
-        # compute distances between each pair of sequences in MSA
-        compute_distances(phylip_command_fp=phylip_command_fp,
-                          warnings=warnings)
-
-        # Z-score normalize distance matrix and add results
-        # to full distance matrix (for all genes)
-        normalize_distances(phylip_fp=phylip_fp,
-                            full_distance_matrix=full_distance_matrix,
-                            num_species=num_species,
-                            full_distance_matrix_offset=i,
-                            species_set_dict=species_set_dict,
-                            gene_bitvector_map=gene_bitvector_map,
-                            debug=debug)
+            print("Computed MSA and distances for gene %s .. (%s/%s)" % (
+                query, n+1, total_genes))
+        checkpoints[genome].store(i, distance_matrix, bitvector)
+        family_stats[genome].append(stats)
+        if detectors is not None and detectors[genome].update(i) and verbose:
+            print("Provisional HGT candidate: %s" % query)
+        if (n+1) % max(checkpoint_interval, 1) == 0:
+            for checkpoint in checkpoints:
+                checkpoint.commit()
+    for checkpoint in checkpoints:
+        checkpoint.commit()
+    if verbose and deduplicate:
+        sys.stdout.write(
+            "Copied the distances of %s duplicate gene families\n" % sum(
+                1 for stats in chain.from_iterable(family_stats)
+                if stats['duplicate_of']))
+    if cache is not None:
+        evicted = cache.evict()
+        if verbose and evicted:
+            sys.stdout.write("Evicted %s gene families from the cache\n"
+                             % evicted)
 
-    # output_full_matrix(full_distance_matrix, num_species)
+    for genome, (_, output_hgt_fp, _) in enumerate(genomes):
+        hgt_genes = detect_hgt_genes(
+            queries=list(hits_min_num_homologs.select(
+                genome_families[genome])),
+            checkpoint=checkpoints[genome],
+            num_species=num_species,
+            output_hgt_fp=output_hgt_fp,
+            stdev_offset=stdev_offset,
+            outlier_hgt=outlier_hgt,
+            species_set_size=species_set_size,
+            hamming_distance=hamming_distance,
+            outlier_chunk_size=outlier_chunk_size,
+            timer=timer,
+            genome=(None if len(genomes) == 1
+                    else basename(genomes[genome][0])),
+            debug=debug,
+            statistics=(None if detectors is None
+                        else detectors[genome].statistics()),
+            outlier_statistics=outlier_statistics)
+        if detectors is not None:
+            detectors[genome].finalize(hgt_genes)
 
-    # cluster gene families by species
-    gene_clusters_dict = cluster_distances(
-        species_set_dict=species_set_dict,
-        species_set_size=species_set_size,
-        hamming_distance=hamming_distance)
+    if report:
+        for genome, (_, output_hgt_fp, _) in enumerate(genomes):
+            write_run_report(output_hgt_fp=output_hgt_fp,
+                             timer=timer,
+                             family_stats=family_stats[genome],
+                             jobs=get_process_runner().history[first_job:])
 
-    # detect outlier genes per core cluster of genes
-    with open(output_hgt_fp, 'w') as output_hgt_f:
-        output_hgt_f.write("\n# Candidate HGT genes: \n")
-        for core_cluster in gene_clusters_dict:
-            outlier_genes = detect_outlier_genes(
-                species_set=gene_clusters_dict[core_cluster],
-                gene_bitvector_map=gene_bitvector_map,
-                full_distance_matrix=full_distance_matrix,
-                stdev_offset=stdev_offset,
-                outlier_hgt=outlier_hgt,
-                num_species=num_species,
-                total_genes=total_genes,
-                debug=debug)
-
-            if outlier_genes:
-                for gene in outlier_genes:
-                    output_hgt_f("%s\n" % gene_id[gene])
 
-    # output_full_matrix(outlier_genes, num_species)
+def update_distance_method(query_proteome_fp,
+                           target_proteomes_dir,
+                           working_dir,
+                           state_dir,
+                           output_hgt_fp,
+                           align_software,
+                           ext=['fa', 'fasta', 'faa'],
+                           min_num_homologs=3,
+                           e_value=10e-20,
+                           threads=1,
+                           stdev_offset=2.326,
+                           outlier_hgt=0.5,
+                           species_set_size=30,
+                           hamming_distance=2,
+                           verbose=False,
+                           debug=False,
+                           warnings=False,
+                           timeout=120,
+                           jobs=1,
+                           distance_engine='protdist',
+                           distance_model='jtt',
+                           outlier_chunk_size=None,
+                           distance_dtype='float64',
+                           checkpoint_interval=100,
+                           cache_dir=None,
+                           cache_max_size=None,
+                           report=False,
+                           timeout_scale=0.0,
+                           fast_retry=False,
+                           aligner='clustalw',
+                           distance_mode='msa',
+                           kmer_size=4,
+                           deduplicate=False,
+                           outlier_statistics='genome'):
+    """ Run Distance Method algorithm incrementally on a changing panel
+
+    Parameters
+    ----------
+    state_dir: string
+        dirpath to the persistent state of the previous runs (see
+        ReferencePanelState)
+    See distance_method() for the other parameters.
+
+    Returns
+    -------
+    dictionary
+        number of reference proteomes 'added', 'removed' and 'kept' since the
+        previous run, and of gene families 'reused' and 'computed'
+
+    Notes
+    -----
+        The query proteome is searched only against the reference proteomes
+        added (or modified) since the previous run, and only the gene families
+        whose homologs changed are aligned again. The distance matrices of the
+        other families are copied to the new species order. The statistics of
+        the species pairs shared by a changed family are recomputed, those of
+        the other pairs are reused. The outlier detection then runs with these
+        statistics on all genes (its threshold depends on the number of
+        species).
+    """
+    timer = StageTimer()
+    timer.start('preprocess')
+    first_job = len(get_process_runner().history)
+    extensions = set(['fa', 'fasta', 'faa'])
+    extensions.update(ext)
+    if not isdir(working_dir):
+        mkdir(working_dir)
+
+    ref_fps = list_proteomes(target_proteomes_dir, extensions)
+    proteomes = [{'name': basename(ref_fp),
+                  'hash': hash_reference_proteomes([ref_fp], align_software)}
+                 for ref_fp in ref_fps]
+    state = ReferencePanelState(state_dir, settings={
+        'query': hash_reference_proteomes([query_proteome_fp],
+                                          align_software),
+        'align_software': align_software,
+        'e_value': e_value,
+        'distance_engine': distance_engine,
+        'distance_model': (distance_model if distance_engine == 'native'
+                           else None),
+        'distance_dtype': numpy.dtype(distance_dtype).name,
+        'aligner': aligner,
+        'distance_mode': distance_mode,
+        'kmer_size': kmer_size if distance_mode == 'kmer' else None})
+    previous = [] if state.manifest is None else state.manifest['proteomes']
+    # species of every previous proteome in the current panel (-1 if it was
+    # removed or modified)
+    species = {proteome['hash']: i for i, proteome in enumerate(proteomes)}
+    old_species = numpy.array(
+        [species.get(proteome['hash'], -1) for proteome in previous],
+        dtype=numpy.intp)
+    kept_old = numpy.flatnonzero(old_species >= 0)
+    kept_new = old_species[kept_old]
+    is_kept = numpy.zeros(shape=len(proteomes), dtype=bool)
+    is_kept[kept_new] = True
+    summary = {'added': len(proteomes) - len(kept_new),
+               'removed': len(previous) - len(kept_old),
+               'kept': len(kept_new)}
+    if verbose:
+        sys.stdout.write(
+            "Reference proteomes: %(kept)s kept, %(added)s added, "
+            "%(removed)s removed\n" % summary)
+
+    gene_map, ref_db, num_species = preprocess_data(
+        working_dir=working_dir,
+        target_proteomes_dir=target_proteomes_dir,
+        extensions=extensions,
+        verbose=verbose)
+
+    # search only the proteomes without stored alignments
+    timer.start('search')
+    missing = [i for i, proteome in enumerate(proteomes)
+               if not exists(state.alignments_fp(proteome['hash']))]
+    if missing:
+        alignments_fps = search_homologs(
+            query_proteome_fp=query_proteome_fp,
+            ref_fps=[ref_fps[i] for i in missing],
+            working_dir=working_dir,
+            align_software=align_software,
+            num_references=len(ref_db),
+            e_value=e_value,
+            threads=threads,
+            jobs=jobs,
+            debug=debug)
+        for i, alignments_fp in zip(missing, alignments_fps):
+            move(alignments_fp, state.alignments_fp(proteomes[i]['hash']))
+
+    timer.start('parse_blast')
+    hits = parse_blast(alignments_fps=[state.alignments_fp(proteome['hash'])
+                                       for proteome in proteomes],
+                       gene_map=gene_map,
+                       debug=debug,
+                       identities=distance_mode == 'hits')
+    num_homologs = hits.num_homologs(exclude_query=True)
+    keep = numpy.flatnonzero(num_homologs >= min_num_homologs)
+    hits = hits.select(keep)
+    max_homologs = int(num_homologs[keep].max()) if len(keep) else 0
+    if max_homologs > num_species:
+        raise ValueError(
+            "max_homologs > num_species: %s > %s " % (
+                max_homologs, num_species))
+    queries = list(hits)
+
+    # a family is reused if its homologs are identical and all belong to
+    # proteomes of the previous panel
+    timer.start('families')
+    previous_families = {}
+    if state.manifest is not None:
+        previous_families = state.load_families()
+    old_rows = {query: row for row, query in enumerate(previous_families)}
+    reuse = {}
+    for row, query in enumerate(queries):
+        members = hits[query]
+        if (previous_families.get(query) == members and
+                is_kept[gene_map.species[gene_map.ids(members)]].all()):
+            reuse[row] = old_rows[query]
+    if (state.manifest is not None and previous == proteomes and
+            list(previous_families) == queries):
+        generation = state.manifest['generation']
+    else:
+        generation = (0 if state.manifest is None
+                      else state.manifest['generation'] + 1)
+    # an interrupted update of another panel may have left a directory of
+    # the same generation, its families and distances are replaced
+    generation_dir = state.generation_dir(generation)
+    if not isdir(generation_dir):
+        mkdir(generation_dir)
+    state.save_families(generation, hits)
+    checkpoint = DistanceCheckpoint(working_dir=generation_dir,
+                                    queries=queries,
+                                    num_species=num_species,
+                                    dtype=distance_dtype,
+                                    settings=dict(state.settings,
+                                                  proteomes=proteomes),
+                                    resume=True,
+                                    hits=hits)
+    # species pairs whose statistics change: those of the families that
+    # left the panel, of the families computed below and of the new species
+    pairs = ~(is_kept[:, None] & is_kept[None, :])
+    if state.manifest is not None:
+        previous_dir = state.generation_dir()
+        old_distances = open_memmap(
+            join(previous_dir, DistanceCheckpoint.distances_name), mode='r')
+        old_species_sets = open_memmap(
+            join(previous_dir, DistanceCheckpoint.species_sets_name),
+            mode='r')
+        for row, old_row in reuse.items():
+            if checkpoint.completed[row]:
+                continue
+            distance_matrix = numpy.full(
+                shape=(num_species, num_species), fill_value=numpy.nan)
+            distance_matrix[numpy.ix_(kept_new, kept_new)] = old_distances[
+                old_row][numpy.ix_(kept_old, kept_old)]
+            present = numpy.zeros(shape=num_species, dtype=bool)
+            present[kept_new] = numpy.unpackbits(
+                old_species_sets[old_row].view(numpy.uint8),
+                count=len(previous), bitorder='little')[kept_old]
+            checkpoint.store(row, distance_matrix,
+                             encode_species_set(present))
+        checkpoint.commit()
+        left = numpy.setdiff1d(numpy.arange(len(previous_families)),
+                               list(reuse.values()))
+        present = numpy.zeros(shape=(len(left), num_species))
+        if len(left):
+            present[:, kept_new] = numpy.unpackbits(
+                old_species_sets[left].view(numpy.uint8), axis=1,
+                count=len(previous), bitorder='little')[:, kept_old]
+        pairs |= present.T.dot(present) > 0
+        del old_distances, old_species_sets
+    pending = checkpoint.pending()
+    summary['reused'] = len(reuse)
+    summary['computed'] = len(pending)
+    if verbose:
+        sys.stdout.write("Gene families: %(reused)s reused, %(computed)s to "
+                         "compute\n" % summary)
+
+    cache = None
+    if cache_dir is not None:
+        cache = FamilyCache(
+            cache_dir=cache_dir,
+            max_size=(None if cache_max_size is None
+                      else int(cache_max_size * 1024 * 1024)))
+    pair_identities = None
+    if distance_mode == 'hits':
+        timer.start('all_vs_all')
+        pair_identities = search_family_pairs(
+            hits=hits.select(pending),
+            ref_db=ref_db,
+            gene_map=gene_map,
+            working_dir=working_dir,
+            align_software=align_software,
+            e_value=e_value,
+            threads=threads,
+            debug=debug)
+        timer.start('families')
+    family_distances = iter_family_distances(
+        hits=hits.select(pending),
+        working_dir=working_dir,
+        gene_map=gene_map,
+        ref_db=ref_db,
+        num_species=num_species,
+        timeout=timeout,
+        jobs=jobs,
+        distance_engine=distance_engine,
+        distance_model=distance_model,
+        warnings=warnings,
+        debug=debug,
+        cache=cache,
+        timeout_scale=timeout_scale,
+        fast_retry=fast_retry,
+        aligner=aligner,
+        distance_mode=distance_mode,
+        kmer_size=kmer_size,
+        pair_identities=pair_identities,
+        locations=[checkpoint.location(i) for i in pending],
+        deduplicate=deduplicate)
+    family_stats = []
+    for n, (position, query, distance_matrix, bitvector, stats) in (
+            enumerate(family_distances)):
+        i = pending[position]
+        if verbose:
+            print("Computed MSA and distances for gene %s .. (%s/%s)" % (
+                query, n+1, len(pending)))
+        # stored as rounded by detect_outlier_genes() so that the statistics
+        # of the species pairs can be reused by the next update
+        if distance_matrix is None:
+            checkpoint.distances[i] = numpy.around(checkpoint.distances[i],
+                                                   decimals=5)
+        else:
+            numpy.around(distance_matrix, decimals=5, out=distance_matrix)
+        checkpoint.store(i, distance_matrix, bitvector)
+        family_stats.append(stats)
+        if (n+1) % max(checkpoint_interval, 1) == 0:
+            checkpoint.commit()
+    checkpoint.commit()
+    if cache is not None:
+        cache.evict()
+
+    timer.start('species_pair_statistics')
+    chunk_size = outlier_chunk_size
+    if chunk_size is None or chunk_size < 1:
+        chunk_size = max(len(queries), 1)
+    statistics = None if state.manifest is None else state.load_statistics()
+    if statistics is None:
+        mean, stdev = species_pair_statistics(checkpoint.distances,
+                                              chunk_size)
+    else:
+        computed = numpy.setdiff1d(numpy.arange(len(queries)), list(reuse))
+        present = numpy.unpackbits(
+            checkpoint.species_sets[computed].view(numpy.uint8), axis=1,
+            count=num_species, bitorder='little').astype(float)
+        pairs |= present.T.dot(present) > 0
+        mean = numpy.full(shape=(num_species, num_species),
+                          fill_value=numpy.nan)
+        stdev = mean.copy()
+        mean[numpy.ix_(kept_new, kept_new)] = statistics[0][
+            numpy.ix_(kept_old, kept_old)]
+        stdev[numpy.ix_(kept_new, kept_new)] = statistics[1][
+            numpy.ix_(kept_old, kept_old)]
+        pair_mean, pair_stdev = species_pair_statistics(
+            checkpoint.distances, chunk_size, pairs=pairs)
+        mean[pairs] = pair_mean[pairs]
+        stdev[pairs] = pair_stdev[pairs]
+    state.save_statistics(generation, mean, stdev)
+
+    detect_hgt_genes(queries=queries,
+                     checkpoint=checkpoint,
+                     num_species=num_species,
+                     output_hgt_fp=output_hgt_fp,
+                     stdev_offset=stdev_offset,
+                     outlier_hgt=outlier_hgt,
+                     species_set_size=species_set_size,
+                     hamming_distance=hamming_distance,
+                     outlier_chunk_size=outlier_chunk_size,
+                     timer=timer,
+                     debug=debug,
+                     statistics=(mean, stdev),
+                     outlier_statistics=outlier_statistics)
+    del checkpoint
+    state.commit(generation, proteomes)
+
+    if report:
+        write_run_report(output_hgt_fp=output_hgt_fp,
+                         timer=timer,
+                         family_stats=family_stats,
+                         jobs=get_process_runner().history[first_job:])
+    return summary
+
+
+def distance_method(query_proteome_fp,
+                    target_proteomes_dir,
+                    working_dir,
+                    output_hgt_fp,
+                    align_software,
+                    tabular_alignments_fp=None,
+                    ext=['fa', 'fasta', 'faa'],
+                    min_num_homologs=3,
+                    e_value=10e-20,
+                    threads=1,
+                    stdev_offset=2.326,
+                    outlier_hgt=0.5,
+                    species_set_size=30,
+                    hamming_distance=2,
+                    verbose=False,
+                    debug=False,
+                    warnings=False,
+                    timeout=120,
+                    jobs=1,
+                    distance_engine='protdist',
+                    distance_model='jtt',
+                    outlier_chunk_size=None,
+                    pooled_database=False,
+                    database_dir=None,
+                    distance_dtype='float64',
+                    resume=False,
+                    checkpoint_interval=100,
+                    cache_dir=None,
+                    cache_max_size=None,
+                    report=False,
+                    state_dir=None,
+                    timeout_scale=0.0,
+                    fast_retry=False,
+                    aligner='clustalw',
+                    distance_mode='msa',
+                    kmer_size=4,
+                    online_outliers=False,
+                    online_warmup=100,
+                    online_refresh_interval=100,
+                    deduplicate=False,
+                    outlier_statistics='genome'):
+    """ Run Distance Method algorithm
+
+    Parameters
+    ----------
+    query_proteome_fp: string
+        filepath to query proteome
+    target_proteomes_dir: string
+        dirpath to target proteomes
+    working_dir: string
+        dirpath to working directory
+    output_hgt_fp: string
+        filepath to output file for storing detected HGTs
+    align_software: string
+        software to use for sequence alignment (BLAST or DIAMOND)
+    tabular_alignments_fp: string, optional
+        filepath to tabular sequence alignments
+    ext: list, optional
+        list of file extensions to open in the target proteomes directory
+    min_num_homologs: integer, optional
+        the mininum number of homologs (determined by BLAST search)
+        for each gene to test
+    e_value: float, optional
+        the E-value cutoff to identify orthologous genes using BLASTP
+    threads: integer, optional
+        number of threads to use for sequence alignment
+    stdev_offset: float, optional
+        the number of standard deviations a gene's normalized distance
+        is from the mean to identify it as an outlier for a species pair
+    outlier_hgt: float, optional
+        the fraction (value between (0,1]) of normalized pairwise distances
+        over all species-pair vectors belonging to the same gene that are
+        z-score standard deviations from the mean
+    species_set_size: integer, optional
+        threshold number of genes to consider a species set large (a species
+        set is a set of genes whose orthologs are detectable in exactly the
+        same subset of the considered species)
+    hamming_distance: integer, optional
+        distance between two binary vectors indicating the species in which
+        the corresponding ortholog gene appears
+    verbose: boolean, optional
+        if True, run in verbose mode
+    debug: boolean, optional
+        if True, run in debug mode
+    warnings: boolean, optional
+        if True, output warnings
+    timeout: integer, optional
+        minimum number of seconds to allow the aligner to run per gene family
+    jobs: integer, optional
+        number of gene families to align and compare in parallel (and of
+        target proteomes searched in parallel)
+    distance_engine: string, optional
+        'protdist' to compute the pairwise distances with PHYLIP's protdist or
+        'native' to compute them in-process
+    distance_model: string, optional
+        distance model of the native engine (see DISTANCE_MODELS)
+    outlier_chunk_size: integer, optional
+        number of genes processed at once by the outlier detection (default:
+        all genes)
+    pooled_database: boolean, optional
+        if True, search the query once against a single database of all
+        target proteomes instead of once per proteome
+    database_dir: string, optional
+        dirpath where the pooled database is cached across runs (default:
+        working_dir)
+    distance_dtype: string, optional
+        'float64' or 'float32' storage of the full distance matrix, which is
+        memory mapped in working_dir (see DistanceCheckpoint)
+    resume: boolean, optional
+        if True, skip the gene families already computed by a previous run
+        with the same families and settings in working_dir (an incremental
+        run always resumes the families of its state_dir)
+    checkpoint_interval: integer, optional
+        number of gene families computed between two writes of the
+        checkpoint to disk
+    cache_dir: string, optional
+        dirpath to a cache of family alignments and distances shared across
+        runs (see FamilyCache), runs that only change the clustering or
+        outlier parameters then skip the alignment and the distance computation
+    cache_max_size: integer, optional
+        maximum size of the cache in megabytes, the least recently used
+        families are evicted at the end of the run (default: unbounded)
+    report: boolean, optional
+        if True, write the wall time, CPU time and peak memory of every stage
+        and the statistics of every gene family next to output_hgt_fp (see
+        write_run_report())
+    state_dir: string, optional
+        dirpath to a persistent state, if given the run only searches the
+        target proteomes and aligns the gene families that changed since the
+        previous run with the same state (see update_distance_method())
+    timeout_scale: float, optional
+        number of seconds added to the aligner timeout of a gene family per
+        billion dynamic programming cells of its alignment, estimated from
+        its number of members and residues (see family_timeouts()), 0 (the
+        default) gives every family the timeout
+    fast_retry: boolean, optional
+        if True, align the gene families whose alignment timed out again with
+        the faster setting of the aligner (Clustalw's fast pairwise
+        alignments, see MSA_BACKENDS for the others), the families that still
+        time out are reported and left out of the outlier detection
+    aligner: string, optional
+        multiple sequence aligner of the gene families, one of ALIGNERS
+        ('clustalw', 'mafft', 'kalign' or 'muscle') or 'auto' to pick an
+        accurate or a fast installed aligner depending on the size of every
+        family (see select_aligner())
+    distance_mode: string, optional
+        'msa' to compute the distances of every gene family from a multiple
+        sequence alignment, 'kmer' to compute Mash distances from the exact
+        k-mer sets of its sequences without aligning them (see
+        compute_kmer_distances()), much faster for screening many genomes,
+        the outlier genes can then be confirmed with the 'msa' mode, 'hits'
+        to compute Poisson corrected distances from the percent identities
+        of the homology search (see compute_hit_distances()), after aligning
+        the members of the gene families against each other once (see
+        search_family_pairs())
+    kmer_size: integer, optional
+        length of the k-mers of the 'kmer' distance mode
+    online_outliers: boolean, optional
+        if True, test every gene for outliers as soon as its family is
+        computed, against running statistics of the species pairs over all
+        genes or over the genes of its provisional core cluster (following
+        outlier_statistics, see OnlineOutlierDetector), and stream the
+        provisional candidates to <output_hgt_fp>.provisional.txt; the final
+        outlier detection then reuses the running statistics over all genes
+    online_warmup: integer, optional
+        number of gene families computed before the first genes are tested
+        by the online outlier detection
+    online_refresh_interval: integer, optional
+        number of genes tested by the online outlier detection between two
+        updates of its bounds from the running statistics
+    deduplicate: boolean, optional
+        if True, align and compare the gene families with identical members
+        (species and sequences) once and copy their distance matrix to the
+        duplicates (see deduplicate_families())
+    outlier_statistics: string, optional
+        'genome' to detect the outlier genes of every core cluster with the
+        statistics of the species pairs over all genes or 'cluster' with
+        those over the genes of the cluster (see detect_hgt_genes())
+    """
+    if state_dir is not None:
+        if tabular_alignments_fp is not None or pooled_database:
+            raise ValueError("Incremental runs search every target proteome "
+                             "separately, tabular_alignments_fp and "
+                             "pooled_database are not supported")
+        if online_outliers:
+            raise ValueError("Incremental runs reuse the statistics of the "
+                             "species pairs, online_outliers is not "
+                             "supported")
+        update_distance_method(query_proteome_fp=query_proteome_fp,
+                               target_proteomes_dir=target_proteomes_dir,
+                               working_dir=working_dir,
+                               state_dir=state_dir,
+                               output_hgt_fp=output_hgt_fp,
+                               align_software=align_software,
+                               ext=ext,
+                               min_num_homologs=min_num_homologs,
+                               e_value=e_value,
+                               threads=threads,
+                               stdev_offset=stdev_offset,
+                               outlier_hgt=outlier_hgt,
+                               species_set_size=species_set_size,
+                               hamming_distance=hamming_distance,
+                               verbose=verbose,
+                               debug=debug,
+                               warnings=warnings,
+                               timeout=timeout,
+                               jobs=jobs,
+                               distance_engine=distance_engine,
+                               distance_model=distance_model,
+                               outlier_chunk_size=outlier_chunk_size,
+                               distance_dtype=distance_dtype,
+                               checkpoint_interval=checkpoint_interval,
+                               cache_dir=cache_dir,
+                               cache_max_size=cache_max_size,
+                               report=report,
+                               timeout_scale=timeout_scale,
+                               fast_retry=fast_retry,
+                               aligner=aligner,
+                               distance_mode=distance_mode,
+                               kmer_size=kmer_size,
+                               deduplicate=deduplicate,
+                               outlier_statistics=outlier_statistics)
+        return
+    _distance_method(genomes=[(query_proteome_fp, output_hgt_fp, working_dir)],
+                     target_proteomes_dir=target_proteomes_dir,
+                     working_dir=working_dir,
+                     align_software=align_software,
+                     tabular_alignments_fp=tabular_alignments_fp,
+                     ext=ext,
+                     min_num_homologs=min_num_homologs,
+                     e_value=e_value,
+                     threads=threads,
+                     stdev_offset=stdev_offset,
+                     outlier_hgt=outlier_hgt,
+                     species_set_size=species_set_size,
+                     hamming_distance=hamming_distance,
+                     verbose=verbose,
+                     debug=debug,
+                     warnings=warnings,
+                     timeout=timeout,
+                     jobs=jobs,
+                     distance_engine=distance_engine,
+                     distance_model=distance_model,
+                     outlier_chunk_size=outlier_chunk_size,
+                     pooled_database=pooled_database,
+                     database_dir=database_dir,
+                     distance_dtype=distance_dtype,
+                     resume=resume,
+                     checkpoint_interval=checkpoint_interval,
+                     cache_dir=cache_dir,
+                     cache_max_size=cache_max_size,
+                     report=report,
+                     timeout_scale=timeout_scale,
+                     fast_retry=fast_retry,
+                     aligner=aligner,
+                     distance_mode=distance_mode,
+                     kmer_size=kmer_size,
+                     online_outliers=online_outliers,
+                     online_warmup=online_warmup,
+                     online_refresh_interval=online_refresh_interval,
+                     deduplicate=deduplicate,
+                     outlier_statistics=outlier_statistics)
+
+
+def distance_method_batch(query_proteome_fps,
+                          target_proteomes_dir,
+                          working_dir,
+                          output_dir,
+                          align_software,
+                          **kwargs):
+    """ Run Distance Method algorithm for several query genomes at once
+
+    Parameters
+    ----------
+    query_proteome_fps: list
+        filepaths to query proteomes (with distinct file names and sequence
+        labels)
+    target_proteomes_dir: string
+        dirpath to target proteomes
+    working_dir: string
+        dirpath to working directory, the full distance matrix of every query
+        genome is checkpointed in working_dir/<query proteome file name>
+    output_dir: string
+        dirpath where the detected HGTs of every query genome are written to
+        <query proteome file name>.hgt.txt
+    align_software: string
+        software to use for sequence alignment (BLAST or DIAMOND)
+    kwargs: dictionary, optional
+        other parameters of distance_method(), tabular_alignments_fp may hold
+        the alignments of all query genomes
+
+    Returns
+    -------
+    output_hgt_fps: list
+        filepaths to the output files, in the order of query_proteome_fps
+
+    Notes
+    -----
+        The target proteomes are preprocessed and searched once for all query
+        genomes (their proteomes are concatenated into one query), and the
+        gene families of all query genomes go through a single pool of jobs
+        workers. Only the clustering and outlier detection are run per query
+        genome. The run report of every query genome holds the stages of the
+        whole batch and the statistics of its own gene families.
+    """
+    options = {name: parameter.default
+               for name, parameter in signature(
+                   distance_method).parameters.items()
+               if parameter.default is not parameter.empty}
+    unknown = set(kwargs) - set(options)
+    if unknown:
+        raise TypeError("Unknown parameters: %s" % ', '.join(sorted(unknown)))
+    options.update(kwargs)
+    if options.pop('state_dir') is not None:
+        raise ValueError("Incremental runs (state_dir) take a single query "
+                         "proteome")
+    if not query_proteome_fps:
+        raise ValueError("At least one query proteome is required")
+    names = [basename(query_proteome_fp)
+             for query_proteome_fp in query_proteome_fps]
+    if len(set(names)) != len(names):
+        raise ValueError("Query proteome file names must be distinct: %s"
+                         % names)
+    if not isdir(working_dir):
+        mkdir(working_dir)
+    if not isdir(output_dir):
+        mkdir(output_dir)
+    genomes = [(query_proteome_fp,
+                join(output_dir, "%s.hgt.txt" % name),
+                join(working_dir, name))
+               for query_proteome_fp, name in zip(query_proteome_fps, names)]
+    _distance_method(genomes=genomes,
+                     target_proteomes_dir=target_proteomes_dir,
+                     working_dir=working_dir,
+                     align_software=align_software,
+                     **options)
+    return [output_hgt_fp for _, output_hgt_fp, _ in genomes]
 
 
 @click.command()
@@ -1135,8 +5609,103 @@ def distance_method(query_proteome_fp,
 @click.option('--warnings', type=bool, required=False, default=False,
               show_default=True, help="Print program warnings")
 @click.option('--timeout', type=int, required=False, default=120,
-              show_default=True, help="Number of seconds to allow Clustalw "
-                                      "to run per call")
+              show_default=True, help="Minimum number of seconds to allow "
+                                      "the aligner to run per gene family")
+@click.option('--timeout-scale', type=float, required=False, default=0.0,
+              show_default=True, help="Seconds added to the aligner timeout "
+                                      "of a gene family per billion dynamic "
+                                      "programming cells of its estimated "
+                                      "alignment cost (0: fixed timeout)")
+@click.option('--fast-retry', type=bool, required=False, default=False,
+              show_default=True, help="Align the gene families that time "
+                                      "out again with the faster setting of "
+                                      "the aligner")
+@click.option('--aligner', type=click.Choice(ALIGNERS + ('auto',)),
+              required=False, default='clustalw', show_default=True,
+              help="Multiple sequence aligner of the gene families, 'auto' "
+                   "picks the fastest adequate installed aligner by family "
+                   "size")
+@click.option('--distance-mode', type=click.Choice(DISTANCE_MODES),
+              required=False, default='msa', show_default=True,
+              help="Compute the distances of every gene family from a "
+                   "multiple sequence alignment, from the k-mers of its "
+                   "sequences or from the percent identities of the "
+                   "homology search (alignment-free, for screening)")
+@click.option('--kmer-size', type=click.IntRange(1, 14), required=False,
+              default=4, show_default=True,
+              help="Length of the k-mers of the kmer distance mode")
+@click.option('--online-outliers', type=bool, required=False, default=False,
+              show_default=True,
+              help="Test every gene for outliers as soon as its family is "
+                   "computed and stream the provisional candidates to "
+                   "<output-hgt-fp>.provisional.txt")
+@click.option('--online-warmup', type=int, required=False, default=100,
+              show_default=True,
+              help="Number of gene families computed before the online "
+                   "outlier detection tests the first genes")
+@click.option('--online-refresh-interval', type=int, required=False,
+              default=100, show_default=True,
+              help="Number of genes tested by the online outlier detection "
+                   "between two updates of its bounds")
+@click.option('--jobs', type=int, required=False, default=1,
+              show_default=True, help="Number of gene families to align "
+                                      "and compare (and of target proteomes "
+                                      "to search) in parallel")
+@click.option('--distance-engine', type=click.Choice(['protdist', 'native']),
+              required=False, default='protdist', show_default=True,
+              help="Compute pairwise distances with PHYLIP's protdist or "
+                   "in-process")
+@click.option('--distance-model', type=click.Choice(DISTANCE_MODELS),
+              required=False, default='jtt', show_default=True,
+              help="Distance model of the native distance engine")
+@click.option('--outlier-chunk-size', type=int, required=False, default=None,
+              help="Number of genes processed at once by the outlier "
+                   "detection, bounds its memory (default: all genes)")
+@click.option('--pooled-database', type=bool, required=False, default=False,
+              show_default=True, help="Search the query once against a "
+                                      "single cached database of all target "
+                                      "proteomes")
+@click.option('--database-dir', required=False,
+              type=click.Path(resolve_path=True, readable=True, exists=False,
+                              file_okay=False),
+              help="Directory caching the pooled database across runs "
+                   "(default: working directory)")
+@click.option('--distance-dtype', type=click.Choice(['float64', 'float32']),
+              required=False, default='float64', show_default=True,
+              help="Storage type of the memory-mapped full distance matrix")
+@click.option('--outlier-statistics', type=click.Choice(OUTLIER_STATISTICS),
+              required=False, default='genome', show_default=True,
+              help="Compare the genes of every core cluster to the species "
+                   "pair statistics of all genes or of the genes of the "
+                   "cluster")
+@click.option('--deduplicate', type=bool, required=False, default=False,
+              show_default=True, help="Align and compare the gene families "
+                                      "with identical members once")
+@click.option('--resume', type=bool, required=False, default=False,
+              show_default=True, help="Skip the gene families already "
+                                      "computed in the working directory")
+@click.option('--checkpoint-interval', type=int, required=False,
+              default=100, show_default=True,
+              help="Number of gene families computed between two "
+                   "checkpoints")
+@click.option('--cache-dir', required=False,
+              type=click.Path(resolve_path=True, readable=True, exists=False,
+                              file_okay=False),
+              help="Directory caching the alignment and distances of every "
+                   "gene family across runs")
+@click.option('--cache-max-size', type=float, required=False, default=None,
+              help="Maximum size of the cache in megabytes, least recently "
+                   "used families are evicted (default: unbounded)")
+@click.option('--report', type=bool, required=False, default=False,
+              show_default=True, help="Write the time and memory used by "
+                                      "every stage and gene family next to "
+                                      "the output file")
+@click.option('--state-dir', required=False,
+              type=click.Path(resolve_path=True, readable=True, exists=False,
+                              file_okay=False),
+              help="Directory keeping the state of the previous runs, only "
+                   "the target proteomes and gene families that changed "
+                   "since are searched and aligned")
 def distance_method_main(query_proteome_fp,
                          target_proteomes_dir,
                          working_dir,
@@ -1154,7 +5723,30 @@ def distance_method_main(query_proteome_fp,
                          verbose,
                          debug,
                          warnings,
-                         timeout):
+                         timeout,
+                         timeout_scale,
+                         fast_retry,
+                         aligner,
+                         distance_mode,
+                         kmer_size,
+                         online_outliers,
+                         online_warmup,
+                         online_refresh_interval,
+                         deduplicate,
+                         outlier_statistics,
+                         jobs,
+                         distance_engine,
+                         distance_model,
+                         outlier_chunk_size,
+                         pooled_database,
+                         database_dir,
+                         distance_dtype,
+                         resume,
+                         checkpoint_interval,
+                         cache_dir,
+                         cache_max_size,
+                         report,
+                         state_dir):
     """ Run the Distance-Method HGT detection algorithm.
     """
     distance_method(query_proteome_fp=query_proteome_fp,
@@ -1174,7 +5766,30 @@ def distance_method_main(query_proteome_fp,
                     verbose=verbose,
                     debug=debug,
                     warnings=warnings,
-                    timeout=timeout)
+                    timeout=timeout,
+                    jobs=jobs,
+                    distance_engine=distance_engine,
+                    distance_model=distance_model,
+                    outlier_chunk_size=outlier_chunk_size,
+                    pooled_database=pooled_database,
+                    database_dir=database_dir,
+                    distance_dtype=distance_dtype,
+                    resume=resume,
+                    checkpoint_interval=checkpoint_interval,
+                    cache_dir=cache_dir,
+                    cache_max_size=cache_max_size,
+                    report=report,
+                    state_dir=state_dir,
+                    timeout_scale=timeout_scale,
+                    fast_retry=fast_retry,
+                    aligner=aligner,
+                    distance_mode=distance_mode,
+                    kmer_size=kmer_size,
+                    online_outliers=online_outliers,
+                    online_warmup=online_warmup,
+                    online_refresh_interval=online_refresh_interval,
+                    deduplicate=deduplicate,
+                    outlier_statistics=outlier_statistics)
 
 
 if __name__ == "__main__":
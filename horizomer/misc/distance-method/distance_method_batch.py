@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+# ----------------------------------------------------------------------------
+# Copyright (c) 2015--, The WGS-HGT Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+
+#
+# Run the Distance Method (distance_method.py) for several query genomes
+# against the same reference proteomes
+#
+
+import click
+
+from distance_method import distance_method_batch, distance_method_main
+
+
+# the options of a single query run apply to every query genome
+BATCH_PARAMS = [
+    click.Argument(['query-proteome-fps'], required=True, nargs=-1,
+                   type=click.Path(resolve_path=True, readable=True,
+                                   exists=True, file_okay=True)),
+    click.Option(['--target-proteomes-dir'], required=True,
+                 type=click.Path(resolve_path=True, readable=True,
+                                 exists=True, file_okay=False),
+                 help="Directory of target proteomes"),
+    click.Option(['--working-dir'], required=True,
+                 type=click.Path(resolve_path=True, readable=True,
+                                 exists=False, file_okay=False),
+                 help="Working directory"),
+    click.Option(['--output-dir'], required=True,
+                 type=click.Path(resolve_path=True, readable=True,
+                                 exists=False, file_okay=False),
+                 help="Directory where the HGTs of every query genome are "
+                      "written to <query proteome file name>.hgt.txt")]
+BATCH_PARAMS.extend(param for param in distance_method_main.params
+                    if isinstance(param, click.Option) and
+                    param.name != 'state_dir')
+
+
+@click.command(params=BATCH_PARAMS)
+def distance_method_batch_main(query_proteome_fps,
+                               target_proteomes_dir,
+                               working_dir,
+                               output_dir,
+                               align_software,
+                               **kwargs):
+    """ Run the Distance-Method HGT detection algorithm for several query
+    genomes, sharing the reference preprocessing, search and worker pool.
+    """
+    distance_method_batch(query_proteome_fps=query_proteome_fps,
+                          target_proteomes_dir=target_proteomes_dir,
+                          working_dir=working_dir,
+                          output_dir=output_dir,
+                          align_software=align_software,
+                          **kwargs)
+
+
+if __name__ == "__main__":
+    distance_method_batch_main()
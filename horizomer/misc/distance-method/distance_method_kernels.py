@@ -0,0 +1,169 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2015--, The WGS-HGT Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+
+#
+# Compiled inner loops of the Distance Method (distance_method.py)
+#
+# The kernels are plain Python loops over NumPy arrays, compiled with Numba
+# when it is installed. Without Numba, distance_method.py runs its vectorized
+# NumPy code instead and the kernels run as Python (see python_kernel()),
+# which the tests use to check that both paths agree.
+#
+
+import numpy
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+NUMBA_AVAILABLE = njit is not None
+
+# constants of the popcount, as uint64 so that Numba does not promote the
+# arithmetic on the species set words to float64
+_M1 = numpy.uint64(0x5555555555555555)
+_M2 = numpy.uint64(0x3333333333333333)
+_M4 = numpy.uint64(0x0f0f0f0f0f0f0f0f)
+_M7 = numpy.uint64(0x7f)
+_S1 = numpy.uint64(1)
+_S2 = numpy.uint64(2)
+_S4 = numpy.uint64(4)
+_S8 = numpy.uint64(8)
+_S16 = numpy.uint64(16)
+_S32 = numpy.uint64(32)
+
+
+def _jit(func):
+    """ Compile func with Numba if it is installed.
+    """
+    if njit is None:
+        return func
+    return njit(cache=True, nogil=True)(func)
+
+
+def python_kernel(kernel):
+    """ Return the Python function of a (possibly compiled) kernel.
+    """
+    return getattr(kernel, 'py_func', kernel)
+
+
+@_jit
+def first_hits(keys):
+    """ Positions of the first occurrence of every distinct key.
+
+    Parameters
+    ----------
+    keys: numpy.ndarray
+        int64 key of every hit (ex. query * num_species + species)
+
+    Returns
+    -------
+    numpy.ndarray
+        sorted positions in keys of the first hit of every key, as
+        numpy.unique(keys, return_index=True)[1] sorted
+    """
+    order = numpy.argsort(keys, kind='mergesort')
+    first = numpy.empty(len(keys), dtype=numpy.int64)
+    num_first = 0
+    for i in range(len(order)):
+        if i == 0 or keys[order[i]] != keys[order[i - 1]]:
+            first[num_first] = order[i]
+            num_first += 1
+    return numpy.sort(first[:num_first])
+
+
+@_jit
+def _popcount(word):
+    """ Number of set bits of a uint64 word.
+    """
+    word = word - ((word >> _S1) & _M1)
+    word = (word & _M2) + ((word >> _S2) & _M2)
+    word = (word + (word >> _S4)) & _M4
+    word = word + (word >> _S8)
+    word = word + (word >> _S16)
+    word = word + (word >> _S32)
+    return numpy.int64(word & _M7)
+
+
+@_jit
+def hamming_distances(words_a, words_b):
+    """ Hamming distances between two sets of packed vectors.
+
+    Parameters
+    ----------
+    words_a: numpy.ndarray
+        uint64 array of shape (m, words), see species_set_words()
+    words_b: numpy.ndarray
+        uint64 array of shape (n, words)
+
+    Returns
+    -------
+    numpy.ndarray
+        int64 array of shape (m, n), without the (m, n, words) temporary of
+        the vectorized XOR
+    """
+    distances = numpy.zeros((words_a.shape[0], words_b.shape[0]),
+                            dtype=numpy.int64)
+    for i in range(words_a.shape[0]):
+        for j in range(words_b.shape[0]):
+            count = numpy.int64(0)
+            for word in range(words_a.shape[1]):
+                count += _popcount(words_a[i, word] ^ words_b[j, word])
+            distances[i, j] = count
+    return distances
+
+
+@_jit
+def _zscore(deviation, stdev):
+    """ deviation / stdev with the nan and inf of NumPy's division by zero.
+    """
+    if stdev != 0:
+        return deviation / stdev
+    if numpy.isnan(deviation) or deviation == 0:
+        return numpy.nan
+    return numpy.inf if deviation > 0 else -numpy.inf
+
+
+@_jit
+def scatter_zscores(distances, species, gene_matrix):
+    """ Z-score normalize a family's distances into its species matrix.
+
+    Parameters
+    ----------
+    distances: numpy.ndarray
+        float64 square matrix of pairwise distances between the family
+        members (nan if unknown)
+    species: numpy.ndarray
+        species index of every member (row of distances)
+    gene_matrix: numpy.ndarray
+        num_species x num_species matrix of the gene, overwritten with the
+        Z-scores of the distances of every member to the other members (nan
+        for the missing species and the diagonal)
+    """
+    gene_matrix[:, :] = numpy.nan
+    num_members = len(species)
+    for i in range(num_members):
+        total = 0.0
+        count = 0
+        for j in range(num_members):
+            if j != i and not numpy.isnan(distances[i, j]):
+                total += distances[i, j]
+                count += 1
+        if count == 0:
+            continue
+        mean = total / count
+        squares = 0.0
+        for j in range(num_members):
+            if j != i and not numpy.isnan(distances[i, j]):
+                squares += (distances[i, j] - mean) ** 2
+        stdev = numpy.sqrt(squares / count)
+        for j in range(num_members):
+            if j != i:
+                gene_matrix[species[i], species[j]] = _zscore(
+                    distances[i, j] - mean, stdev)
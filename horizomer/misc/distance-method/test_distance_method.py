@@ -10,11 +10,13 @@
 
 # dependencies: scikit-bio >= 0.2.3, < 0.3.0
 
-from unittest import TestCase, main
+import sys
+import json
+from unittest import TestCase, main, mock
 from shutil import rmtree
 from tempfile import mkdtemp
-from os import makedirs
-from os.path import join, exists
+from os import makedirs, utime, remove, listdir
+from os.path import join, exists, getsize
 import numpy
 import numpy.testing as npt
 import pandas as pd
@@ -23,14 +25,58 @@ from skbio.util import remove_files
 import skbio.io
 
 from horizomer.distance_method import (
+    encode_species_set,
+    decode_species_set,
+    hamming_distances,
+    HammingIndex,
+    kernels,
+    species_set_words,
+    species_set_counts,
+    GeneTable,
+    phylip_name,
+    phylip_position,
     preprocess_data,
     parse_blast,
     normalize_distances,
+    normalize_distance_matrix,
+    parse_phylip_distances,
     cluster_distances,
+    gene_cluster_index,
     detect_outlier_genes,
+    detect_hgt_genes,
+    species_pair_statistics,
+    SpeciesPairAccumulator,
+    OnlineOutlierDetector,
     launch_blast,
     launch_diamond,
-    distance_method)
+    hash_reference_proteomes,
+    prepare_family_scratch,
+    estimate_family_costs,
+    deduplicate_families,
+    family_timeouts,
+    FAMILY_COST_UNIT,
+    DistanceCheckpoint,
+    FamilyCache,
+    ProcessRunner,
+    JobResult,
+    StageTimer,
+    write_run_report,
+    FAMILY_STATS,
+    parse_phylip_alignment,
+    parse_fasta_alignment,
+    format_phylip_alignment,
+    select_aligner,
+    AUTO_ALIGNER_MAX_MEMBERS,
+    compute_native_distances,
+    compute_kmer_distances,
+    identity_distances,
+    compute_hit_distances,
+    PairIdentities,
+    parse_pair_identities,
+    read_query_genes,
+    distance_method,
+    distance_method_batch,
+    update_distance_method)
 
 
 class DistanceMethodTests(TestCase):
@@ -74,13 +120,19 @@ class DistanceMethodTests(TestCase):
         with open(self.phylip_fp, 'w') as tmp:
             tmp.write(phylip_output)
 
+        # interleaved PHYLIP alignment output by Clustalw
+        self.phylip_alignment_fp = join(self.working_dir, "msa.phy")
+        with open(self.phylip_alignment_fp, 'w') as tmp:
+            tmp.write(phylip_alignment)
+
         # list of files to remove
         self.files_to_remove = [self.species_1_fp,
                                 self.species_2_fp,
                                 self.species_3_fp,
                                 self.species_4_fp,
                                 self.blast_fp,
-                                self.phylip_fp]
+                                self.phylip_fp,
+                                self.phylip_alignment_fp]
 
     def tearDown(self):
         remove_files(self.files_to_remove)
@@ -171,7 +223,14 @@ class DistanceMethodTests(TestCase):
         for seq in skbio.io.read(self.species_4_fp, format='fasta'):
             ref_db_exp[seq.metadata['id']] = seq
         num_species_exp = 4
-        self.assertDictEqual(gene_map, gene_map_exp)
+        self.assertDictEqual(gene_map.as_dict(), gene_map_exp)
+        self.assertEqual(gene_map.num_species, 4)
+        npt.assert_array_equal(
+            gene_map.ids(['G2_SE003', 'G5_SE001', 'unknown']), [11, 4, -1])
+        npt.assert_array_equal(gene_map.species[[11, 4]], [2, 0])
+        npt.assert_array_equal(gene_map.genes[[11, 4]], [1, 4])
+        self.assertTrue('G2_SE003' in gene_map)
+        self.assertFalse('2_1' in gene_map)
         self.assertDictEqual(ref_db, ref_db_exp)
         self.assertEqual(species, num_species_exp)
 
@@ -188,23 +247,53 @@ class DistanceMethodTests(TestCase):
                                  'G5_SE004'],
                     'G2_SE001': ['G2_SE001', 'G2_SE002', 'G2_SE003',
                                  'G2_SE004']}
-        gene_map = {'G1_SE001': '0_0', 'G1_SE002': '1_0', 'G1_SE003': '2_0',
-                    'G1_SE004': '3_0', '0_0': 'G1_SE001', '1_0': 'G1_SE002',
-                    '2_0': 'G1_SE003', '3_0': 'G1_SE004', 'G2_SE001': '0_1',
-                    'G2_SE002': '1_1', 'G2_SE003': '2_1', 'G2_SE004': '3_1',
-                    '0_1': 'G2_SE001', '1_1': 'G2_SE002', '2_1': 'G2_SE003',
-                    '3_1': 'G2_SE004', 'G3_SE001': '0_2', 'G3_SE002': '1_2',
-                    'G3_SE003': '2_2', 'G3_SE004': '3_2', '0_2': 'G3_SE001',
-                    '1_2': 'G3_SE002', '2_2': 'G3_SE003', '3_2': 'G3_SE004',
-                    'G4_SE001': '0_3', 'G4_SE002': '1_3', 'G4_SE003': '2_3',
-                    'G4_SE004': '3_3', '0_3': 'G4_SE001', '1_3': 'G4_SE002',
-                    '2_3': 'G4_SE003', '3_3': 'G4_SE004', 'G5_SE001': '0_4',
-                    'G5_SE002': '1_4', 'G5_SE003': '2_4', 'G5_SE004': '3_4',
-                    '0_4': 'G5_SE001', '1_4': 'G5_SE002', '2_4': 'G5_SE003',
-                    '3_4': 'G5_SE004'}
-        hits = {}
-        parse_blast(self.blast_fp, hits, gene_map)
-        self.assertDictEqual(hits, hits_exp)
+        gene_map = GeneTable(
+            labels=['G%s_SE00%s' % (gene, species)
+                    for species in range(1, 5) for gene in range(1, 6)],
+            species=numpy.repeat(numpy.arange(4), 5),
+            genes=numpy.tile(numpy.arange(5), 4))
+        hits = parse_blast(self.blast_fp, gene_map)
+        self.assertDictEqual(hits.as_dict(), hits_exp)
+        self.assertEqual(len(hits), 5)
+        self.assertTrue('G3_SE001' in hits)
+        self.assertFalse('G3_SE002' in hits)
+        npt.assert_array_equal(
+            hits.num_homologs(exclude_query=True), [3, 3, 3, 3, 3])
+        # chunked reading yields the same table
+        hits = parse_blast([self.blast_fp], gene_map, chunksize=2)
+        self.assertDictEqual(hits.as_dict(), hits_exp)
+        # selecting rows keeps the table consistent
+        selected = hits.select([1, 3])
+        self.assertListEqual(list(selected), [list(hits)[1], list(hits)[3]])
+        self.assertListEqual(selected[list(hits)[3]],
+                             hits_exp[list(hits)[3]])
+        # percent identities of the first hit of every (query, species)
+        hits = parse_blast([self.blast_fp], gene_map, chunksize=2,
+                           identities=True)
+        npt.assert_array_equal(hits.query_identities('G1_SE001'),
+                               [100.0, 58.11, 66.74, 65.25])
+        selected = hits.select([list(hits).index('G4_SE001')])
+        npt.assert_array_equal(selected.query_identities('G4_SE001'),
+                               [100.0, 48.29, 57.40, 55.23])
+        self.assertRaises(ValueError, parse_blast(
+            self.blast_fp, gene_map).query_identities, 'G1_SE001')
+
+    def test_gene_table(self):
+        """ Test functionality of GeneTable and of the PHYLIP member names
+        """
+        gene_map = GeneTable(labels=['a', 'b', 'c'], species=[0, 0, 10000],
+                             genes=[0, 1, 123456])
+        self.assertEqual(len(gene_map), 3)
+        self.assertEqual(gene_map.num_species, 10001)
+        self.assertEqual(gene_map.pseudo_name(2), '10000_123456')
+        self.assertDictEqual(gene_map.as_dict(),
+                             {'a': '0_0', 'b': '0_1', 'c': '10000_123456',
+                              '0_0': 'a', '0_1': 'b', '10000_123456': 'c'})
+        self.assertRaises(ValueError, GeneTable, ['a', 'a'], [0, 1], [0, 0])
+        # member names fit PHYLIP's 10 characters whatever the panel size
+        self.assertEqual(phylip_name(0), 'm0')
+        self.assertEqual(phylip_position(phylip_name(123456789)), 123456789)
+        self.assertLessEqual(len(phylip_name(999999999)), 10)
 
     def test_normalize_distances(self):
         """ Test functionality of normalize_distances()
@@ -230,9 +319,9 @@ class DistanceMethodTests(TestCase):
         num_species = 4
         i = 0
         species_set_dict = {}
-        species_set_dict_exp = {'IIII': 1}
+        species_set_dict_exp = {encode_species_set('IIII'): 1}
         gene_bitvector_map = {}
-        gene_bitvector_map_exp = {0: 'IIII'}
+        gene_bitvector_map_exp = {0: encode_species_set('IIII')}
         full_distance_matrix = numpy.zeros(
             shape=(1, num_species, num_species), dtype=float)
         full_distance_matrix_exp = numpy.array(
@@ -250,15 +339,247 @@ class DistanceMethodTests(TestCase):
                                           full_distance_matrix_exp[0][0])
         self.assertDictEqual(species_set_dict, species_set_dict_exp)
         self.assertDictEqual(gene_bitvector_map, gene_bitvector_map_exp)
+        # protdist output of compute_family_distances() names the members by
+        # their position in the family, their species are given
+        positions_fp = join(self.working_dir, "positions.txt")
+        with open(positions_fp, 'w') as positions_f:
+            positions_f.write(phylip_output.replace('2_1', 'm1  ').replace(
+                '3_1', 'm3  ').replace('0_1', 'm0  ').replace('1_1', 'm2  '))
+        self.assertRaises(ValueError, normalize_distances, positions_fp,
+                          full_distance_matrix, num_species, i, {}, {})
+        species_set_dict = {}
+        gene_bitvector_map = {}
+        full_distance_matrix[:] = 0
+        normalize_distances(phylip_fp=positions_fp,
+                            full_distance_matrix=full_distance_matrix,
+                            num_species=num_species,
+                            full_distance_matrix_offset=i,
+                            species_set_dict=species_set_dict,
+                            gene_bitvector_map=gene_bitvector_map,
+                            species=[0, 2, 1, 3])
+        numpy.testing.assert_almost_equal(full_distance_matrix,
+                                          full_distance_matrix_exp)
+        self.assertDictEqual(species_set_dict, species_set_dict_exp)
+        self.assertDictEqual(gene_bitvector_map, gene_bitvector_map_exp)
+
+    def test_parse_phylip_distances(self):
+        """ Test functionality of parse_phylip_distances()
+        """
+        labels, distances = parse_phylip_distances(self.phylip_fp)
+        self.assertListEqual(labels, ['2_1', '3_1', '0_1', '1_1'])
+        self.assertEqual(distances.shape, (4, 4))
+        self.assertAlmostEqual(distances[2, 3], 0.722046)
+        # rows wrapped onto continuation lines
+        wrapped_fp = join(self.working_dir, "wrapped.dis")
+        with open(wrapped_fp, 'w') as wrapped_f:
+            wrapped_f.write("    2\n0_1         0.000000\n  0.100000\n"
+                            "1_1         0.100000\n  0.000000\n")
+        labels, distances = parse_phylip_distances(wrapped_fp)
+        self.assertListEqual(labels, ['0_1', '1_1'])
+        npt.assert_array_equal(distances, [[0.0, 0.1], [0.1, 0.0]])
+        with open(wrapped_fp, 'w') as wrapped_f:
+            wrapped_f.write("    2\n0_1         0.000000\n")
+        self.assertRaises(ValueError, parse_phylip_distances, wrapped_fp)
+
+    def test_normalize_distance_matrix(self):
+        """ Test normalize_distance_matrix() orders rows by species number
+        """
+        num_species = 12
+        labels = ['11_0', '2_3', '0_1', '10_2']
+        distances = numpy.array([[0.0, 0.1, 0.2, 0.6],
+                                 [0.1, 0.0, 0.3, 0.4],
+                                 [0.2, 0.3, 0.0, 0.5],
+                                 [0.6, 0.4, 0.5, 0.0]])
+        full_distance_matrix = numpy.zeros(
+            shape=(2, num_species, num_species))
+        species_set_dict = {}
+        gene_bitvector_map = {}
+        normalize_distance_matrix(labels=labels,
+                                  distances=distances,
+                                  full_distance_matrix=full_distance_matrix,
+                                  num_species=num_species,
+                                  full_distance_matrix_offset=1,
+                                  species_set_dict=species_set_dict,
+                                  gene_bitvector_map=gene_bitvector_map)
+        present_exp = 'IOIOOOOOOOII'
+        self.assertDictEqual(species_set_dict,
+                             {encode_species_set(present_exp): 1})
+        self.assertDictEqual(gene_bitvector_map,
+                             {1: encode_species_set(present_exp)})
+        # the input is left untouched and other genes are not written
+        self.assertEqual(distances[0, 0], 0.0)
+        npt.assert_array_equal(full_distance_matrix[0], 0)
+        species = [11, 2, 0, 10]
+        for a, species_a in enumerate(species):
+            row = numpy.delete(distances[a], a)
+            zscores = (row - row.mean()) / row.std()
+            npt.assert_almost_equal(
+                full_distance_matrix[1, species_a, numpy.delete(species, a)],
+                zscores)
+            self.assertTrue(numpy.isnan(
+                full_distance_matrix[1, species_a, species_a]))
+        for missing in (1, 3, 9):
+            self.assertTrue(
+                numpy.isnan(full_distance_matrix[1, missing]).all())
+            self.assertTrue(
+                numpy.isnan(full_distance_matrix[1, :, missing]).all())
+
+    def test_parse_phylip_alignment(self):
+        """ Test functionality of parse_phylip_alignment()
+        """
+        labels, sequences = parse_phylip_alignment(self.phylip_alignment_fp)
+        self.assertListEqual(labels, ['0_1', '1_1', '2_1'])
+        self.assertListEqual(sequences, ['ACDEFGHIKLMN', 'ACDEFGHIKVMN',
+                                         'AC-EFGHMKVMY'])
+
+    def test_compute_kmer_distances(self):
+        """ Test functionality of compute_kmer_distances()
+        """
+        sequences = ['MKVLAAGIVLLL', 'MKVLAAGIVLLL', 'MKVLSAGIVLLL',
+                     'WWWWWW', 'MK', 'mkvlxagivlll']
+        distances = compute_kmer_distances(sequences, kmer_size=4)
+        npt.assert_array_equal(numpy.diag(distances), 0)
+        npt.assert_array_equal(distances, distances.T)
+        self.assertEqual(distances[0, 1], 0)
+        # 9 k-mers each, 5 shared: J = 5 / 13
+        jaccard = 5 / 13
+        self.assertAlmostEqual(distances[0, 2],
+                               -numpy.log(2 * jaccard / (1 + jaccard)) / 4)
+        # the k-mers with an ambiguous residue are ignored, the residues
+        # are not case sensitive
+        jaccard = 5 / 9
+        self.assertAlmostEqual(distances[0, 5],
+                               -numpy.log(2 * jaccard / (1 + jaccard)) / 4)
+        # no shared k-mer (or no k-mer at all)
+        self.assertTrue(numpy.isnan(distances[0, 3]))
+        self.assertTrue(numpy.isnan(distances[4, 0]))
+        # independent of the number of k-mers counted at once
+        npt.assert_array_equal(
+            compute_kmer_distances(sequences, kmer_size=4, block_size=2),
+            distances)
+        self.assertRaises(ValueError, compute_kmer_distances, sequences, 15)
+
+    def test_compute_hit_distances(self):
+        """ Test compute_hit_distances() and parse_pair_identities()
+        """
+        npt.assert_allclose(identity_distances([100.0, 50.0, 0.0, 120.0]),
+                            [0.0, numpy.log(2), numpy.nan, 0.0])
+        gene_map = GeneTable(
+            labels=['G%s_SE00%s' % (gene, species)
+                    for species in range(1, 5) for gene in range(1, 6)],
+            species=numpy.repeat(numpy.arange(4), 5),
+            genes=numpy.tile(numpy.arange(5), 4))
+        hits = parse_blast(self.blast_fp, gene_map, identities=True)
+        # only the alignments of the query gene
+        distances = compute_hit_distances('G1_SE001', hits, gene_map)
+        npt.assert_allclose(distances[0], identity_distances(
+            [100.0, 58.11, 66.74, 65.25]))
+        npt.assert_array_equal(distances, distances.T)
+        npt.assert_array_equal(numpy.diag(distances), 0)
+        self.assertTrue(numpy.isnan(distances[1, 2]))
+        # and of the pairs of members, in either direction
+        alignments_fp = join(self.working_dir, 'pairs.m8')
+        with open(alignments_fp, 'w') as alignments_f:
+            alignments_f.write('G1_SE003\tG1_SE002\t80.0\n'
+                               'G1_SE002\tG1_SE003\t70.0\n'
+                               'G1_SE002\tG1_SE002\t100.0\n'
+                               'G1_SE004\tunknown\t90.0\n')
+        pair_identities = parse_pair_identities([alignments_fp], gene_map)
+        self.assertEqual(len(pair_identities), 1)
+        npt.assert_array_equal(pair_identities.get([5, 10, 5], [10, 5, 15]),
+                               [80.0, 80.0, numpy.nan])
+        self.assertEqual(len(PairIdentities(numpy.zeros(0, dtype=int),
+                                            numpy.zeros(0), 20)), 0)
+        distances = compute_hit_distances('G1_SE001', hits, gene_map,
+                                          pair_identities)
+        self.assertAlmostEqual(distances[1, 2], -numpy.log(0.8))
+        self.assertAlmostEqual(distances[2, 1], -numpy.log(0.8))
+        self.assertTrue(numpy.isnan(distances[1, 3]))
+
+    def test_parse_fasta_alignment(self):
+        """ Test parse_fasta_alignment() and format_phylip_alignment()
+        """
+        labels, sequences = parse_fasta_alignment(
+            ">m1 description\nmk-la\nvv\n>m0\nMKILAV-\n")
+        self.assertListEqual(labels, ['m1', 'm0'])
+        self.assertListEqual(sequences, ['mk-lavv', 'MKILAV-'])
+        alignment = format_phylip_alignment(labels, sequences)
+        self.assertEqual(alignment,
+                         " 2 7\nm1        MK-LAVV\nm0        MKILAV-\n")
+        phy_msa_fp = join(self.working_dir, "msa.phy")
+        with open(phy_msa_fp, 'w') as phy_msa_f:
+            phy_msa_f.write(alignment)
+        self.assertEqual(parse_phylip_alignment(phy_msa_fp),
+                         (labels, ['MK-LAVV', 'MKILAV-']))
+        # the native distances do not depend on the round trip
+        for act, exp in zip(
+                compute_native_distances(None, model='p-distance',
+                                         alignment=(labels, sequences)),
+                compute_native_distances(phy_msa_fp, model='p-distance')):
+            npt.assert_array_equal(act, exp)
+        self.assertRaises(ValueError, parse_fasta_alignment,
+                          ">m0\nMKL\n>m1\nMK\n")
+        self.assertRaises(ValueError, parse_fasta_alignment, "MKL\n")
+
+    def test_select_aligner(self):
+        """ Test functionality of select_aligner()
+        """
+        installed = ('clustalw', 'mafft', 'kalign', 'muscle')
+        self.assertEqual(select_aligner(4, installed), 'mafft')
+        self.assertEqual(
+            select_aligner(AUTO_ALIGNER_MAX_MEMBERS + 1, installed),
+            'kalign')
+        self.assertEqual(select_aligner(4, ('clustalw', 'kalign')), 'kalign')
+        self.assertEqual(select_aligner(400, ('clustalw', 'muscle')),
+                         'muscle')
+        self.assertEqual(select_aligner(400, ('clustalw',)), 'clustalw')
+        self.assertRaises(ValueError, select_aligner, 4, ())
+
+    def test_compute_native_distances(self):
+        """ Test functionality of compute_native_distances()
+
+        Mismatches / compared sites (the gap is ignored):
+            0_1   1_1   2_1
+        0_1 0     1/12  3/11
+        1_1 1/12  0     2/11
+        2_1 3/11  2/11  0
+        """
+        p_exp = numpy.array([[0, 1/12, 3/11],
+                             [1/12, 0, 2/11],
+                             [3/11, 2/11, 0]])
+        labels, p = compute_native_distances(self.phylip_alignment_fp,
+                                             model='p-distance')
+        self.assertListEqual(labels, ['0_1', '1_1', '2_1'])
+        npt.assert_almost_equal(p, p_exp)
+        _, poisson = compute_native_distances(self.phylip_alignment_fp,
+                                              model='poisson')
+        npt.assert_almost_equal(poisson, -numpy.log(1 - p_exp))
+        _, kimura = compute_native_distances(self.phylip_alignment_fp,
+                                             model='kimura')
+        npt.assert_almost_equal(
+            kimura, -numpy.log(1 - p_exp - 0.2 * p_exp ** 2))
+        _, jtt = compute_native_distances(self.phylip_alignment_fp,
+                                          model='jtt')
+        npt.assert_almost_equal(jtt, jtt.T)
+        npt.assert_almost_equal(numpy.diag(jtt), numpy.zeros(3))
+        self.assertTrue(0 < jtt[0, 1] < jtt[1, 2] < jtt[0, 2])
+        self.assertRaises(ValueError, compute_native_distances,
+                          self.phylip_alignment_fp, 'blosum')
 
     def test_cluster_distances(self):
         """ Test functionality of cluster_distances()
         """
         species_set_dict = {'IIIIIIII': 100, 'IIOOOIII': 50, 'IIIIIII0': 10,
                             'OIOIIIII': 5, 'IIIOOIII': 8, 'OOOOOIOO': 12}
+        species_set_dict = {encode_species_set(bv): count
+                            for bv, count in species_set_dict.items()}
         gene_clusters_list_exp = [('IIIIIIII', ['IIIIIIII', 'IIIIIII0',
                                                 'IIIOOIII', 'OIOIIIII']),
                                   ('IIOOOIII', ['IIOOOIII', 'OOOOOIOO'])]
+        gene_clusters_list_exp = [
+            (encode_species_set(core), [encode_species_set(bv)
+                                        for bv in species_sets])
+            for core, species_sets in gene_clusters_list_exp]
         gene_clusters_list_act = cluster_distances(
             species_set_dict=species_set_dict, species_set_size=30,
             hamming_distance=2)
@@ -268,13 +589,154 @@ class DistanceMethodTests(TestCase):
             self.assertTrue(core_cluster_exp in gene_clusters_list_act)
         for core_cluster_act in gene_clusters_list_act:
             self.assertTrue(core_cluster_act in gene_clusters_list_exp)
+        # cluster of every gene
+        genes = species_set_words([encode_species_set(bv) for bv in (
+            'OOOOOIOO', 'IIIIIIII', 'IIIOOIII', 'IOIOIOIO', 'IIOOOIII')])
+        clusters = gene_cluster_index(genes, gene_clusters_list_act)
+        core = [core for core, _ in gene_clusters_list_act].index(
+            encode_species_set('IIIIIIII'))
+        npt.assert_array_equal(clusters, [1 - core, core, core, -1,
+                                          1 - core])
+
+    def test_encode_species_set(self):
+        """ Test functionality of encode_species_set()
+        """
+        species_set = encode_species_set('IIOI')
+        self.assertEqual(len(species_set), 8)
+        self.assertEqual(species_set, encode_species_set(
+            [True, True, False, True]))
+        self.assertEqual(decode_species_set(species_set, 4), 'IIOI')
+        # 65 species need two 64-bit words
+        species_set = encode_species_set('O' * 64 + 'I')
+        self.assertEqual(len(species_set), 16)
+        self.assertEqual(decode_species_set(species_set, 65), 'O' * 64 + 'I')
+
+    def test_hamming_distances(self):
+        """ Test functionality of hamming_distances()
+        """
+        words_a = species_set_words([encode_species_set('IIII' * 20),
+                                     encode_species_set('IOIO' * 20)])
+        words_b = species_set_words([encode_species_set('IIII' * 20),
+                                     encode_species_set('OIII' * 20),
+                                     encode_species_set('OOOO' * 20)])
+        npt.assert_equal(hamming_distances(words_a, words_b),
+                         [[0, 20, 80], [40, 60, 40]])
+
+    def test_hamming_index(self):
+        """ Test functionality of HammingIndex
+        """
+        rng = numpy.random.RandomState(0)
+        ancestors = rng.rand(5, 150) < 0.5
+        species_sets = ancestors[rng.randint(5, size=300)] ^ (
+            rng.rand(300, 150) < 0.03)
+        words = species_set_words([encode_species_set(
+            ''.join('I' if bit else 'O' for bit in species_set))
+            for species_set in species_sets])
+        cores, queries = words[:20], words[20:]
+        distances = hamming_distances(cores, queries)
+        # a radius of 0 and radii with more blocks than bytes
+        for radius in (0, 3, 8, 30):
+            index = HammingIndex(cores, radius)
+            query_idx, core_idx, distances_act = index.within(queries)
+            npt.assert_array_equal(
+                numpy.column_stack((core_idx, query_idx)),
+                numpy.argwhere(distances.T <= radius)[:, ::-1])
+            npt.assert_array_equal(distances_act,
+                                   distances[core_idx, query_idx])
+            is_within = distances <= radius
+            npt.assert_array_equal(
+                index.first_within(queries),
+                numpy.where(is_within.any(axis=0), is_within.argmax(axis=0),
+                            -1))
+        nearest, nearest_distances = index.nearest(queries, chunk_size=7)
+        npt.assert_array_equal(nearest, distances.argmin(axis=0))
+        npt.assert_array_equal(nearest_distances, distances.min(axis=0))
+        # lowest index on ties
+        index = HammingIndex(species_set_words([
+            encode_species_set('IIOO'), encode_species_set('OOII'),
+            encode_species_set('IIOO')]), 1)
+        query = species_set_words([encode_species_set('IOIO')])
+        npt.assert_array_equal(index.first_within(query), [-1])
+        npt.assert_array_equal(index.nearest(query)[0], [0])
+        query = species_set_words([encode_species_set('IIIO')])
+        npt.assert_array_equal(index.within(query)[1], [0, 2])
+
+    def test_kernels(self):
+        """ Test that the kernels agree with the vectorized NumPy code
+        """
+        rng = numpy.random.RandomState(0)
+        kernel_paths = [kernels.python_kernel]
+        if kernels.NUMBA_AVAILABLE:
+            kernel_paths.append(lambda kernel: kernel)
+        keys = rng.randint(50, size=500)
+        words_a = rng.randint(2 ** 62, size=(7, 3)).astype(numpy.uint64)
+        words_b = rng.randint(2 ** 62, size=(11, 3)).astype(numpy.uint64)
+        words_b[0] = words_a[0]
+        distances = rng.rand(6, 6)
+        distances = distances + distances.T
+        distances[1, 4] = distances[4, 1] = numpy.nan
+        # a member without distances and a member with constant distances
+        distances[2, :] = distances[:, 2] = numpy.nan
+        distances[5, :] = distances[:, 5] = 0.5
+        species = numpy.array([7, 0, 3, 5, 1, 6])
+        with mock.patch('horizomer.distance_method.JIT_KERNELS', False):
+            expected_hamming = hamming_distances(words_a, words_b)
+            expected_matrix = numpy.zeros(shape=(1, 8, 8))
+            normalize_distance_matrix(
+                labels=None, distances=distances,
+                full_distance_matrix=expected_matrix, num_species=8,
+                full_distance_matrix_offset=0, species_set_dict={},
+                gene_bitvector_map={}, species=species)
+        for kernel in kernel_paths:
+            _, expected = numpy.unique(keys, return_index=True)
+            npt.assert_array_equal(kernel(kernels.first_hits)(keys),
+                                   numpy.sort(expected))
+            npt.assert_array_equal(
+                kernel(kernels.hamming_distances)(words_a, words_b),
+                expected_hamming)
+            gene_matrix = numpy.zeros(shape=(8, 8))
+            kernel(kernels.scatter_zscores)(distances, species, gene_matrix)
+            npt.assert_allclose(gene_matrix, expected_matrix[0], rtol=1e-12)
+        # the functions give the same results through the kernels
+        with mock.patch('horizomer.distance_method.JIT_KERNELS', True):
+            npt.assert_array_equal(hamming_distances(words_a, words_b),
+                                   expected_hamming)
+            full_distance_matrix = numpy.zeros(shape=(1, 8, 8))
+            normalize_distance_matrix(
+                labels=None, distances=distances,
+                full_distance_matrix=full_distance_matrix, num_species=8,
+                full_distance_matrix_offset=0, species_set_dict={},
+                gene_bitvector_map={}, species=species)
+            npt.assert_allclose(full_distance_matrix, expected_matrix,
+                                rtol=1e-12)
+            gene_map = GeneTable(
+                labels=['G%s_SE00%s' % (gene, species)
+                        for species in range(1, 5) for gene in range(1, 6)],
+                species=numpy.repeat(numpy.arange(4), 5),
+                genes=numpy.tile(numpy.arange(5), 4))
+            hits = parse_blast(self.blast_fp, gene_map, identities=True)
+        with mock.patch('horizomer.distance_method.JIT_KERNELS', False):
+            hits_exp = parse_blast(self.blast_fp, gene_map, identities=True)
+        self.assertDictEqual(hits.as_dict(), hits_exp.as_dict())
+        npt.assert_array_equal(hits.identities, hits_exp.identities)
+
+    def test_species_set_counts(self):
+        """ Test functionality of species_set_counts()
+        """
+        species_sets = [encode_species_set(s) for s in (
+            'OIII', 'IIII', 'OIII', 'IIOI', 'IIII', 'OIII')]
+        self.assertListEqual(
+            list(species_set_counts(species_set_words(species_sets)).items()),
+            [(species_sets[0], 3), (species_sets[1], 2),
+             (species_sets[3], 1)])
+        self.assertDictEqual(species_set_counts(species_set_words([])), {})
 
     def test_detect_outlier_genes(self):
         """ Test functionality of detect_outlier_genes()
         """
-        species_set = ['IIII']
-        gene_bitvector_map = {0: 'IIII', 1: 'IIII', 2: 'IIII',
-                              3: 'IIII', 4: 'IIII'}
+        species_set = [encode_species_set('IIII')]
+        gene_bitvector_map = {gene: encode_species_set('IIII')
+                              for gene in range(5)}
         full_distance_matrix = numpy.array(
             [[[numpy.nan, 1.20467207, 0.03920422, -1.24387629],
               [0.70710678, numpy.nan, -1.41421356, 0.70710678],
@@ -306,6 +768,483 @@ class DistanceMethodTests(TestCase):
             num_species=4,
             total_genes=5)
         self.assertSetEqual(outlier_genes, outlier_genes_exp)
+        # chunks along the gene axis give the same outliers
+        outlier_genes = detect_outlier_genes(
+            species_set=species_set,
+            gene_bitvector_map=gene_bitvector_map,
+            full_distance_matrix=full_distance_matrix,
+            stdev_offset=1.5,
+            outlier_hgt=0.5,
+            num_species=4,
+            total_genes=5,
+            chunk_size=2)
+        self.assertSetEqual(outlier_genes, outlier_genes_exp)
+        # only the given genes are tested, with the shared statistics
+        statistics = species_pair_statistics(full_distance_matrix, 5,
+                                             decimals=5)
+        for genes, outlier_genes_exp in (([0, 3], {0}), ([1, 2, 4], set())):
+            outlier_genes = detect_outlier_genes(
+                species_set=species_set,
+                gene_bitvector_map=gene_bitvector_map,
+                full_distance_matrix=full_distance_matrix,
+                stdev_offset=1.5,
+                outlier_hgt=0.5,
+                num_species=4,
+                total_genes=5,
+                chunk_size=2,
+                statistics=statistics,
+                genes=numpy.array(genes))
+            self.assertSetEqual(outlier_genes, outlier_genes_exp)
+
+    def test_species_pair_statistics(self):
+        """ Test functionality of species_pair_statistics()
+        """
+        full_distance_matrix = numpy.array(
+            [[[numpy.nan, 1.0], [0.5, numpy.nan]],
+             [[numpy.nan, 2.0], [numpy.nan, numpy.nan]],
+             [[numpy.nan, 4.5], [-0.5, numpy.nan]]])
+        for chunk_size in (1, 2, 3):
+            mean, stdev = species_pair_statistics(full_distance_matrix,
+                                                  chunk_size)
+            npt.assert_almost_equal(
+                mean, [[numpy.nan, 2.5], [0.0, numpy.nan]])
+            npt.assert_almost_equal(
+                stdev, [[numpy.nan, numpy.std([1.0, 2.0, 4.5])],
+                        [0.5, numpy.nan]])
+        # only the selected species pairs are computed
+        mean, stdev = species_pair_statistics(
+            full_distance_matrix, 2, pairs=numpy.array([[False, False],
+                                                        [True, False]]))
+        npt.assert_almost_equal(mean, [[numpy.nan, numpy.nan],
+                                       [0.0, numpy.nan]])
+        npt.assert_almost_equal(stdev, [[numpy.nan, numpy.nan],
+                                        [0.5, numpy.nan]])
+        # of a subset of the genes, rounded
+        mean, stdev = species_pair_statistics(
+            full_distance_matrix + 0.004, 1, genes=numpy.array([0, 2]),
+            decimals=2)
+        npt.assert_almost_equal(mean, [[numpy.nan, 2.75], [0.0, numpy.nan]])
+        npt.assert_almost_equal(stdev, [[numpy.nan, 1.75],
+                                        [0.5, numpy.nan]])
+
+    def test_online_outlier_detector(self):
+        """ Test SpeciesPairAccumulator and OnlineOutlierDetector
+        """
+        full_distance_matrix = numpy.array(
+            [[[numpy.nan, 1.0], [0.5, numpy.nan]],
+             [[numpy.nan, 2.0], [numpy.nan, numpy.nan]],
+             [[numpy.nan, 4.5], [-0.5, numpy.nan]]])
+        mean_exp, stdev_exp = species_pair_statistics(full_distance_matrix, 3)
+        # gene by gene or in chunks
+        accumulator = SpeciesPairAccumulator(2)
+        for matrix in full_distance_matrix:
+            accumulator.update(matrix)
+        npt.assert_almost_equal(accumulator.statistics(),
+                                (mean_exp, stdev_exp))
+        accumulator = SpeciesPairAccumulator(2)
+        accumulator.update(full_distance_matrix[:2])
+        accumulator.update(full_distance_matrix[2:])
+        npt.assert_almost_equal(accumulator.statistics(),
+                                (mean_exp, stdev_exp))
+        # the genes are tested once the warmup is over
+        queries = ['G1_SE001', 'G2_SE001', 'G3_SE001', 'G4_SE001']
+        checkpoint = DistanceCheckpoint(self.working_dir, queries, 3)
+        matrices = numpy.array([[[0, 1, 1], [1, 0, 1], [1, 1, 0]]] * 3 +
+                               [[[0, 9, 9], [9, 0, 1], [9, 1, 0]]],
+                               dtype=float)
+        output_fp = join(self.working_dir, 'provisional.txt')
+        detector = OnlineOutlierDetector(
+            checkpoint=checkpoint, queries=queries, output_fp=output_fp,
+            num_species=3, stdev_offset=1.0, outlier_hgt=0.5, warmup=4)
+        for i, matrix in enumerate(matrices):
+            checkpoint.store(i, matrix, encode_species_set('III'))
+            self.assertEqual(detector.update(i), i == 3)
+            self.assertListEqual(detector.candidates,
+                                 [] if i < 3 else ['G4_SE001'])
+        status = detector.finalize(['G1_SE001', 'G4_SE001'])
+        self.assertDictEqual(status, {'confirmed': ['G4_SE001'],
+                                      'rejected': [],
+                                      'added': ['G1_SE001']})
+        with open(output_fp) as output_f:
+            lines = output_f.read().splitlines()
+        self.assertListEqual(lines[1:], ['G4_SE001\t4', lines[2],
+                                         'G4_SE001\tconfirmed',
+                                         'G1_SE001\tadded'])
+        self.assertTrue(lines[2].startswith('# Final'))
+        # a resumed run appends its candidates, and keeps those of an
+        # interrupted run
+        checkpoint.commit()
+        for interrupted in (True, False):
+            checkpoint = DistanceCheckpoint(self.working_dir, queries, 3,
+                                            resume=True)
+            detector = OnlineOutlierDetector(
+                checkpoint=checkpoint, queries=queries, output_fp=output_fp,
+                num_species=3, stdev_offset=1.0, outlier_hgt=0.5, warmup=4)
+            self.assertListEqual(detector.candidates, ['G4_SE001'])
+            if interrupted:
+                detector._output_f.close()
+        detector.finalize(['G4_SE001'])
+        with open(output_fp) as output_f:
+            lines = output_f.read().splitlines()
+        self.assertListEqual(lines[5:], [lines[0], 'G4_SE001\t4', lines[7],
+                                         'G4_SE001\tconfirmed'])
+        self.assertTrue(lines[7].startswith('# Final'))
+        # running statistics per provisional core cluster: two species sets
+        # with distances on different scales, and an outlier of the second
+        # one that is not an outlier over all genes
+        rng = numpy.random.RandomState(0)
+        species_sets = ['IIIIII'] * 30 + ['IIIOOO'] * 30
+        queries = ['G%s_SE001' % gene for gene in range(len(species_sets))]
+        makedirs(join(self.working_dir, 'cluster'))
+        checkpoint = DistanceCheckpoint(join(self.working_dir, 'cluster'),
+                                        queries, 6)
+        matrices = numpy.around(rng.randn(len(species_sets), 6, 6), 5)
+        matrices[30:] = numpy.around(0.1 * matrices[30:], 5)
+        matrices[30:, 3:, :] = numpy.nan
+        matrices[30:, :, 3:] = numpy.nan
+        matrices[45, :3, :3] += 1.0
+        for matrix in matrices:
+            numpy.fill_diagonal(matrix, numpy.nan)
+        detectors = {}
+        for outlier_statistics in ('genome', 'cluster'):
+            detectors[outlier_statistics] = OnlineOutlierDetector(
+                checkpoint=checkpoint, queries=queries,
+                output_fp=join(self.working_dir,
+                               '%s.txt' % outlier_statistics),
+                num_species=6, stdev_offset=2.326, outlier_hgt=0.25,
+                warmup=len(queries), outlier_statistics=outlier_statistics,
+                species_set_size=10, hamming_distance=1)
+        for i, (matrix, species_set) in enumerate(zip(matrices,
+                                                      species_sets)):
+            checkpoint.store(i, matrix, encode_species_set(species_set))
+            for detector in detectors.values():
+                detector.update(i)
+        self.assertEqual(len(detectors['cluster'].cluster_accumulators), 2)
+        npt.assert_almost_equal(
+            detectors['cluster'].cluster_accumulators[1].statistics(),
+            species_pair_statistics(matrices, 7, genes=numpy.arange(30, 60),
+                                    decimals=5))
+        hgt_genes = detect_hgt_genes(
+            queries, checkpoint, 6, join(self.working_dir, 'hgt.txt'),
+            stdev_offset=2.326, outlier_hgt=0.25, species_set_size=10,
+            hamming_distance=1, outlier_statistics='cluster')
+        self.assertIn('G45_SE001', hgt_genes)
+        self.assertListEqual(detectors['cluster'].candidates, hgt_genes)
+        self.assertNotIn('G45_SE001', detectors['genome'].candidates)
+        self.assertRaises(ValueError, OnlineOutlierDetector, checkpoint,
+                          queries, output_fp, 6, outlier_statistics='gene')
+        # the outliers over all genes are the same with the running
+        # statistics as with the two-pass statistics of the same matrix
+        rng = numpy.random.RandomState(0)
+        num_genes, num_species = 400, 8
+        full_distance_matrix = numpy.around(
+            rng.randn(num_genes, num_species, num_species), 5)
+        full_distance_matrix[rng.rand(*full_distance_matrix.shape) < 0.05] = (
+            numpy.nan)
+        full_distance_matrix[rng.choice(num_genes, 10), :4, 4:] += 3.0
+        accumulator = SpeciesPairAccumulator(num_species)
+        start = 0
+        while start < num_genes:
+            stop = start + rng.randint(1, 50)
+            accumulator.update(full_distance_matrix[start:stop])
+            start = stop
+        species_set = [encode_species_set('I' * num_species)]
+        gene_bitvector_map = {gene: species_set[0]
+                              for gene in range(num_genes)}
+        outliers = [detect_outlier_genes(
+            species_set=species_set, gene_bitvector_map=gene_bitvector_map,
+            full_distance_matrix=full_distance_matrix, stdev_offset=2.326,
+            outlier_hgt=0.25, num_species=num_species, total_genes=num_genes,
+            chunk_size=64, statistics=statistics)
+            for statistics in (accumulator.statistics(), None)]
+        self.assertGreater(len(outliers[1]), 0)
+        self.assertSetEqual(outliers[0], outliers[1])
+
+    def test_distance_checkpoint(self):
+        """ Test functionality of DistanceCheckpoint
+        """
+        queries = ['G1_SE001', 'G2_SE001', 'G3_SE001']
+        settings = {'distance_engine': 'native'}
+        checkpoint = DistanceCheckpoint(self.working_dir, queries, 4,
+                                        dtype='float32', settings=settings)
+        self.assertEqual(checkpoint.distances.shape, (3, 4, 4))
+        self.assertEqual(checkpoint.distances.dtype, numpy.float32)
+        self.assertEqual(checkpoint.resumed, 0)
+        npt.assert_array_equal(checkpoint.pending(), [0, 1, 2])
+        matrix = numpy.full((4, 4), 0.5)
+        bitvector = encode_species_set('IIOI')
+        checkpoint.store(1, matrix, bitvector)
+        # stored families are only complete once committed
+        npt.assert_array_equal(checkpoint.pending(), [0, 1, 2])
+        checkpoint.commit()
+        npt.assert_array_equal(checkpoint.pending(), [0, 2])
+        del checkpoint
+        # a restarted run resumes from the checkpoint
+        checkpoint = DistanceCheckpoint(self.working_dir, queries, 4,
+                                        dtype='float32', settings=settings,
+                                        resume=True)
+        self.assertEqual(checkpoint.resumed, 1)
+        npt.assert_array_equal(checkpoint.pending(), [0, 2])
+        npt.assert_array_equal(checkpoint.distances[1], matrix)
+        self.assertEqual(checkpoint.species_set(1), bitvector)
+        del checkpoint
+        # other families, settings or resume=False start from scratch
+        for kwargs in [dict(queries=queries[:2], settings=settings,
+                            resume=True),
+                       dict(queries=queries, settings={}, resume=True),
+                       dict(queries=queries, settings=settings)]:
+            checkpoint = DistanceCheckpoint(self.working_dir,
+                                            num_species=4, dtype='float32',
+                                            **kwargs)
+            self.assertEqual(checkpoint.resumed, 0)
+            del checkpoint
+        # families of the same queries with other members start from scratch
+        hits = {query: [query, query.replace('SE001', 'SE002')]
+                for query in queries}
+        checkpoint = DistanceCheckpoint(self.working_dir, queries, 4,
+                                        settings=settings, hits=hits)
+        checkpoint.store(0, matrix, bitvector)
+        checkpoint.commit()
+        del checkpoint
+        checkpoint = DistanceCheckpoint(self.working_dir, queries, 4,
+                                        settings=settings, hits=dict(hits),
+                                        resume=True)
+        self.assertEqual(checkpoint.resumed, 1)
+        del checkpoint
+        hits['G2_SE001'] = ['G2_SE001', 'G2_SE003']
+        checkpoint = DistanceCheckpoint(self.working_dir, queries, 4,
+                                        settings=settings, hits=hits,
+                                        resume=True)
+        self.assertEqual(checkpoint.resumed, 0)
+
+    def test_detect_hgt_genes_timed_out(self):
+        """ Test that detect_hgt_genes() leaves the timed out families out
+            of the clustering
+        """
+        queries = ['G%s_SE001' % gene for gene in range(1, 7)]
+        checkpoint = DistanceCheckpoint(self.working_dir, queries, 4)
+        rng = numpy.random.RandomState(0)
+        for i in range(5):
+            matrix = rng.normal(size=(4, 4))
+            numpy.fill_diagonal(matrix, numpy.nan)
+            checkpoint.store(i, matrix, encode_species_set('IIII'))
+        # a family whose alignment timed out (see compute_family_distances())
+        checkpoint.store(5, numpy.full((4, 4), numpy.nan),
+                         encode_species_set('OOOO'))
+        checkpoint.commit()
+        output_hgt_fp = join(self.working_dir, "hgt_result.txt")
+        with mock.patch('horizomer.distance_method.cluster_distances',
+                        wraps=cluster_distances) as clustering:
+            hgt_genes = detect_hgt_genes(queries, checkpoint, 4,
+                                         output_hgt_fp, species_set_size=2)
+        self.assertDictEqual(clustering.call_args[1]['species_set_dict'],
+                             {encode_species_set('IIII'): 5})
+        self.assertNotIn(queries[5], hgt_genes)
+
+    def test_family_cache(self):
+        """ Test functionality of FamilyCache
+        """
+        cache = FamilyCache(join(self.working_dir, "cache"))
+        members = [('0_0', 'MKVLA'), ('1_0', 'MKILA'), ('2_0', 'MRVLA')]
+        settings = {'distance_engine': 'native', 'distance_model': 'jtt'}
+        key = cache.key(members, settings)
+        # the key depends on the members, their order and the settings
+        self.assertEqual(key, cache.key(list(members), dict(settings)))
+        self.assertNotEqual(key, cache.key(members[::-1], settings))
+        self.assertNotEqual(key, cache.key(
+            members[:2] + [('2_0', 'MRVLV')], settings))
+        self.assertNotEqual(key, cache.key(
+            members, {'distance_engine': 'protdist'}))
+        self.assertIsNone(cache.get(key))
+        distances = numpy.array([[0.0, 0.2, 0.3],
+                                 [0.2, 0.0, 0.4],
+                                 [0.3, 0.4, 0.0]])
+        cache.put(key, ['0_0', '1_0', '2_0'], distances, phylip_alignment)
+        labels, distances_act, alignment = cache.get(key)
+        self.assertListEqual(labels, ['0_0', '1_0', '2_0'])
+        npt.assert_array_equal(distances_act, distances)
+        self.assertEqual(alignment, phylip_alignment)
+        # the least recently used entries are evicted first
+        other_key = cache.key(members[:2], settings)
+        cache.put(other_key, ['0_0', '1_0'], distances[:2, :2], '')
+        utime(cache._entry_fp(key), (1, 1))
+        self.assertEqual(cache.evict(), 0)
+        cache.max_size = getsize(cache._entry_fp(other_key))
+        self.assertEqual(cache.evict(), 1)
+        self.assertIsNone(cache.get(key))
+        self.assertIsNotNone(cache.get(other_key))
+
+    def test_process_runner(self):
+        """ Test functionality of ProcessRunner
+        """
+        runner = ProcessRunner(max_jobs=2, max_output=8, kill_delay=0.2)
+        try:
+            result = runner.run([sys.executable, '-c',
+                                 'import sys; sys.stdout.write("a" * 20); '
+                                 'sys.stderr.write("error"); sys.exit(3)'])
+            self.assertEqual(result.status, 3)
+            self.assertFalse(result.timed_out)
+            # only the last max_output bytes are kept
+            self.assertEqual(result.output, b'a' * 8)
+            self.assertEqual(result.error, b'error')
+            self.assertGreater(result.wall_time, 0)
+            self.assertGreaterEqual(result.cpu_time, 0)
+            self.assertGreater(result.max_rss, 0)
+            # standard input from bytes
+            result = runner.run([sys.executable, '-c',
+                                 'import sys; sys.stdout.write('
+                                 'sys.stdin.read()[-4:])'],
+                                input=b'x' * 100000 + b'done')
+            self.assertEqual(result.output, b'done')
+            # or the whole standard output with keep_output
+            result = runner.run([sys.executable, '-c',
+                                 'import sys; sys.stdout.write("a" * 20)'],
+                                keep_output=True)
+            self.assertEqual(result.output, b'a' * 20)
+            # a command ignoring SIGTERM is killed after kill_delay
+            result = runner.run([sys.executable, '-c',
+                                 'import signal, time; signal.signal('
+                                 'signal.SIGTERM, signal.SIG_IGN); '
+                                 'print("ready", flush=True); '
+                                 'time.sleep(30)'],
+                                timeout=0.5)
+            self.assertTrue(result.timed_out)
+            self.assertEqual(result.status, -9)
+            self.assertLess(result.wall_time, 10)
+            # commands submitted together all run and are recorded
+            futures = [runner.submit([sys.executable, '-c', 'pass'])
+                       for _ in range(3)]
+            self.assertListEqual([f.result().status for f in futures],
+                                 [0, 0, 0])
+            self.assertEqual(len(runner.history), 7)
+            self.assertEqual(runner.history[-1].output, b'')
+            with self.assertRaises(OSError):
+                runner.run([join(self.working_dir, 'missing_command')])
+            # resizing waits for the commands in flight
+            future = runner.submit([sys.executable, '-c',
+                                    'import time; time.sleep(0.5)'])
+            runner.resize(3)
+            self.assertEqual(len(runner.history), 8)
+            self.assertEqual(future.result(timeout=5).status, 0)
+            self.assertEqual(runner.max_jobs, 3)
+            self.assertEqual(runner.run([sys.executable, '-c', 'pass']).status,
+                             0)
+        finally:
+            runner.close()
+
+    def test_write_run_report(self):
+        """ Test functionality of StageTimer and write_run_report()
+        """
+        timer = StageTimer()
+        timer.start('preprocess')
+        timer.start('clustering')
+        timer.stop()
+        timer.stop()
+        self.assertListEqual([stage['stage'] for stage in timer.stages],
+                             ['preprocess', 'clustering'])
+        family_stats = [
+            {'query': 'G1_SE001', 'members': 4, 'residues': 400,
+             'alignment_length': 120, 'cached': False, 'duplicate_of': '',
+             'aligner': 'clustalw-fast', 'timeout_s': 120.0,
+             'timed_out': False, 'msa_s': 1.0, 'distance_s': 0.5,
+             'normalize_s': 0.1, 'external_wall_s': 1.4,
+             'external_cpu_s': 1.2, 'total_s': 1.6},
+            {'query': 'G2_SE001', 'members': 3, 'residues': 240,
+             'alignment_length': 80, 'cached': True, 'duplicate_of': '',
+             'aligner': 'clustalw', 'timeout_s': 120.0, 'timed_out': True,
+             'msa_s': 0.0, 'distance_s': 0.0, 'normalize_s': 0.1,
+             'external_wall_s': 0.0, 'external_cpu_s': 0.0, 'total_s': 0.1},
+            {'query': 'G1_SE002', 'members': 4, 'residues': 400,
+             'alignment_length': 120, 'cached': False,
+             'duplicate_of': 'G1_SE001', 'aligner': 'clustalw-fast',
+             'timeout_s': 120.0, 'timed_out': False, 'msa_s': 0.0,
+             'distance_s': 0.0, 'normalize_s': 0.0, 'external_wall_s': 0.0,
+             'external_cpu_s': 0.0, 'total_s': 0.0}]
+        jobs = [JobResult(['diamond', 'blastp', '--db', 'db'], 0, b'', b'',
+                          2.0, 1.5, 1000, False),
+                JobResult(['/usr/bin/clustalw'], -9, b'', b'', 3.0, 2.5,
+                          3000, True)]
+        output_hgt_fp = join(self.working_dir, "hgt_result.txt")
+        report_fp, families_fp = write_run_report(
+            output_hgt_fp, timer, family_stats, jobs)
+        with open(report_fp, 'r') as report_f:
+            report = json.load(report_f)
+        self.assertEqual(len(report['stages']), 2)
+        self.assertEqual(report['families']['computed'], 2)
+        self.assertEqual(report['families']['cached'], 1)
+        self.assertEqual(report['families']['members'], 7)
+        self.assertEqual(report['families']['residues'], 640)
+        self.assertEqual(report['families']['timed_out'], 1)
+        self.assertEqual(report['families']['fast_aligner'], 1)
+        self.assertAlmostEqual(report['families']['normalize_s'], 0.2)
+        # the duplicate families are reported apart
+        self.assertEqual(report['families']['duplicates'], 1)
+        self.assertEqual(report['families']['duplicate_residues'], 400)
+        self.assertAlmostEqual(report['families']['duplicate_saved_s'], 1.6)
+        self.assertDictEqual(report['commands']['clustalw'],
+                             {'count': 1, 'wall_s': 3.0, 'cpu_s': 2.5,
+                              'max_rss_kb': 3000, 'timed_out': 1})
+        self.assertEqual(report['commands']['diamond blastp']['count'], 1)
+        families = pd.read_csv(families_fp, sep='\t')
+        self.assertListEqual(list(families.columns), list(FAMILY_STATS))
+        self.assertListEqual(list(families['query']),
+                             ['G1_SE001', 'G2_SE001', 'G1_SE002'])
+
+    def test_prepare_family_scratch(self):
+        """ Test functionality of prepare_family_scratch()
+        """
+        scratch_dir = join(self.working_dir, "worker_1")
+        makedirs(scratch_dir)
+        scratch = prepare_family_scratch(scratch_dir)
+        for key in ('phy_msa', 'dnd_msa', 'phylip'):
+            self.assertTrue(exists(scratch[key]))
+        with open(scratch['phylip_command'], 'r') as phylip_command_f:
+            self.assertEqual(phylip_command_f.read(), '%s\nF\n%s\nR\nY\n' % (
+                join(scratch_dir, "msa.phy"), join(scratch_dir, "msa.dis")))
+        with open(scratch['clustal_command'], 'r') as clustal_command_f:
+            clustal_command = clustal_command_f.read()
+        self.assertTrue(clustal_command.startswith(
+            '1\n%s\n' % join(scratch_dir, "input.faa")))
+        # the fast command only toggles the pairwise alignments
+        with open(scratch['clustal_fast_command'], 'r') as clustal_command_f:
+            self.assertEqual(clustal_command_f.read(), clustal_command.replace(
+                '\n\n1\n', '\n\n4\n1\n', 1))
+
+    def test_estimate_family_costs(self):
+        """ Test estimate_family_costs() and family_timeouts()
+        """
+        ref_db = {'0_0': 'M' * 100, '1_0': 'M' * 300, '2_0': 'M' * 200,
+                  '3_0': 'M' * 1000}
+        hits = {'G1': ['0_0', '1_0', '2_0'], 'G2': ['3_0', '3_0'],
+                'G3': []}
+        costs, residues = estimate_family_costs(hits, ref_db)
+        npt.assert_array_equal(residues, [600, 2000, 0])
+        # n * (n + 1) / 2 alignments of the mean length
+        npt.assert_allclose(costs, [6 * 200 ** 2, 3 * 1000 ** 2, 0])
+        npt.assert_array_equal(family_timeouts(costs, 120), [120, 120, 120])
+        # the scaled cost is added to the timeout
+        timeouts = family_timeouts(
+            costs, 120, timeout_scale=1000 * FAMILY_COST_UNIT / costs[1])
+        npt.assert_allclose(timeouts, [120 + 1000 * costs[0] / costs[1],
+                                       1120, 120])
+
+    def test_hash_reference_proteomes(self):
+        """ Test functionality of hash_reference_proteomes()
+        """
+        ref_fps = [self.species_1_fp, self.species_2_fp, self.species_3_fp]
+        digest = hash_reference_proteomes(ref_fps, 'diamond')
+        # independent of the order of the proteomes
+        self.assertEqual(
+            hash_reference_proteomes(ref_fps[::-1], 'diamond'), digest)
+        # depends on the software, the set of proteomes and their content
+        self.assertNotEqual(
+            hash_reference_proteomes(ref_fps, 'blast'), digest)
+        self.assertNotEqual(
+            hash_reference_proteomes(ref_fps[:2], 'diamond'), digest)
+        with open(self.species_3_fp, 'a') as tmp:
+            tmp.write(">G6_SE003\nMKV\n")
+        self.assertNotEqual(
+            hash_reference_proteomes(ref_fps, 'diamond'), digest)
 
     def test_launch_blast(self):
         """Test functionality of launch_blast()
@@ -509,6 +1448,324 @@ class DistanceMethodTests(TestCase):
                     hgt_act.append(line.strip().split()[0])
         self.assertListEqual(hgt_exp, hgt_act)
 
+    def test_distance_method_pass_alignments_jobs(self):
+        """ Test distance_method_main() with alignments and parallel jobs
+        """
+        output_hgt_fp = join(self.working_dir, "hgt_result.txt")
+        distance_method(self.species_1_fp,
+                        self.target_proteomes_dir,
+                        self.working_dir,
+                        output_hgt_fp,
+                        'diamond',
+                        tabular_alignments_fp=self.blast_fp,
+                        jobs=2)
+        hgt_exp = []
+        hgt_act = []
+        with open(output_hgt_fp, 'r') as output_hgt_f:
+            for line in output_hgt_f:
+                if line.startswith('#'):
+                    continue
+                if line not in ['\n', '\r\n']:
+                    hgt_act.append(line.strip().split()[0])
+        self.assertListEqual(hgt_exp, hgt_act)
+        # the workers write the same full distance matrix in place as a
+        # serial run
+        serial_dir = join(self.working_dir, "serial")
+        distance_method(self.species_1_fp,
+                        self.target_proteomes_dir,
+                        serial_dir,
+                        output_hgt_fp,
+                        'diamond',
+                        tabular_alignments_fp=self.blast_fp)
+        for name in (DistanceCheckpoint.distances_name,
+                     DistanceCheckpoint.species_sets_name):
+            npt.assert_array_equal(numpy.load(join(self.working_dir, name)),
+                                   numpy.load(join(serial_dir, name)))
+
+    def test_distance_method_deduplicate(self):
+        """ Test deduplicate_families() and distance_method_main() with
+            duplicate gene families
+        """
+        hits = {'a': ['G1_SE001', 'G1_SE002'], 'b': ['G2_SE001', 'G2_SE002'],
+                'c': ['G1_SE001', 'G1_SE002'], 'd': ['G1_SE002', 'G1_SE001']}
+        ref_db = {'G1_SE001': 'MKV', 'G1_SE002': 'MKL', 'G2_SE001': 'MKV',
+                  'G2_SE002': 'MKL'}
+        gene_map = GeneTable(labels=sorted(ref_db), species=[0, 1, 0, 1],
+                             genes=[0, 0, 1, 1])
+        representatives, groups = deduplicate_families(hits, ref_db,
+                                                       gene_map)
+        # same species and sequences in the same order
+        npt.assert_array_equal(representatives, [0, 3])
+        npt.assert_array_equal(groups, [0, 0, 0, 1])
+        # the family of G1_SE002 has the members of the family of G1_SE001
+        blast_fp = join(self.working_dir, "blast_duplicates.txt")
+        with open(blast_fp, 'w') as blast_f:
+            blast_f.write(blast_alignments)
+            for species in range(1, 5):
+                blast_f.write("G1_SE002   G1_SE00%s    90.00  862 0   0   1 "
+                              "  862 1   862 0\n" % species)
+        for jobs in (1, 2):
+            working_dir = join(self.working_dir, "jobs_%s" % jobs)
+            output_hgt_fp = join(working_dir, "hgt_result.txt")
+            distance_method(self.species_1_fp,
+                            self.target_proteomes_dir,
+                            working_dir,
+                            output_hgt_fp,
+                            'diamond',
+                            tabular_alignments_fp=blast_fp,
+                            jobs=jobs,
+                            report=True,
+                            deduplicate=True)
+            families = pd.read_csv("%s.families.tsv" % output_hgt_fp,
+                                   sep='\t').set_index('query')
+            self.assertEqual(families.loc['G1_SE002', 'duplicate_of'],
+                             'G1_SE001')
+            self.assertEqual(families['duplicate_of'].count(), 1)
+            with open("%s.report.json" % output_hgt_fp) as report_f:
+                report = json.load(report_f)
+            self.assertEqual(report['families']['computed'], 5)
+            self.assertEqual(report['families']['duplicates'], 1)
+            distances = numpy.load(join(working_dir,
+                                        DistanceCheckpoint.distances_name))
+            self.assertEqual(len(distances), 6)
+            npt.assert_array_equal(distances[0], distances[-1])
+        # the same distances without deduplication
+        working_dir = join(self.working_dir, "no_deduplicate")
+        distance_method(self.species_1_fp,
+                        self.target_proteomes_dir,
+                        working_dir,
+                        join(working_dir, "hgt_result.txt"),
+                        'diamond',
+                        tabular_alignments_fp=blast_fp,
+                        deduplicate=False)
+        npt.assert_array_equal(
+            numpy.load(join(working_dir, DistanceCheckpoint.distances_name)),
+            distances)
+
+    def test_distance_method_kmer(self):
+        """ Test distance_method_main() with alignment-free distances and
+            the statistics of the core clusters
+        """
+        output_hgt_fp = join(self.working_dir, "hgt_result.txt")
+        distance_method(self.species_1_fp,
+                        self.target_proteomes_dir,
+                        self.working_dir,
+                        output_hgt_fp,
+                        'diamond',
+                        tabular_alignments_fp=self.blast_fp,
+                        distance_mode='kmer',
+                        kmer_size=3,
+                        outlier_statistics='cluster',
+                        report=True)
+        hgt_act = []
+        with open(output_hgt_fp, 'r') as output_hgt_f:
+            for line in output_hgt_f:
+                if line.startswith('#'):
+                    continue
+                if line not in ['\n', '\r\n']:
+                    hgt_act.append(line.strip().split()[0])
+        self.assertListEqual([], hgt_act)
+        families = pd.read_csv("%s.families.tsv" % output_hgt_fp, sep='\t')
+        self.assertListEqual(list(families['aligner']), ['kmer'] * 5)
+
+    def test_distance_method_online(self):
+        """ Test distance_method_main() with the online outlier detection
+        """
+        output_hgt_fp = join(self.working_dir, "hgt_result.txt")
+        distance_method(self.species_1_fp,
+                        self.target_proteomes_dir,
+                        self.working_dir,
+                        output_hgt_fp,
+                        'diamond',
+                        tabular_alignments_fp=self.blast_fp,
+                        online_outliers=True,
+                        online_warmup=2,
+                        online_refresh_interval=1)
+        with open(output_hgt_fp, 'r') as output_hgt_f:
+            self.assertEqual(output_hgt_f.read(),
+                             "\n# Candidate HGT genes: \n")
+        with open("%s.provisional.txt" % output_hgt_fp) as output_f:
+            lines = output_f.read().splitlines()
+        self.assertTrue(lines[0].startswith('# Provisional'))
+        final = [n for n, line in enumerate(lines)
+                 if line.startswith('# Final')]
+        self.assertEqual(len(final), 1)
+        # there are no HGT candidates, the provisional ones are rejected
+        self.assertListEqual(
+            lines[final[0]+1:],
+            ['%s\trejected' % line.split()[0]
+             for line in lines[1:final[0]]])
+        self.assertRaises(ValueError, distance_method, self.species_1_fp,
+                          self.target_proteomes_dir, self.working_dir,
+                          output_hgt_fp, 'diamond',
+                          state_dir=join(self.working_dir, 'state'),
+                          online_outliers=True)
+
+    def test_distance_method_hits(self):
+        """ Test distance_method_main() with the hit identity distances
+        """
+        output_hgt_fp = join(self.working_dir, "hgt_result.txt")
+        distance_method(self.species_1_fp,
+                        self.target_proteomes_dir,
+                        self.working_dir,
+                        output_hgt_fp,
+                        'diamond',
+                        tabular_alignments_fp=self.blast_fp,
+                        distance_mode='hits',
+                        report=True)
+        hgt_act = []
+        with open(output_hgt_fp, 'r') as output_hgt_f:
+            for line in output_hgt_f:
+                if line.startswith('#'):
+                    continue
+                if line not in ['\n', '\r\n']:
+                    hgt_act.append(line.strip().split()[0])
+        self.assertListEqual([], hgt_act)
+        families = pd.read_csv("%s.families.tsv" % output_hgt_fp, sep='\t')
+        self.assertListEqual(list(families['aligner']), ['hits'] * 5)
+
+    def test_distance_method_hits_query_outside_panel(self):
+        """ Test the hit identity distances of a query proteome that is not
+            one of the reference proteomes
+        """
+        query_fp = join(self.working_dir, "query.fasta")
+        with open(query_fp, 'w') as query_f:
+            query_f.write(species_1.replace('_SE001', '_Q001'))
+        output_hgt_fp = join(self.working_dir, "hgt_result.txt")
+        distance_method(query_fp,
+                        self.target_proteomes_dir,
+                        self.working_dir,
+                        output_hgt_fp,
+                        'diamond',
+                        distance_mode='hits')
+        species_sets = numpy.load(join(self.working_dir,
+                                       DistanceCheckpoint.species_sets_name))
+        self.assertEqual(len(species_sets), 5)
+        # the distances between the homologs come from their own alignments
+        self.assertTrue(species_sets.any(axis=1).all())
+        distances = numpy.load(join(self.working_dir,
+                                    DistanceCheckpoint.distances_name))
+        self.assertTrue((~numpy.isnan(distances)).any(axis=(1, 2)).all())
+
+    def test_distance_method_batch(self):
+        """ Test distance_method_batch() and read_query_genes()
+        """
+        query_genes = read_query_genes([self.species_1_fp,
+                                        self.species_2_fp])
+        self.assertEqual(query_genes['G1_SE001'], 0)
+        self.assertEqual(query_genes['G5_SE002'], 1)
+        self.assertEqual(len(query_genes), 10)
+        self.assertRaises(ValueError, read_query_genes,
+                          [self.species_1_fp, self.species_1_fp])
+        output_dir = join(self.working_dir, "hgt")
+        self.assertRaises(TypeError, distance_method_batch,
+                          [self.species_1_fp], self.target_proteomes_dir,
+                          self.working_dir, output_dir, 'diamond',
+                          unknown_option=True)
+        self.assertRaises(ValueError, distance_method_batch,
+                          [self.species_1_fp, self.species_1_fp],
+                          self.target_proteomes_dir, self.working_dir,
+                          output_dir, 'diamond')
+        output_hgt_fps = distance_method_batch(
+            [self.species_1_fp], self.target_proteomes_dir,
+            self.working_dir, output_dir, 'diamond',
+            tabular_alignments_fp=self.blast_fp)
+        self.assertListEqual(
+            output_hgt_fps, [join(output_dir, "species_1.fasta.hgt.txt")])
+        hgt_act = []
+        with open(output_hgt_fps[0], 'r') as output_hgt_f:
+            for line in output_hgt_f:
+                if line.startswith('#'):
+                    continue
+                if line not in ['\n', '\r\n']:
+                    hgt_act.append(line.strip().split()[0])
+        self.assertListEqual([], hgt_act)
+
+    def test_update_distance_method(self):
+        """ Test update_distance_method() on an unchanged and a smaller panel
+        """
+        state_dir = join(self.working_dir, "state")
+        output_hgt_fp = join(self.working_dir, "hgt_result.txt")
+        summary = update_distance_method(self.species_1_fp,
+                                         self.target_proteomes_dir,
+                                         self.working_dir,
+                                         state_dir,
+                                         output_hgt_fp,
+                                         'diamond')
+        self.assertDictEqual(summary, {'added': 4, 'removed': 0, 'kept': 0,
+                                       'reused': 0, 'computed': 5})
+        with open(output_hgt_fp, 'r') as output_hgt_f:
+            hgt_first = output_hgt_f.read()
+        # nothing to search nor to align again
+        summary = update_distance_method(self.species_1_fp,
+                                         self.target_proteomes_dir,
+                                         self.working_dir,
+                                         state_dir,
+                                         output_hgt_fp,
+                                         'diamond')
+        self.assertDictEqual(summary, {'added': 0, 'removed': 0, 'kept': 4,
+                                       'reused': 5, 'computed': 0})
+        with open(output_hgt_fp, 'r') as output_hgt_f:
+            self.assertEqual(output_hgt_f.read(), hgt_first)
+        # every family has a homolog in the removed proteome
+        remove(self.species_4_fp)
+        self.files_to_remove.remove(self.species_4_fp)
+        summary = update_distance_method(self.species_1_fp,
+                                         self.target_proteomes_dir,
+                                         self.working_dir,
+                                         state_dir,
+                                         output_hgt_fp,
+                                         'diamond',
+                                         min_num_homologs=2)
+        self.assertDictEqual(summary, {'added': 0, 'removed': 1, 'kept': 3,
+                                       'reused': 0, 'computed': 5})
+        self.assertListEqual(sorted(listdir(state_dir)),
+                             ['alignments', 'generation_1', 'state.json'])
+        self.assertEqual(len(listdir(join(state_dir, 'alignments'))), 3)
+
+    def test_update_distance_method_interrupted(self):
+        """ Test update_distance_method() after an interrupted update
+        """
+        state_dir = join(self.working_dir, "state")
+        output_hgt_fp = join(self.working_dir, "hgt_result.txt")
+        update_distance_method(self.species_1_fp, self.target_proteomes_dir,
+                               self.working_dir, state_dir, output_hgt_fp,
+                               'diamond')
+        # the update of a panel with a modified proteome is interrupted once
+        # its gene families are computed
+        with open(self.species_4_fp, 'w') as tmp:
+            tmp.write('\n'.join(line if line.startswith('>') else line[::-1]
+                                for line in species_4.splitlines()))
+        with mock.patch('horizomer.distance_method.detect_hgt_genes',
+                        side_effect=RuntimeError('interrupted')):
+            self.assertRaises(RuntimeError, update_distance_method,
+                              self.species_1_fp, self.target_proteomes_dir,
+                              self.working_dir, state_dir, output_hgt_fp,
+                              'diamond')
+        # the next update of another panel has the same generation but does
+        # not resume the families of the interrupted one
+        with open(self.species_4_fp, 'w') as tmp:
+            tmp.write(species_4 + '\n')
+        summary = update_distance_method(self.species_1_fp,
+                                         self.target_proteomes_dir,
+                                         self.working_dir, state_dir,
+                                         output_hgt_fp, 'diamond')
+        self.assertDictEqual(summary, {'added': 1, 'removed': 1, 'kept': 3,
+                                       'reused': 0, 'computed': 5})
+        fresh_state_dir = join(self.working_dir, "fresh_state")
+        fresh_output_hgt_fp = join(self.working_dir, "fresh_hgt_result.txt")
+        update_distance_method(self.species_1_fp, self.target_proteomes_dir,
+                               self.working_dir, fresh_state_dir,
+                               fresh_output_hgt_fp, 'diamond')
+        npt.assert_array_equal(
+            numpy.load(join(state_dir, 'generation_1',
+                            DistanceCheckpoint.distances_name)),
+            numpy.load(join(fresh_state_dir, 'generation_0',
+                            DistanceCheckpoint.distances_name)))
+        with open(output_hgt_fp) as output_f, \
+                open(fresh_output_hgt_fp) as fresh_output_f:
+            self.assertEqual(output_f.read(), fresh_output_f.read())
+
 
 phylip_output = """    4
 2_1         0.000000  0.379562  0.473355  0.521700
@@ -516,6 +1773,15 @@ phylip_output = """    4
 0_1         0.473355  0.587981  0.000000  0.722046
 1_1         0.521700  0.660393  0.722046  0.000000
 """
+phylip_alignment = """ 3 12
+0_1       ACDEFGHIKL
+1_1       ACDEFGHIKV
+2_1       AC-EFGHMKV
+
+          MN
+          MN
+          MY
+"""
 
 blast_alignments = """G1_SE001    G1_SE001    100.00  862 0   0   1   862 1  \
  862 0.0  1803   100
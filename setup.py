@@ -21,9 +21,9 @@ classes = """
     Topic :: Software Development :: Libraries :: Application Frameworks
     Topic :: Software Development :: Libraries :: Python Modules
     Programming Language :: Python
-    Programming Language :: Python :: 3.4
-    Programming Language :: Python :: 3.5
-    Programming Language :: Python :: 3.6
+    Programming Language :: Python :: 3.7
+    Programming Language :: Python :: 3.8
+    Programming Language :: Python :: 3.9
     Programming Language :: Python :: Implementation :: CPython
     Operating System :: POSIX :: Linux
     Operating System :: MacOS :: MacOS X
@@ -49,6 +49,7 @@ setup(name='horizomer',
       url='https://github.com/biocore/horizomer',
       test_suite='nose.collector',
       packages=find_packages(),
+      python_requires='>=3.7',
       install_requires=[
           'click >= 6.0',
           'scikit-bio >= 0.5.1',